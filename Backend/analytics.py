@@ -0,0 +1,78 @@
+"""Vectorised transaction analytics for the Kashela API.
+
+Server-side equivalents of ``calculateTotals``, ``groupByCategory`` and
+``groupByTimePeriod`` in frontend/src/utils/analytics.js, computed with
+NumPy array grouping instead of per-row reductions.
+"""
+
+from typing import Iterable
+
+import numpy as np
+
+def period_buckets(days: np.ndarray, period: str) -> np.ndarray:
+    """Map ``datetime64[D]`` dates to the first day of their bucket"""
+    if period == "monthly":
+        return days.astype("datetime64[M]").astype("datetime64[D]")
+    if period == "weekly":
+        # 1970-01-01 was a Thursday; shift so weeks start on Monday
+        weekday = (days.astype(np.int64) + 3) % 7
+        return days - weekday.astype("timedelta64[D]")
+    return days
+
+
+def bucket_label(day: np.datetime64, period: str) -> str:
+    """Format a bucket the way the frontend keys it"""
+    label = str(day)
+    return label[:7] if period == "monthly" else label
+
+
+def totals(income: float, expenses: float) -> dict:
+    return {
+        "total_income": round(income, 2),
+        "total_expenses": round(expenses, 2),
+        "net_balance": round(income - expenses, 2),
+        "profit_margin": round((income - expenses) / income * 100, 2) if income else 0.0
+    }
+
+
+def summarize(rows: Iterable[dict], period: str = "daily", category_type: str = "expense") -> dict:
+    """Totals, per-category sums and per-period income/expense buckets.
+
+    Anything that is not ``income`` counts as an expense, as on the frontend.
+    """
+    rows = list(rows)
+    if not rows:
+        return {"count": 0, "totals": totals(0.0, 0.0), "categories": {}, "periods": []}
+
+    amounts = np.fromiter((row["amount"] or 0 for row in rows), dtype=np.float64, count=len(rows))
+    is_income = np.fromiter((row["type"] == "income" for row in rows), dtype=bool, count=len(rows))
+    categories = np.array([row["category"] or "" for row in rows], dtype=object)
+    days = np.array([str(row["date"])[:10] for row in rows], dtype="datetime64[D]")
+
+    income = np.where(is_income, amounts, 0.0)
+    expenses = amounts - income
+
+    selected = is_income if category_type == "income" else ~is_income
+    names, category_index = np.unique(categories[selected].astype(str), return_inverse=True)
+    category_sums = np.bincount(category_index, weights=amounts[selected], minlength=len(names))
+
+    buckets, bucket_index = np.unique(period_buckets(days, period), return_inverse=True)
+    income_sums = np.bincount(bucket_index, weights=income, minlength=len(buckets))
+    expense_sums = np.bincount(bucket_index, weights=expenses, minlength=len(buckets))
+
+    return {
+        "count": len(rows),
+        "totals": totals(float(income.sum()), float(expenses.sum())),
+        "categories": {
+            str(name): round(float(total), 2) for name, total in zip(names, category_sums)
+        },
+        "periods": [
+            {
+                "date": bucket_label(bucket, period),
+                "income": round(float(inc), 2),
+                "expenses": round(float(exp), 2)
+            }
+            for bucket, inc, exp in zip(buckets, income_sums, expense_sums)
+        ]
+    }
+
@@ -0,0 +1,184 @@
+"""Content-addressed, deduplicating file storage for uploads."""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime
+from typing import BinaryIO, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FileTooLarge(Exception):
+    """Raised when an upload exceeds the store's size limit"""
+
+
+class BlobStore:
+    """Files stored once by SHA-256, with a per-user index of names.
+
+    Blobs live at ``<root>/ab/cd/<sha256>``; the two levels of sharding keep
+    directories small. An SQLite index at ``index_path`` maps the names each
+    user uploaded under to blob hashes, so identical uploads share one blob.
+    Each upload writes one index row, and every worker process on the host
+    can share the index. Per-user JSON indexes left by earlier versions in
+    the directory named like ``index_path`` without its extension are
+    imported on first use. Blobs are never removed.
+    """
+
+    def __init__(self, root: str, index_path: str):
+        self.root = root
+        self.index_path = index_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def variant_path(self, sha256: str, variant: str) -> str:
+        return os.path.join(self.root, "variants", sha256[:2], sha256[2:4], f"{sha256}_{variant}.jpg")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.index_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.index_path, check_same_thread=False, isolation_level=None, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                " user_id TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " entry TEXT NOT NULL,"
+                " PRIMARY KEY (user_id, name))"
+            )
+            self._import_json_indexes(conn, os.path.splitext(self.index_path)[0])
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _import_json_indexes(conn: sqlite3.Connection, index_dir: str) -> None:
+        """Move entries from the per-user JSON files an older version kept in ``index_dir``"""
+        for path in glob.glob(os.path.join(index_dir, "*.json")):
+            try:
+                with open(path) as f:
+                    index = json.load(f)
+            except ValueError:
+                logger.warning(f"Skipping unreadable upload index {path}")
+                continue
+            # Files are named by a hash of the user ID; uploads are named "<user ID>_..."
+            stem = os.path.splitext(os.path.basename(path))[0]
+            rows = [
+                (name.split("_", 1)[0], name, json.dumps(entry)) for name, entry in index.items()
+                if hashlib.sha256(name.split("_", 1)[0].encode()).hexdigest()[:32] == stem
+            ]
+            conn.executemany("INSERT OR IGNORE INTO uploads (user_id, name, entry) VALUES (?, ?, ?)", rows)
+            os.replace(path, f"{path}.imported")
+            logger.info(f"Imported {len(rows)} upload index entries from {path}")
+
+    def put(
+        self,
+        user_id: str,
+        name: str,
+        source: BinaryIO,
+        kind: str,
+        content_type: Optional[str],
+        max_size: Optional[int] = None,
+        scrub: Optional[Callable[[str], bool]] = None
+    ) -> dict:
+        """Stream ``source`` into the store, hashing as it is written.
+
+        ``scrub`` may rewrite the received file before it is stored, e.g. to
+        drop metadata, returning True if it did; the blob is keyed by the
+        scrubbed contents. Blocking; call from a worker thread.
+
+        Returns:
+            dict: The index entry, plus ``duplicate`` when the blob already existed
+
+        Raises:
+            FileTooLarge: Once more than ``max_size`` bytes are read; nothing is stored
+        """
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise FileTooLarge(f"File exceeds {max_size} bytes")
+                    digest.update(chunk)
+                    out.write(chunk)
+
+            if scrub is not None and scrub(tmp):
+                digest = hashlib.sha256()
+                with open(tmp, "rb") as scrubbed:
+                    for chunk in iter(lambda: scrubbed.read(CHUNK_SIZE), b""):
+                        digest.update(chunk)
+                size = os.path.getsize(tmp)
+            sha256 = digest.hexdigest()
+            path = self.path(sha256)
+            duplicate = os.path.exists(path)
+            if duplicate:
+                os.remove(tmp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        entry = {
+            "sha256": sha256,
+            "size": size,
+            "kind": kind,
+            "content_type": content_type,
+            "uploaded_at": datetime.now().isoformat()
+        }
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO uploads (user_id, name, entry) VALUES (?, ?, ?)",
+                (user_id, name, json.dumps(entry))
+            )
+        return {**entry, "duplicate": duplicate}
+
+    def lookup(self, user_id: str, name: str) -> Optional[dict]:
+        """The index entry for one of a user's uploads"""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT entry FROM uploads WHERE user_id = ? AND name = ?", (user_id, name)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, user_id: str, name: str, **fields) -> None:
+        """Merge ``fields`` into one of a user's index entries"""
+        with self._lock:
+            conn = self._connect()
+            # Read and write in one transaction so other processes cannot interleave
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT entry FROM uploads WHERE user_id = ? AND name = ?", (user_id, name)
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE uploads SET entry = ? WHERE user_id = ? AND name = ?",
+                        (json.dumps({**json.loads(row[0]), **fields}), user_id, name)
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
@@ -0,0 +1,219 @@
+"""Durable queue for inbound M-PESA callbacks.
+
+Callbacks are appended to a SQLite database in WAL mode as soon as they
+arrive, so the endpoint can acknowledge Safaricom immediately. A pool of
+background workers claims pending rows in batches, hands them to an
+``apply`` coroutine and deletes them once applied. Rows claimed by a
+worker that never finished (e.g. the process crashed) are put back on
+the queue when it starts again.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PENDING = 0
+CLAIMED = 1
+DEAD = 2
+
+
+class CallbackQueue:
+    """Append-only SQLite queue drained by a pool of async workers"""
+
+    def __init__(
+        self,
+        path: str,
+        apply: Callable[[List[dict]], Awaitable[None]],
+        workers: int = 2,
+        batch_size: int = 100,
+        poll_interval: float = 1.0,
+        retry_delay: float = 1.0
+    ):
+        self.path = path
+        self.apply = apply
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._depth = 0
+
+        self.received = 0
+        self.applied = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.dead = 0
+        self._started_at: Optional[float] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL survives process crashes; only power loss can drop the tail
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS callbacks ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " payload TEXT NOT NULL,"
+                " received_at REAL NOT NULL,"
+                " state INTEGER NOT NULL DEFAULT 0,"
+                " attempts INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS callbacks_state ON callbacks (state, id)")
+            self._depth = conn.execute(
+                "SELECT COUNT(*) FROM callbacks WHERE state != ?", (DEAD,)
+            ).fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def append(self, payload: str) -> int:
+        """Durably store a raw callback body and wake a worker"""
+        with self._lock:
+            cursor = self._connect().execute(
+                "INSERT INTO callbacks (payload, received_at) VALUES (?, ?)",
+                (payload, time.time())
+            )
+            self._depth += 1
+        self.received += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return cursor.lastrowid
+
+    def recover(self) -> int:
+        """Return rows claimed before a crash to the queue"""
+        with self._lock:
+            cursor = self._connect().execute(
+                "UPDATE callbacks SET state = ? WHERE state = ?", (PENDING, CLAIMED)
+            )
+        return cursor.rowcount
+
+    def _claim(self) -> List[Tuple[int, str]]:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT id, payload FROM callbacks WHERE state = ? ORDER BY id LIMIT ?",
+                    (PENDING, self.batch_size)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE callbacks SET state = ?, attempts = attempts + 1 WHERE id = ?",
+                    [(CLAIMED, row[0]) for row in rows]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def _finish(self, done: List[int], dead: List[int]) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("DELETE FROM callbacks WHERE id = ?", [(i,) for i in done])
+            conn.executemany("UPDATE callbacks SET state = ? WHERE id = ?", [(DEAD, i) for i in dead])
+            conn.execute("COMMIT")
+            self._depth -= len(done) + len(dead)
+
+    def _release(self, ids: List[int]) -> None:
+        with self._lock:
+            self._connect().executemany(
+                "UPDATE callbacks SET state = ? WHERE id = ?", [(PENDING, i) for i in ids]
+            )
+
+    async def drain_once(self) -> int:
+        """Claim and apply one batch; returns the number of callbacks processed"""
+        rows = await asyncio.to_thread(self._claim)
+        if not rows:
+            return 0
+
+        payloads, done, dead = [], [], []
+        for row_id, raw in rows:
+            try:
+                payloads.append(json.loads(raw))
+                done.append(row_id)
+            except ValueError:
+                logger.error("Discarding malformed M-PESA callback %s", row_id)
+                dead.append(row_id)
+
+        try:
+            if payloads:
+                await self.apply(payloads)
+        except Exception as e:
+            self.failed_batches += 1
+            logger.error("Failed to apply %d M-PESA callbacks: %s", len(payloads), e)
+            await asyncio.to_thread(self._release, done)
+            await asyncio.to_thread(self._finish, [], dead)
+            self.dead += len(dead)
+            raise
+
+        await asyncio.to_thread(self._finish, done, dead)
+        self.batches += 1
+        self.applied += len(done)
+        self.dead += len(dead)
+        return len(rows)
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                if await self.drain_once():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await asyncio.sleep(self.retry_delay)
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        """Replay anything left over from a previous run and start the workers"""
+        if self._tasks:
+            return
+        recovered = await asyncio.to_thread(self.recover)
+        if recovered:
+            logger.info("Replaying %d M-PESA callbacks claimed before restart", recovered)
+        self._wakeup = asyncio.Event()
+        self._started_at = time.monotonic()
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Stop the workers; unfinished batches are replayed on next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wakeup = None
+
+    def close(self) -> None:
+        """Close the underlying database"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        """Return queue depth and throughput counters"""
+        uptime = time.monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            "depth": self._depth,
+            "received": self.received,
+            "applied": self.applied,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "dead": self.dead,
+            "workers": len(self._tasks),
+            "applied_per_second": round(self.applied / uptime, 1) if uptime else 0.0
+        }
@@ -0,0 +1,106 @@
+"""Circuit breaker that stops sending queries to a database that is down."""
+
+import logging
+import math
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    """The circuit is open, so the call was refused without being attempted"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Database unavailable; retrying in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class CircuitBreaker:
+    """Fails fast after repeated outages, then probes for recovery.
+
+    ``failure_threshold`` consecutive failures open the circuit: calls are
+    refused with ``CircuitOpen`` for ``reset_timeout`` seconds. After that it
+    is half-open: one call goes through as a probe while the others are still
+    refused. A successful probe closes the circuit; a failed one opens it for
+    another ``reset_timeout``.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+        self.opened = 0
+        self.rejected = 0
+        self.probes = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def before(self) -> bool:
+        """Admit a call or raise ``CircuitOpen``; True if the call is the probe"""
+        state = self.state
+        if state == self.CLOSED:
+            return False
+        if state == self.HALF_OPEN and not self._probing:
+            self._state = self.HALF_OPEN
+            self._probing = True
+            self.probes += 1
+            return True
+        self.rejected += 1
+        raise CircuitOpen(max(0.0, self._opened_at + self.reset_timeout - self._clock()))
+
+    def success(self) -> None:
+        """The database answered"""
+        self._failures = 0
+        self._probing = False
+        if self._state != self.CLOSED:
+            logger.info("Database reachable again, closing circuit")
+            self._state = self.CLOSED
+
+    def failure(self) -> None:
+        """The database could not be reached or did not answer in time"""
+        self._probing = False
+        if self._state == self.OPEN:
+            # A call admitted before the circuit opened
+            return
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            logger.warning(f"Database unavailable after {self._failures} failures, opening circuit")
+            self._state = self.OPEN
+            self._opened_at = self._clock()
+            self.opened += 1
+
+    def release(self) -> None:
+        """Free the probe slot of a call that ended without reaching the database"""
+        self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "probes": self.probes
+        }
@@ -24,6 +24,18 @@ class Settings(BaseModel):
     JWT_SECRET_KEY: str = os.getenv("JWT_SECRET_KEY", "your-secret-key")
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    TOKEN_CACHE_SIZE: int = 10000  # verified tokens kept in memory
+
+    # Rate Limit Settings
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    RATE_LIMIT_REDIS_URL: str = os.getenv("RATE_LIMIT_REDIS_URL", "")  # share buckets between workers
+    RATE_LIMIT_TRUST_PROXY: bool = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"  # client IP from X-Forwarded-For
+    LOGIN_RATE_LIMIT: int = 10  # attempts per minute per IP
+    LOGIN_BURST: int = 5
+    PAYMENT_RATE_LIMIT: int = 10  # payment requests per minute per user
+    PAYMENT_BURST: int = 5
+    PAYMENT_IP_RATE_LIMIT: int = 60  # per IP, allowing for several users behind one NAT
+    PAYMENT_IP_BURST: int = 20
     
     # CORS Settings
     CORS_ORIGINS: List[str] = [
@@ -38,15 +50,53 @@ class Settings(BaseModel):
     STATIC_DIR: str = "static"
     UPLOAD_DIR: str = "uploads"
     LOGS_DIR: str = "logs"
+    DATA_DIR: str = "data"
     
     # M-PESA Settings
     MPESA_CONSUMER_KEY: str = os.getenv("MPESA_CONSUMER_KEY", "")
     MPESA_CONSUMER_SECRET: str = os.getenv("MPESA_CONSUMER_SECRET", "")
     MPESA_SHORTCODE: str = os.getenv("MPESA_SHORTCODE", "")
     MPESA_PASSKEY: str = os.getenv("MPESA_PASSKEY", "")
+    MPESA_BASE_URL: str = os.getenv("MPESA_BASE_URL", "https://sandbox.safaricom.co.ke")
+    MPESA_TOKEN_REFRESH_MARGIN: int = 60  # seconds before expiry to renew the token
+    MPESA_MAX_CONNECTIONS: int = 20
+    MPESA_MAX_CONCURRENCY: int = 10
+    MPESA_TIMEOUT: float = 10.0  # seconds per Daraja call
+    MPESA_RETRIES: int = 2
+    MPESA_CALLBACK_WORKERS: int = 2
+    MPESA_CALLBACK_BATCH_SIZE: int = 100
+    PAYMENT_CACHE_SIZE: int = 10000  # payments kept in memory for status polls
+    PAYMENT_WAIT_TIMEOUT: float = 30.0  # longest a status request may be held open
+    PAYMENT_PENDING_TTL: float = 2.0  # seconds a pending payment is served from memory before re-reading it
+    IDEMPOTENCY_TTL: int = 600  # seconds a payment result is replayed to duplicates
+    IDEMPOTENCY_WINDOW: int = 30  # seconds in which keyless identical payments are deduplicated
+    MPESA_BATCH_MAX_SIZE: int = 100
+    MPESA_BATCH_CONCURRENCY: int = 5  # concurrent STK pushes per batch request
+    
+    # Database Settings
+    DB_POOL_SIZE: int = 10  # queries in flight at once
+    DB_POOL_TIMEOUT: float = 5.0  # seconds to wait for a free slot
+    DB_QUERY_TIMEOUT: float = 10.0  # seconds per query
+    CIRCUIT_FAILURE_THRESHOLD: int = 5  # consecutive outages before queries are refused
+    CIRCUIT_RESET_TIMEOUT: float = 30.0  # seconds before a probe query is let through
+    DATABASE_BACKEND: str = os.getenv("DATABASE_BACKEND", "auto")  # supabase, sqlite, or auto: sqlite without Supabase credentials
+    SQLITE_PATH: str = os.getenv("SQLITE_PATH", os.path.join("data", "kashela.db"))
+    
+    # Health Check Settings
+    HEALTH_CHECK_INTERVAL: float = 30.0  # seconds between background probes
+    HEALTH_CHECK_TIMEOUT: float = 5.0  # seconds per probe
+    HEALTH_MIN_FREE_DISK_MB: int = 500  # upload volume space below which it is unhealthy
+    
+    # Transaction Import Settings
+    IMPORT_BATCH_SIZE: int = 500  # rows inserted per round-trip
+    IMPORT_MAX_BATCH_SIZE: int = 1000
+    RESPONSE_CACHE_SIZE: int = 5000  # cached transaction reads across all users
     
     # File Upload Settings
     MAX_UPLOAD_SIZE: int = 5 * 1024 * 1024  # 5MB
+    UPLOAD_SESSION_TTL: int = 24 * 3600  # seconds an idle resumable upload is kept
+    UPLOAD_SESSION_CLEANUP_INTERVAL: int = 3600  # seconds between sweeps for expired sessions
+    IMAGE_WORKERS: int = min(2, os.cpu_count() or 1)  # processes rendering image variants, at most one per CPU
     ALLOWED_IMAGE_TYPES: List[str] = ["image/jpeg", "image/png", "image/gif"]
     ALLOWED_AUDIO_TYPES: List[str] = ["audio/mpeg", "audio/wav", "audio/ogg"]
 
@@ -64,6 +114,7 @@ for directory in [
     settings.UPLOAD_DIR,
     os.path.join(settings.UPLOAD_DIR, "audio"),
     os.path.join(settings.UPLOAD_DIR, "images"),
-    settings.LOGS_DIR
+    settings.LOGS_DIR,
+    settings.DATA_DIR
 ]:
     os.makedirs(directory, exist_ok=True) 
\ No newline at end of file
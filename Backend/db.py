@@ -1,16 +1,276 @@
 from supabase import create_client, Client
+from postgrest import AsyncPostgrestClient
+from httpx import AsyncClient, Limits, TransportError
+import asyncio
 import os
+import time
 from functools import lru_cache
+from typing import Any, Callable, Optional
 import logging
+from circuit_breaker import CircuitBreaker, CircuitOpen
+from config import settings
+from sqlite_store import SQLiteStore
 
 logger = logging.getLogger(__name__)
 
+
+def use_sqlite() -> bool:
+    """Whether data lives in the embedded SQLite store rather than Supabase"""
+    backend = settings.DATABASE_BACKEND.lower()
+    if backend == "sqlite":
+        return True
+    if backend == "supabase":
+        return False
+    return not (os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY"))
+
+
+@lru_cache()
+def get_sqlite() -> SQLiteStore:
+    """Get the embedded store, creating the database file on first use"""
+    logger.info(f"Using embedded SQLite storage at {settings.SQLITE_PATH}")
+    return SQLiteStore(settings.SQLITE_PATH)
+
+
 @lru_cache()
 def get_supabase() -> Client:
-    """Get cached Supabase client instance"""
+    """Get cached Supabase client instance, or the SQLite store offline"""
+    if use_sqlite():
+        return get_sqlite()
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_KEY")
+    if not url or not key:
+        logger.warning("Supabase credentials not found!")
+        return None
+    return create_client(url, key)
+
+
+class PoolTimeout(Exception):
+    """No database connection became free in time"""
+
+
+class QueryTimeout(Exception):
+    """A query took longer than the per-query timeout"""
+
+
+def is_outage(e: Exception) -> bool:
+    """Whether a failure means the database could not be reached or answer in time"""
+    return isinstance(e, (CircuitOpen, QueryTimeout, TransportError, ConnectionError, TimeoutError))
+
+
+class PooledPostgrestClient(AsyncPostgrestClient):
+    """Async PostgREST client whose HTTP pool holds at most ``max_connections``"""
+
+    def __init__(self, base_url: str, max_connections: int, **kwargs):
+        self.max_connections = max_connections
+        super().__init__(base_url, **kwargs)
+
+    def create_session(self, base_url, headers, timeout) -> AsyncClient:
+        return AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            limits=Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        )
+
+
+class PooledQuery:
+    """A query builder whose ``execute`` runs through the database's pool.
+
+    Filter and modifier calls are passed to the wrapped builder, so routes
+    build queries exactly as with the Supabase client and then
+    ``await query.execute()``.
+    """
+
+    def __init__(self, database: "Database", builder):
+        self._database = database
+        self._builder = builder
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return PooledQuery(self._database, result) if hasattr(result, "execute") else result
+        return call
+
+    async def execute(self):
+        return await self._database.run(self._builder)
+
+
+class Database:
+    """Async data access with a bounded pool, query timeouts and metrics.
+
+    ``connect`` builds the underlying client: the async PostgREST client
+    in production, or any object with the Supabase ``table()`` builder API,
+    such as a local stand-in. Builders with a synchronous ``execute`` run in
+    worker threads, so neither kind blocks the event loop.
+
+    At most ``pool_size`` queries run at once; others wait up to
+    ``acquire_timeout`` for a slot before failing with ``PoolTimeout``.
+    Outages are reported to ``breaker``, which then refuses queries with
+    ``CircuitOpen`` instead of letting each one wait for its timeout.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        pool_size: int = 10,
+        query_timeout: float = 10.0,
+        acquire_timeout: float = 5.0,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self._connect = connect
+        self.pool_size = pool_size
+        self.query_timeout = query_timeout
+        self.acquire_timeout = acquire_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._client = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.queries = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.peak_in_use = 0
+        self.peak_waiting = 0
+        self.waited = 0
+        self.wait_time = 0.0
+        self.pool_timeouts = 0
+        self.query_timeouts = 0
+        self.failures = 0
+
+    def client(self):
+        if self._client is None:
+            self._client = self._connect()
+        return self._client
+
+    def _pool(self) -> asyncio.Semaphore:
+        # Semaphores are bound to the event loop that first uses them
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.pool_size)
+            self._loop = loop
+        return self._semaphore
+
+    def table(self, name: str) -> PooledQuery:
+        return PooledQuery(self, self.client().table(name))
+
+    async def _acquire(self, pool: asyncio.Semaphore) -> None:
+        if not pool.locked():
+            await pool.acquire()
+            return
+        self.waited += 1
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(pool.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.pool_timeouts += 1
+            raise PoolTimeout(f"No database connection free after {self.acquire_timeout}s")
+        finally:
+            self.waiting -= 1
+            self.wait_time += time.perf_counter() - started
+
+    async def run(self, builder):
+        """Execute a query builder through the pool
+
+        Raises:
+            CircuitOpen: The database is considered down
+            PoolTimeout: The pool stayed full for ``acquire_timeout``
+            QueryTimeout: The query ran past ``query_timeout``
+        """
+        probe = self.breaker.before()
+        try:
+            pool = self._pool()
+            await self._acquire(pool)
+            self.queries += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            try:
+                if asyncio.iscoroutinefunction(builder.execute):
+                    call = builder.execute()
+                else:
+                    # A timed-out thread finishes in the background, but its slot is released
+                    call = asyncio.to_thread(builder.execute)
+                result = await asyncio.wait_for(call, self.query_timeout)
+            except asyncio.TimeoutError:
+                self.query_timeouts += 1
+                self.breaker.failure()
+                raise QueryTimeout(f"Query exceeded {self.query_timeout}s")
+            except Exception as e:
+                self.failures += 1
+                # Errors the database itself returned show it is reachable
+                if is_outage(e):
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                raise
+            finally:
+                self.in_use -= 1
+                pool.release()
+            self.breaker.success()
+            return result
+        finally:
+            if probe:
+                self.breaker.release()
+
+    async def aclose(self) -> None:
+        client, self._client = self._client, None
+        if client is not None and hasattr(client, "aclose"):
+            await client.aclose()
+
+    def stats(self) -> dict:
+        """Pool occupancy and saturation counters"""
+        return {
+            "pool_size": self.pool_size,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "peak_in_use": self.peak_in_use,
+            "peak_waiting": self.peak_waiting,
+            "queries": self.queries,
+            "waited": self.waited,
+            "avg_wait_ms": round(self.wait_time / self.waited * 1000, 2) if self.waited else 0.0,
+            "pool_timeouts": self.pool_timeouts,
+            "query_timeouts": self.query_timeouts,
+            "failures": self.failures,
+            "circuit": self.breaker.stats()
+        }
+
+
+@lru_cache()
+def get_database() -> Optional[Database]:
+    """Get the shared async database, or None without any storage configured"""
+    breaker = CircuitBreaker(settings.CIRCUIT_FAILURE_THRESHOLD, settings.CIRCUIT_RESET_TIMEOUT)
+    if use_sqlite():
+        return Database(
+            get_sqlite,
+            pool_size=settings.DB_POOL_SIZE,
+            query_timeout=settings.DB_QUERY_TIMEOUT,
+            acquire_timeout=settings.DB_POOL_TIMEOUT,
+            breaker=breaker
+        )
     url = os.getenv("SUPABASE_URL")
     key = os.getenv("SUPABASE_KEY")
     if not url or not key:
         logger.warning("Supabase credentials not found!")
         return None
-    return create_client(url, key) 
\ No newline at end of file
+    return Database(
+        lambda: PooledPostgrestClient(
+            f"{url}/rest/v1",
+            max_connections=settings.DB_POOL_SIZE,
+            headers={
+                "apikey": key,
+                "Authorization": f"Bearer {key}",
+                "Accept": "application/json",
+                "Content-Type": "application/json"
+            },
+            timeout=settings.DB_QUERY_TIMEOUT
+        ),
+        pool_size=settings.DB_POOL_SIZE,
+        query_timeout=settings.DB_QUERY_TIMEOUT,
+        acquire_timeout=settings.DB_POOL_TIMEOUT,
+        breaker=breaker
+    )
@@ -0,0 +1,157 @@
+"""File responses with byte ranges, strong ETags and cache headers."""
+
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Iterable, Iterator, Mapping, Optional, Tuple
+
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.datastructures import Headers
+from starlette.staticfiles import StaticFiles
+
+CHUNK_SIZE = 64 * 1024
+# Uploads are never modified in place
+IMMUTABLE = "max-age=31536000, immutable"
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested range lies entirely past the end of the file"""
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Resolve a ``Range`` header to one inclusive ``(start, end)`` byte span.
+
+    Returns None when the header should be ignored and the whole file sent:
+    other units, multiple ranges or malformed values.
+
+    Raises:
+        RangeNotSatisfiable: When the range starts at or past ``size``
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = (part.strip() for part in spec.partition("-"))
+    if not dash or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        # Suffix range: the final N bytes
+        if int(last) == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def iter_file(path: str, start: int, end: int) -> Iterator[bytes]:
+    """Read ``path`` from ``start`` to ``end`` inclusive in chunks"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match uses"""
+    tags = [tag.strip() for tag in header.split(",")]
+    tags = [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+    return "*" in tags or etag in tags
+
+
+def _if_range_allows(header: Optional[str], etag: str, stat_result: os.stat_result) -> bool:
+    """Whether a conditional range request still refers to this representation"""
+    if header is None:
+        return True
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"):
+        # Range requests need a strong match
+        return header == etag
+    try:
+        return int(stat_result.st_mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def file_response(
+    request_headers: Mapping[str, str],
+    path: str,
+    media_type: Optional[str] = None,
+    etag: Optional[str] = None,
+    cache_control: str = "no-cache",
+    stat_result: Optional[os.stat_result] = None,
+    method: str = "GET"
+) -> Response:
+    """Serve ``path`` honouring ``If-None-Match``, ``Range`` and ``If-Range``.
+
+    ``etag`` should be a content hash when one is known; otherwise one is
+    derived from the file's modification time and size.
+    """
+    stat_result = stat_result or os.stat(path)
+    size = stat_result.st_size
+    etag = f'"{etag}"' if etag else f'"{stat_result.st_mtime_ns:x}-{size:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes"
+    }
+
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request_headers.get("range")
+    if range_header and _if_range_allows(request_headers.get("if-range"), etag, stat_result):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+            return StreamingResponse(
+                iter_file(path, start, end) if method != "HEAD" else iter(()),
+                status_code=206,
+                media_type=media_type,
+                headers={
+                    **headers,
+                    "Content-Range": f"bytes {start}-{end}/{size}",
+                    "Content-Length": str(end - start + 1)
+                }
+            )
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result, method=method)
+
+
+class UploadStaticFiles(StaticFiles):
+    """StaticFiles for the uploads directory, with ranges and immutable caching.
+
+    Top-level directories named in ``private`` are never served; their
+    files are only reachable through authenticated routes.
+    """
+
+    def __init__(self, *args, private: Iterable[str] = (), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.private = set(private)
+
+    def lookup_path(self, path: str) -> Tuple[str, Optional[os.stat_result]]:
+        if path.split(os.sep, 1)[0] in self.private:
+            return "", None
+        return super().lookup_path(path)
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        return file_response(
+            Headers(scope=scope),
+            str(full_path),
+            cache_control=f"public, {IMMUTABLE}",
+            stat_result=stat_result,
+            method=scope["method"]
+        )
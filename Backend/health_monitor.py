@@ -0,0 +1,116 @@
+"""Background health probes whose latest results are served from memory."""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+HEALTHY = "healthy"
+UNHEALTHY = "unhealthy"
+UNCONFIGURED = "unconfigured"
+
+
+class NotConfigured(Exception):
+    """The dependency is not set up in this deployment, so it is not checked"""
+
+
+class HealthMonitor:
+    """Runs health probes on an interval and keeps their latest results.
+
+    A probe is a coroutine function that raises when its dependency is
+    unhealthy and may return details to report. Probes run concurrently,
+    each bounded by ``timeout``, so health endpoints only read the stored
+    results and never wait on a dependency themselves.
+    """
+
+    def __init__(
+        self,
+        probes: Dict[str, Callable[[], Awaitable[Optional[dict]]]],
+        interval: float = 30.0,
+        timeout: float = 5.0,
+        clock: Callable[[], float] = time.time
+    ):
+        self.probes = probes
+        self.interval = interval
+        self.timeout = timeout
+        self._clock = clock
+        self._results: Dict[str, dict] = {}
+        self._checked_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+
+    async def _probe(self, name: str, probe: Callable[[], Awaitable[Optional[dict]]]) -> dict:
+        started = time.perf_counter()
+        try:
+            details = await asyncio.wait_for(probe(), self.timeout) or {}
+            result = {"status": HEALTHY, **details}
+        except NotConfigured as e:
+            result = {"status": UNCONFIGURED, "detail": str(e)}
+        except asyncio.TimeoutError:
+            result = {"status": UNHEALTHY, "error": f"No answer within {self.timeout}s"}
+        except Exception as e:
+            result = {"status": UNHEALTHY, "error": str(e) or type(e).__name__}
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        if result["status"] == UNHEALTHY:
+            logger.warning(f"Health probe {name} failed: {result['error']}")
+        return result
+
+    async def run_once(self) -> Dict[str, dict]:
+        """Run every probe now and store the results"""
+        names = list(self.probes)
+        results = await asyncio.gather(*(self._probe(name, self.probes[name]) for name in names))
+        self._checked_at = self._clock()
+        checked_at = datetime.fromtimestamp(self._checked_at).isoformat()
+        self._results = {name: {**result, "checked_at": checked_at} for name, result in zip(names, results)}
+        self.runs += 1
+        return self._results
+
+    def start(self) -> None:
+        """Probe now and then every ``interval`` seconds in the background"""
+        if self._task and not self._task.done():
+            return
+
+        async def run():
+            while True:
+                try:
+                    await self.run_once()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Health probes failed to run: {str(e)}")
+                await asyncio.sleep(self.interval)
+
+        self._task = asyncio.ensure_future(run())
+
+    def stop(self) -> None:
+        """Cancel the background probes"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def results(self) -> Dict[str, dict]:
+        return dict(self._results)
+
+    def age(self) -> Optional[float]:
+        """Seconds since the last run, or None before the first"""
+        return None if self._checked_at is None else self._clock() - self._checked_at
+
+    def status(self) -> str:
+        """``starting`` before the first run, then ``ok`` or ``degraded``"""
+        if self._checked_at is None:
+            return "starting"
+        if any(result["status"] == UNHEALTHY for result in self._results.values()):
+            return "degraded"
+        return "ok"
+
+    def ready(self, required: Iterable[str]) -> bool:
+        """Whether recent results show every ``required`` dependency healthy"""
+        age = self.age()
+        # Results this old mean the probe loop itself has stalled
+        if age is None or age > self.interval * 3 + self.timeout:
+            return False
+        return all(self._results.get(name, {}).get("status") == HEALTHY for name in required)
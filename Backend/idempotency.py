@@ -0,0 +1,110 @@
+"""Request deduplication for operations that must not run twice."""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+
+def derive_key(*parts: Any) -> str:
+    """Build a stable key from the fields that identify a request"""
+    return hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class KeyReused(Exception):
+    """An idempotency key was sent again with a different request"""
+
+
+class IdempotencyCache:
+    """TTL cache of in-flight and completed results keyed by idempotency key.
+
+    The first caller for a key runs the operation. Concurrent duplicates
+    await that same run, and later duplicates get the stored result until
+    it expires. Failed runs are not remembered, so a retry after an error
+    executes again. A ``fingerprint`` of the request can be stored with the
+    key so that reusing the key for a different request is refused.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 600.0,
+        max_entries: int = 10000,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        # key -> (future, expires_at, fingerprint); insertion order matches expiry order
+        self._entries: "OrderedDict[str, Tuple[asyncio.Future, float, Optional[str]]]" = OrderedDict()
+
+        self.misses = 0
+        self.hits = 0
+        self.joined = 0
+        self.reused = 0
+
+    def _purge(self) -> None:
+        now = self._clock()
+        while self._entries:
+            key, (future, expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def _forget_failure(self, key: str, future: asyncio.Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            entry = self._entries.get(key)
+            if entry and entry[0] is future:
+                del self._entries[key]
+
+    def conflicts(self, key: str, fingerprint: Optional[str]) -> bool:
+        """Whether ``key`` is held by a request with a different fingerprint"""
+        self._purge()
+        entry = self._entries.get(key)
+        return entry is not None and None not in (fingerprint, entry[2]) and entry[2] != fingerprint
+
+    async def run(
+        self,
+        key: str,
+        operation: Callable[[], Awaitable[Any]],
+        fingerprint: Optional[str] = None
+    ) -> Tuple[Any, bool]:
+        """Run ``operation`` once per key.
+
+        Returns:
+            Tuple[Any, bool]: The result and whether it was replayed from
+            an earlier or concurrent call
+
+        Raises:
+            KeyReused: If the key was stored with a different fingerprint
+        """
+        if self.conflicts(key, fingerprint):
+            self.reused += 1
+            raise KeyReused(key)
+        entry = self._entries.get(key)
+        if entry is not None:
+            future = entry[0]
+            if future.done():
+                self.hits += 1
+            else:
+                self.joined += 1
+            return await asyncio.shield(future), True
+
+        self.misses += 1
+        future = asyncio.ensure_future(operation())
+        future.add_done_callback(lambda f: self._forget_failure(key, f))
+        self._entries[key] = (future, self._clock() + self.ttl, fingerprint)
+        # Shielded so a disconnecting first caller does not cancel the run for the others
+        return await asyncio.shield(future), False
+
+    def stats(self) -> dict:
+        """Return hit counters for replayed and joined requests"""
+        total = self.misses + self.hits + self.joined
+        return {
+            "entries": len(self._entries),
+            "misses": self.misses,
+            "hits": self.hits,
+            "joined": self.joined,
+            "reused": self.reused,
+            "hit_rate": round((self.hits + self.joined) / total, 3) if total else 0.0
+        }
@@ -0,0 +1,208 @@
+"""Image variant generation for uploaded photos, run in a process pool."""
+
+import asyncio
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, Optional
+
+from PIL import Image, ImageOps
+
+# Longest edge of each generated variant, in pixels
+VARIANT_SIZES = {"thumb": 256, "web": 1280}
+JPEG_QUALITY = 80
+
+JPEG_SOI = b"\xff\xd8"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# EXIF/XMP (APP1), Photoshop IRB with IPTC (APP13) and comments; these carry
+# GPS positions, device serials and timestamps. ICC profiles (APP2) and the
+# Adobe colour transform (APP14) are kept, since pixels depend on them.
+JPEG_METADATA = {0xE1, 0xED, 0xFE}
+PNG_METADATA = {b"eXIf", b"tEXt", b"zTXt", b"iTXt", b"tIME"}
+EXIF_ORIENTATION = 0x0112
+
+
+def _copy_jpeg(src: BinaryIO, out: BinaryIO) -> bool:
+    """Copy a JPEG without its metadata segments; True if any were dropped"""
+    soi = src.read(2)
+    # Segments before the image data are small, so they are collected first
+    kept, tail = [], b""
+    orientation, stripped = 1, False
+    while True:
+        marker = src.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF or marker[1] == 0xDA:
+            # Start of scan, or something unexpected: copy the rest untouched
+            tail = marker
+            break
+        length = src.read(2)
+        segment = src.read(max(struct.unpack(">H", length)[0] - 2, 0)) if len(length) == 2 else b""
+        if marker[1] not in JPEG_METADATA:
+            kept.append(marker + length + segment)
+            continue
+        if marker[1] == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+            try:
+                exif = Image.Exif()
+                exif.load(segment)
+            except Exception:
+                exif = {}
+            if exif and set(exif) == {EXIF_ORIENTATION}:
+                # Already just the orientation, e.g. a file stripped before
+                kept.append(marker + length + segment)
+                continue
+            orientation = exif.get(EXIF_ORIENTATION, orientation)
+        stripped = True
+    if stripped and orientation != 1:
+        # Keep photos upright: a fresh EXIF block holding only the orientation,
+        # after any JFIF header as readers expect
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = orientation
+        data = exif.tobytes()
+        at = 1 if kept and kept[0][1] == 0xE0 else 0
+        kept.insert(at, b"\xff\xe1" + struct.pack(">H", len(data) + 2) + data)
+    out.write(soi + b"".join(kept) + tail)
+    shutil.copyfileobj(src, out)
+    return stripped
+
+
+def _copy_png(src: BinaryIO, out: BinaryIO) -> bool:
+    """Copy a PNG without its metadata chunks; True if any were dropped"""
+    out.write(src.read(8))
+    stripped = False
+    while True:
+        header = src.read(8)
+        if len(header) < 8:
+            out.write(header)
+            break
+        length, kind = struct.unpack(">I", header[:4])[0], header[4:]
+        if kind in PNG_METADATA:
+            src.seek(length + 4, os.SEEK_CUR)
+            stripped = True
+            continue
+        out.write(header)
+        copied = 0
+        while copied < length + 4:
+            chunk = src.read(min(64 * 1024, length + 4 - copied))
+            if not chunk:
+                break
+            out.write(chunk)
+            copied += len(chunk)
+        if kind == b"IEND":
+            break
+    return stripped
+
+
+def strip_metadata(path: str) -> bool:
+    """Remove location and device metadata from a JPEG or PNG file in place.
+
+    Only metadata is dropped; image data is copied byte for byte, so there is
+    no re-encoding loss. A JPEG's EXIF orientation is kept. Other files are
+    left alone. Returns True if the file was rewritten.
+    """
+    with open(path, "rb") as src:
+        head = src.read(8)
+        src.seek(0)
+        if head.startswith(JPEG_SOI):
+            copy = _copy_jpeg
+        elif head == PNG_SIGNATURE:
+            copy = _copy_png
+        else:
+            return False
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                stripped = copy(src, out)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    if not stripped:
+        os.remove(tmp)
+        return False
+    os.replace(tmp, path)
+    return True
+
+
+def render_variants(source: str, targets: Dict[str, str], sizes: Dict[str, int] = VARIANT_SIZES) -> dict:
+    """Write a downscaled JPEG for each variant of ``source``.
+
+    EXIF orientation is applied to the pixels and all metadata is dropped.
+    Runs in a worker process, so it only takes and returns plain data.
+
+    Returns:
+        dict: ``width`` and ``height`` of the upright original
+    """
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        width, height = image.size
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        for name, target in targets.items():
+            variant = image.copy()
+            variant.thumbnail((sizes[name], sizes[name]), Image.LANCZOS)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+            with os.fdopen(fd, "wb") as out:
+                variant.save(out, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            os.replace(tmp, target)
+    return {"width": width, "height": height}
+
+
+class ImagePipeline:
+    """Generates image variants in worker processes, off the event loop.
+
+    Work is keyed by blob hash, so concurrent requests for the same image
+    share one job. The pool is started on first use.
+    """
+
+    def __init__(self, workers: int = 2):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._jobs: Dict[str, asyncio.Future] = {}
+
+        self.processed = 0
+        self.failed = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Forking a process that already runs threads can deadlock the child
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def process(self, key: str, source: str, targets: Dict[str, str]) -> dict:
+        """Render ``targets`` from ``source``, joining any job already running for ``key``"""
+        job = self._jobs.get(key)
+        if job is None:
+            loop = asyncio.get_running_loop()
+            job = asyncio.ensure_future(
+                loop.run_in_executor(self._executor(), render_variants, source, targets)
+            )
+            self._jobs[key] = job
+            job.add_done_callback(lambda _: self._jobs.pop(key, None))
+            job.add_done_callback(self._count)
+        return await asyncio.shield(job)
+
+    def _count(self, job: asyncio.Future) -> None:
+        if job.cancelled() or job.exception() is not None:
+            self.failed += 1
+        else:
+            self.processed += 1
+
+    def shutdown(self, wait: bool = False) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "in_flight": len(self._jobs),
+            "processed": self.processed,
+            "failed": self.failed
+        }
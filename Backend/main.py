@@ -2,9 +2,15 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
+from jose import JWTError
+import asyncio
+import json
 import os
 from logging_config import get_logger
 from config import settings
+from db import get_database, get_sqlite, use_sqlite
+from file_responses import UploadStaticFiles
+from rate_limit import RateLimit, RateLimiter, RateLimitMiddleware, RouteBudget, build_backend
 
 # Configure logging
 logger = get_logger("main")
@@ -19,7 +25,6 @@ app = FastAPI(
 
 # Mount static files
 app.mount("/static", StaticFiles(directory=settings.STATIC_DIR), name="static")
-app.mount("/uploads", StaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
 
 @app.get("/favicon.ico")
 async def favicon():
@@ -30,6 +35,47 @@ async def favicon():
         raise HTTPException(status_code=404, detail="Favicon not found")
     return FileResponse(path)
 
+# Import Routes
+from routes import auth, exports, health, payments, transactions, uploads  # noqa: E402
+
+# Reject oversized uploads before their body is read; added first so CORS wraps it
+app.add_middleware(uploads.UploadSizeLimitMiddleware)
+
+# Throttle login attempts and payment requests per IP and per user
+def token_subject(token: str):
+    """The user a bearer token belongs to; verifying it warms the token cache"""
+    try:
+        return auth.authenticate(token).sub
+    except JWTError:
+        return None
+
+def batch_size(body: bytes) -> float:
+    """Payments in a batch request, each charged like a single payment"""
+    try:
+        items = json.loads(body).get("payments")
+    except (ValueError, AttributeError):
+        return 1.0
+    return float(max(1, len(items))) if isinstance(items, list) else 1.0
+
+payment_limits = {
+    "per_ip": RateLimit.per_minute(settings.PAYMENT_IP_RATE_LIMIT, settings.PAYMENT_IP_BURST),
+    "per_user": RateLimit.per_minute(settings.PAYMENT_RATE_LIMIT, settings.PAYMENT_BURST)
+}
+rate_limiter = RateLimiter(
+    [
+        RouteBudget("login", "POST", "/auth/login",
+                    per_ip=RateLimit.per_minute(settings.LOGIN_RATE_LIMIT, settings.LOGIN_BURST)),
+        RouteBudget("payments", "POST", "/payments/pay", **payment_limits),
+        RouteBudget("payments", "POST", "/payments/pay/batch", **payment_limits, cost=batch_size),
+        RouteBudget("payments", "POST", "/payments/mpesa", **payment_limits)
+    ],
+    backend=build_backend(settings.RATE_LIMIT_REDIS_URL),
+    identify=token_subject,
+    trust_proxy=settings.RATE_LIMIT_TRUST_PROXY
+)
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 # CORS Setup
 app.add_middleware(
     CORSMiddleware,
@@ -37,15 +83,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Content-Disposition", "ETag", "Last-Modified", "Retry-After"],
 )
 
-# Import Routes
-from routes import auth, payments, uploads  # noqa: E402
-
 # Mount Routes
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(payments.router, prefix="/payments", tags=["payments"])
+app.include_router(transactions.router, prefix="/transactions", tags=["transactions"])
 app.include_router(uploads.router, prefix="/uploads", tags=["uploads"])
+app.include_router(exports.router, prefix="/exports", tags=["exports"])
+app.include_router(health.router, tags=["health"])
+
+# Mounted after the routers so it does not shadow the /uploads API routes. Blobs and
+# partial uploads are private: they are served only to their owner by /uploads/files
+app.mount(
+    "/uploads", UploadStaticFiles(directory=settings.UPLOAD_DIR, private=["blobs", "sessions"]), name="uploads"
+)
 
 @app.get("/")
 async def read_root():
@@ -66,9 +119,31 @@ async def startup_event():
     logger.info("✅ Static files mounted")
     logger.info("✅ CORS configured")
     logger.info("✅ Routes mounted")
+    auth.prepare_signing_key()
+    logger.info("✅ JWT signing key loaded")
+    if os.getenv("MPESA_CONSUMER_KEY") and os.getenv("MPESA_CONSUMER_SECRET"):
+        payments.token_cache.start()
+        logger.info("✅ M-PESA token refresh scheduled")
+    await payments.callback_queue.start()
+    logger.info("✅ M-PESA callback workers started")
+    uploads.upload_sessions.start(settings.UPLOAD_SESSION_CLEANUP_INTERVAL)
+    health.monitor.start()
+    logger.info("✅ Health probes scheduled")
     logger.info("✅ Startup complete")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Application shutdown event handler"""
-    logger.info("Kashela API is shutting down...") 
\ No newline at end of file
+    logger.info("Kashela API is shutting down...")
+    payments.token_cache.stop()
+    await payments.callback_queue.stop()
+    await payments.daraja.aclose()
+    uploads.upload_sessions.stop()
+    health.monitor.stop()
+    database = get_database()
+    if database:
+        await database.aclose()
+    if use_sqlite():
+        # Commits whatever the writer still has queued
+        await asyncio.to_thread(get_sqlite().close)
+    uploads.image_pipeline.shutdown() 
\ No newline at end of file
@@ -0,0 +1,18 @@
+-- M-PESA STK pushes and their callback results, keyed by our transaction_id
+create table if not exists payments (
+    transaction_id text primary key,
+    checkout_request_id text,
+    merchant_request_id text,
+    user_id uuid references auth.users,
+    phone_number text,
+    amount numeric,
+    status text not null default 'pending',
+    result_code integer,
+    result_desc text,
+    mpesa_receipt text,
+    created_at timestamptz default now(),
+    updated_at timestamptz default now()
+);
+
+-- Daraja callbacks only carry the CheckoutRequestID
+create index if not exists payments_checkout_request_id_idx on payments (checkout_request_id);
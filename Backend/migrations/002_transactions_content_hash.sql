@@ -0,0 +1,16 @@
+-- Fingerprint of an imported transaction, so re-uploading a statement skips
+-- the rows already stored. Manually created transactions leave it null.
+alter table transactions add column if not exists content_hash text;
+
+-- Keep the earliest of any rows imported twice before the index existed
+update transactions set content_hash = null
+where content_hash is not null
+  and id not in (
+    select distinct on (user_id, content_hash) id
+    from transactions
+    where content_hash is not null
+    order by user_id, content_hash, created_at, id
+  );
+
+create unique index if not exists transactions_user_content_hash_idx
+    on transactions (user_id, content_hash);
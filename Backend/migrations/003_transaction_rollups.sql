@@ -0,0 +1,14 @@
+-- Per-user daily, monthly and per-category totals behind /transactions/summary.
+-- Rows are keyed "user_id|kind|bucket"; kind 'meta' rows mark build state.
+create table if not exists transaction_rollups (
+    id text primary key,
+    user_id uuid not null references auth.users on delete cascade,
+    kind text not null,
+    bucket text not null,
+    income numeric not null default 0,
+    expenses numeric not null default 0,
+    income_count integer not null default 0,
+    expense_count integer not null default 0
+);
+
+create index if not exists transaction_rollups_user_id_idx on transaction_rollups (user_id);
@@ -0,0 +1,298 @@
+"""M-PESA (Daraja) integration helpers for the Kashela API."""
+
+import asyncio
+import base64
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Fallback lifetime when Daraja omits ``expires_in`` (tokens last an hour)
+DEFAULT_TOKEN_LIFETIME = 3599
+
+
+class DarajaClient:
+    """Shared async HTTP client for every Daraja call.
+
+    Connections are pooled and kept alive across requests, the number of
+    calls in flight is bounded, and transient failures are retried with
+    jittered exponential backoff. Requests that are not idempotent (STK
+    push) are only retried when Daraja cannot have acted on them.
+    """
+
+    # Safe to retry when the request may already have been processed
+    IDEMPOTENT_RETRY_STATUSES = {429, 500, 502, 503, 504}
+    # Safe to retry even for requests that charge the customer
+    UNSAFE_RETRY_STATUSES = {429, 503}
+
+    def __init__(
+        self,
+        base_url: str,
+        max_connections: int = 20,
+        max_concurrency: int = 10,
+        timeout: float = 10.0,
+        retries: int = 2,
+        backoff_base: float = 0.25,
+        backoff_cap: float = 2.0
+    ):
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+        self.in_flight = 0
+
+    def _session(self) -> Tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        # Pools are bound to the event loop that created them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._client, self._semaphore
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        idempotent: bool = True,
+        timeout: Optional[float] = None,
+        **kwargs
+    ) -> httpx.Response:
+        """Send a request through the shared pool, retrying transient failures"""
+        client, semaphore = self._session()
+        retry_statuses = self.IDEMPOTENT_RETRY_STATUSES if idempotent else self.UNSAFE_RETRY_STATUSES
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+        attempt = 0
+        while True:
+            try:
+                async with semaphore:
+                    self.requests += 1
+                    self.in_flight += 1
+                    try:
+                        response = await client.request(method, path, **kwargs)
+                    finally:
+                        self.in_flight -= 1
+                if response.status_code not in retry_statuses or attempt >= self.retries:
+                    return response
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                # The request never reached Daraja
+                if attempt >= self.retries:
+                    self.failures += 1
+                    raise
+            except httpx.TransportError:
+                if not idempotent or attempt >= self.retries:
+                    self.failures += 1
+                    raise
+            attempt += 1
+            self.retried += 1
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def fetch_access_token(
+        self,
+        consumer_key: str,
+        consumer_secret: str
+    ) -> Tuple[str, float]:
+        """Fetch a fresh OAuth token from Daraja.
+
+        Returns:
+            Tuple[str, float]: The access token and its lifetime in seconds
+        """
+        auth_string = f"{consumer_key}:{consumer_secret}"
+        auth_base64 = base64.b64encode(auth_string.encode("ascii")).decode("ascii")
+
+        response = await self.request(
+            "GET",
+            "/oauth/v1/generate",
+            params={"grant_type": "client_credentials"},
+            headers={"Authorization": f"Basic {auth_base64}"}
+        )
+        response.raise_for_status()
+        body = response.json()
+        return body["access_token"], float(body.get("expires_in") or DEFAULT_TOKEN_LIFETIME)
+
+    async def stk_push(self, payload: dict, access_token: str) -> httpx.Response:
+        """Submit an STK push request"""
+        return await self.request(
+            "POST",
+            "/mpesa/stkpush/v1/processrequest",
+            idempotent=False,
+            json=payload,
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+
+    async def aclose(self) -> None:
+        """Close pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        """Return request counters and current pool usage"""
+        return {
+            "requests": self.requests,
+            "retries": self.retried,
+            "failures": self.failures,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency
+        }
+
+
+class AccessTokenCache:
+    """Process-wide cache for the Daraja OAuth access token.
+
+    The token is reused until shortly before it expires. Concurrent misses
+    share a single upstream request, and once the token enters its refresh
+    window it is renewed in the background while callers keep using the
+    current one.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable[Tuple[str, float]]],
+        refresh_margin: float = 60.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self._fetch = fetch
+        self.refresh_margin = refresh_margin
+        self._clock = clock
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+        self._scheduler: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    async def get(self) -> str:
+        """Return a valid access token, fetching one only when none is usable"""
+        token, expires_at = self._token, self._expires_at
+        now = self._clock()
+        if token and now < expires_at:
+            self.hits += 1
+            if now >= expires_at - self.refresh_margin and not self._refreshing():
+                self._start_refresh()
+            return token
+
+        self.misses += 1
+        return await self._refresh()
+
+    def invalidate(self) -> None:
+        """Drop the cached token, e.g. after Daraja rejects it"""
+        self._token = None
+        self._expires_at = 0.0
+
+    def _refreshing(self) -> bool:
+        task = self._inflight
+        return (
+            task is not None
+            and not task.done()
+            and task.get_loop() is asyncio.get_running_loop()
+        )
+
+    def _start_refresh(self) -> asyncio.Future:
+        task = self._inflight = asyncio.ensure_future(self._fetch_and_store())
+        task.add_done_callback(self._log_failure)
+        return task
+
+    async def _refresh(self) -> str:
+        task = self._inflight if self._refreshing() else self._start_refresh()
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(self) -> str:
+        try:
+            token, expires_in = await self._fetch()
+        except Exception:
+            self.failures += 1
+            raise
+        self._token = token
+        self._expires_at = self._clock() + expires_in
+        self.refreshes += 1
+        return token
+
+    @staticmethod
+    def _log_failure(task: asyncio.Future) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("M-PESA token refresh failed: %s", task.exception())
+
+    def start(self, retry_delay: float = 5.0) -> None:
+        """Keep the token warm with a background task, even when idle"""
+        if self._scheduler and not self._scheduler.done():
+            return
+
+        async def run():
+            while True:
+                delay = self._expires_at - self.refresh_margin - self._clock()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                try:
+                    await self._refresh()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    await asyncio.sleep(retry_delay)
+
+        self._scheduler = asyncio.ensure_future(run())
+
+    def stop(self) -> None:
+        """Cancel the background refresh task"""
+        if self._scheduler:
+            self._scheduler.cancel()
+            self._scheduler = None
+
+    def stats(self) -> dict:
+        """Return cache counters and the remaining token lifetime"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "expires_in": max(0.0, round(self._expires_at - self._clock(), 1)) if self._token else 0.0
+        }
+
+
+def parse_stk_callback(payload: dict) -> dict:
+    """Flatten a Daraja STK callback body into a payment status update"""
+    callback = payload.get("Body", {}).get("stkCallback", {})
+    result_code = callback.get("ResultCode")
+    metadata = {
+        item.get("Name"): item.get("Value")
+        for item in callback.get("CallbackMetadata", {}).get("Item", [])
+    }
+    return {
+        "checkout_request_id": callback.get("CheckoutRequestID"),
+        "merchant_request_id": callback.get("MerchantRequestID"),
+        "status": "completed" if result_code == 0 else "failed",
+        "result_code": result_code,
+        "result_desc": callback.get("ResultDesc"),
+        "mpesa_receipt": metadata.get("MpesaReceiptNumber"),
+        "amount": metadata.get("Amount")
+    }
@@ -0,0 +1,215 @@
+"""Payment state for M-PESA STK pushes."""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from db import get_supabase
+from mpesa import parse_stk_callback
+
+logger = logging.getLogger(__name__)
+
+
+class _Waiters:
+    """Requests parked on one payment, all woken by a single event"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.event = asyncio.Event()
+        self.count = 0
+
+    def wake(self) -> None:
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+class PaymentStore:
+    """Payment state indexed by transaction ID and CheckoutRequestID.
+
+    Recent payments live in an in-memory LRU so status polls are answered
+    without a database round-trip. Every change is written through to the
+    ``payments`` table when Supabase is configured, and misses fall back
+    to it. Callbacks may be applied by another worker process, so a pending
+    record is only trusted for ``pending_ttl`` seconds before it is read
+    again; settled records never change and are served from memory.
+    """
+
+    TABLE = "payments"
+
+    def __init__(self, capacity: int = 10000, get_db: Callable = get_supabase, pending_ttl: float = 2.0):
+        self.capacity = capacity
+        self._get_db = get_db
+        self.pending_ttl = pending_ttl
+        self._records: "OrderedDict[str, dict]" = OrderedDict()
+        # When each record was last read or written, for expiring pending ones
+        self._loaded_at: Dict[str, float] = {}
+        self._by_checkout: Dict[str, str] = {}
+        # Callbacks that arrived before their STK push was recorded
+        self._unmatched: "OrderedDict[str, dict]" = OrderedDict()
+        self._waiters: Dict[str, _Waiters] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, record: dict) -> None:
+        transaction_id = record["transaction_id"]
+        self._records[transaction_id] = record
+        self._records.move_to_end(transaction_id)
+        self._loaded_at[transaction_id] = time.monotonic()
+        if record.get("checkout_request_id"):
+            self._by_checkout[record["checkout_request_id"]] = transaction_id
+        while len(self._records) > self.capacity:
+            evicted_id, evicted = self._records.popitem(last=False)
+            self._loaded_at.pop(evicted_id, None)
+            self._by_checkout.pop(evicted.get("checkout_request_id"), None)
+
+    def _cached(self, transaction_id: Optional[str]) -> Optional[dict]:
+        record = self._records.get(transaction_id)
+        if record is not None:
+            self._records.move_to_end(transaction_id)
+        return record
+
+    async def _query(self, column: str, values: List[str]) -> List[dict]:
+        db = self._get_db()
+        if not db or not values:
+            return []
+        result = await asyncio.to_thread(
+            db.table(self.TABLE).select("*").in_(column, values).execute
+        )
+        return result.data or []
+
+    async def _write(self, records: List[dict]) -> None:
+        db = self._get_db()
+        if not db or not records:
+            return
+        await asyncio.to_thread(db.table(self.TABLE).upsert(records).execute)
+
+    async def record_pending(self, record: dict) -> dict:
+        """Store a freshly submitted STK push"""
+        now = datetime.now().isoformat()
+        record = {"status": "pending", "created_at": now, "updated_at": now, **record}
+        unmatched = self._unmatched.pop(record.get("checkout_request_id"), None)
+        if unmatched:
+            record.update(unmatched)
+        self._remember(record)
+        await self._write([record])
+        return dict(record)
+
+    def _expired(self, record: dict) -> bool:
+        """Whether a cached record may have been settled by another process"""
+        loaded_at = self._loaded_at.get(record["transaction_id"], 0.0)
+        return record.get("status") == "pending" and time.monotonic() - loaded_at >= self.pending_ttl
+
+    async def get(self, transaction_id: str) -> Optional[dict]:
+        """Look up a payment by the transaction ID returned to the client"""
+        record = self._cached(transaction_id)
+        if record is None or self._expired(record):
+            self.misses += 1
+            rows = await self._query("transaction_id", [transaction_id])
+            if rows:
+                record = rows[0]
+            elif record is None:
+                return None
+            # Without a database the cached record is the only copy
+            self._remember(record)
+        else:
+            self.hits += 1
+        return dict(record)
+
+    async def get_by_checkout(self, checkout_request_id: str) -> Optional[dict]:
+        """Look up a payment by its M-PESA CheckoutRequestID"""
+        transaction_id = self._by_checkout.get(checkout_request_id)
+        if transaction_id is not None:
+            return await self.get(transaction_id)
+        rows = await self._query("checkout_request_id", [checkout_request_id])
+        if rows:
+            self._remember(rows[0])
+            return dict(rows[0])
+        unmatched = self._unmatched.get(checkout_request_id)
+        return dict(unmatched) if unmatched else None
+
+    async def apply_callbacks(self, payloads: List[dict]) -> None:
+        """Apply a batch of raw Daraja callback bodies to both layers"""
+        updates = {}
+        for payload in payloads:
+            update = parse_stk_callback(payload)
+            if not update["checkout_request_id"]:
+                logger.warning("Ignoring M-PESA callback without a CheckoutRequestID")
+                continue
+            update["updated_at"] = datetime.now().isoformat()
+            updates[update["checkout_request_id"]] = update
+
+        missing = [c for c in updates if c not in self._by_checkout]
+        for row in await self._query("checkout_request_id", missing):
+            self._remember(row)
+
+        changed = []
+        for checkout_request_id, update in updates.items():
+            record = self._cached(self._by_checkout.get(checkout_request_id))
+            if record is None:
+                logger.warning("M-PESA callback for unknown checkout request %s", checkout_request_id)
+                self._unmatched[checkout_request_id] = update
+                while len(self._unmatched) > self.capacity:
+                    self._unmatched.popitem(last=False)
+                continue
+            record.update(update)
+            changed.append(record)
+            logger.info("Payment %s for checkout request %s", update["status"], checkout_request_id)
+
+        await self._write(changed)
+        for record in changed:
+            self._notify(record["transaction_id"])
+
+    def _notify(self, transaction_id: str) -> None:
+        waiters = self._waiters.pop(transaction_id, None)
+        if waiters is not None:
+            waiters.wake()
+
+    async def wait_for_update(self, transaction_id: str, timeout: float) -> Optional[dict]:
+        """Return the payment once it leaves ``pending``, or as-is after ``timeout``.
+
+        Waiting requests hold no resources beyond a shared ``asyncio.Event``
+        per payment, so thousands can be parked at negligible cost. Callbacks
+        applied by this process wake them at once; those applied by another
+        process are seen when the record is re-read every ``pending_ttl``.
+        """
+        record = await self.get(transaction_id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while record is not None and record["status"] == "pending":
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            waiters = self._waiters.get(transaction_id)
+            if waiters is None or waiters.loop is not loop:
+                waiters = self._waiters[transaction_id] = _Waiters(loop)
+            waiters.count += 1
+            try:
+                await asyncio.wait_for(waiters.event.wait(), min(remaining, self.pending_ttl))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                waiters.count -= 1
+                if not waiters.count and self._waiters.get(transaction_id) is waiters:
+                    del self._waiters[transaction_id]
+            record = await self.get(transaction_id)
+        return record
+
+    def stats(self) -> dict:
+        """Return cache size and hit counters"""
+        return {
+            "cached": len(self._records),
+            "unmatched": len(self._unmatched),
+            "waiting": sum(waiters.count for waiters in self._waiters.values()),
+            "hits": self.hits,
+            "misses": self.misses
+        }
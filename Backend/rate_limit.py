@@ -0,0 +1,270 @@
+"""Token-bucket rate limiting for sensitive routes, applied as middleware."""
+
+import logging
+import math
+import time
+from typing import Awaitable, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimit(NamedTuple):
+    """Sustained ``rate`` in requests per second, with bursts up to ``burst``"""
+    rate: float
+    burst: int
+
+    @classmethod
+    def per_minute(cls, requests: float, burst: int) -> "RateLimit":
+        return cls(requests / 60.0, burst)
+
+
+class RouteBudget(NamedTuple):
+    """Limits for one route; routes sharing a ``name`` share buckets.
+
+    ``cost`` maps a request body to the tokens it spends, for routes where
+    one request does the work of several; by default each costs one.
+    """
+    name: str
+    method: str
+    path: str
+    per_ip: RateLimit
+    per_user: Optional[RateLimit] = None
+    cost: Optional[Callable[[bytes], float]] = None
+
+
+class MemoryBuckets:
+    """Token buckets held in this process.
+
+    Each key costs one tuple of three floats. Buckets are only read and
+    written between awaits, so the event loop serialises them without a
+    lock. A bucket that has refilled completely is indistinguishable from
+    a missing one, so those are swept out every ``sweep_interval`` seconds.
+    """
+
+    def __init__(self, sweep_interval: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        # key -> (tokens, updated at, full at)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._next_sweep = clock() + sweep_interval
+
+        self.evictions = 0
+
+    async def take(self, key: str, limit: RateLimit, cost: float = 1.0) -> float:
+        """Spend ``cost`` tokens; returns 0 if allowed, else seconds to wait"""
+        now = self._clock()
+        if now >= self._next_sweep:
+            self.sweep(now)
+
+        bucket = self._buckets.get(key)
+        tokens = limit.burst if bucket is None else min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / limit.rate
+        self._buckets[key] = (tokens, now, now + (limit.burst - tokens) / limit.rate)
+        return wait
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Drop buckets that have refilled; returns how many"""
+        now = self._clock() if now is None else now
+        idle = [key for key, bucket in self._buckets.items() if bucket[2] <= now]
+        for key in idle:
+            del self._buckets[key]
+        self.evictions += len(idle)
+        self._next_sweep = now + self.sweep_interval
+        return len(idle)
+
+    def reset(self) -> None:
+        self._buckets.clear()
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "keys": len(self._buckets), "evictions": self.evictions}
+
+
+# Refill, spend and expire in one round-trip. Uses the server's clock so
+# every worker sees the same time; idle keys expire once they have refilled.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    """Token buckets in Redis, or a compatible server, shared by all workers.
+
+    If Redis cannot be reached, requests are let through rather than
+    failing: the limiter protects the API, it must not take it down.
+    """
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self._client = client
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.prefix = prefix
+
+        self.errors = 0
+
+    async def take(self, key: str, limit: RateLimit, cost: float = 1.0) -> float:
+        try:
+            wait = await self._script(keys=[self.prefix + key], args=[limit.rate, limit.burst, cost])
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Rate limit backend unavailable, allowing request: {str(e)}")
+            return 0.0
+        return float(wait)
+
+    def reset(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "errors": self.errors}
+
+
+def build_backend(redis_url: str = ""):
+    """Redis buckets when ``redis_url`` is set, otherwise in-process ones"""
+    if not redis_url:
+        return MemoryBuckets()
+    try:
+        from redis import asyncio as aioredis
+    except ImportError:
+        raise RuntimeError("RATE_LIMIT_REDIS_URL is set but the redis package is not installed")
+    return RedisBuckets(aioredis.from_url(redis_url))
+
+
+class RateLimiter:
+    """Per-IP and per-user budgets for a fixed set of routes.
+
+    ``identify`` maps a bearer token to a user id, or None when the token
+    is not valid; such requests are only limited by IP.
+    """
+
+    def __init__(
+        self,
+        budgets: Iterable[RouteBudget],
+        backend=None,
+        identify: Optional[Callable[[str], Optional[str]]] = None,
+        trust_proxy: bool = False
+    ):
+        self.budgets = {(budget.method, budget.path): budget for budget in budgets}
+        self.backend = backend or MemoryBuckets()
+        self.identify = identify
+        self.trust_proxy = trust_proxy
+
+        self.allowed = 0
+        self.limited = 0
+
+    def client_ip(self, scope, headers: Dict[bytes, bytes]) -> str:
+        forwarded = headers.get(b"x-forwarded-for")
+        if self.trust_proxy and forwarded:
+            # The last entry was added by our own proxy; earlier ones are client-supplied
+            return forwarded.decode("latin-1").split(",")[-1].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def user_id(self, headers: Dict[bytes, bytes]) -> Optional[str]:
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        scheme, _, token = authorization.partition(" ")
+        if self.identify is None or scheme.lower() != "bearer" or not token:
+            return None
+        return self.identify(token)
+
+    def budget(self, scope) -> Optional[RouteBudget]:
+        return self.budgets.get((scope["method"], scope["path"]))
+
+    async def check(self, scope, cost: float = 1.0) -> float:
+        """0 if the request may proceed, else seconds until it would be allowed
+
+        A ``cost`` above a bucket's burst empties it rather than being
+        refused outright.
+        """
+        budget = self.budget(scope)
+        if budget is None:
+            return 0.0
+        headers = dict(scope["headers"])
+        wait = await self.backend.take(
+            f"{budget.name}:ip:{self.client_ip(scope, headers)}", budget.per_ip, min(cost, budget.per_ip.burst)
+        )
+        if not wait and budget.per_user is not None:
+            user_id = self.user_id(headers)
+            if user_id is not None:
+                wait = await self.backend.take(
+                    f"{budget.name}:user:{user_id}", budget.per_user, min(cost, budget.per_user.burst)
+                )
+        if wait:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def reset(self) -> None:
+        self.backend.reset()
+
+    def stats(self) -> dict:
+        return {"allowed": self.allowed, "limited": self.limited, **self.backend.stats()}
+
+
+async def buffer_body(receive) -> Tuple[bytes, Callable[[], Awaitable[dict]]]:
+    """Read a request body, returning it and a ``receive`` that replays it"""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    body = b"".join(chunks)
+    replayed = False
+
+    async def replay() -> dict:
+        nonlocal replayed
+        if replayed:
+            return await receive()
+        replayed = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return body, replay
+
+
+class RateLimitMiddleware:
+    """Answer 429 with Retry-After once a route's budget is spent"""
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            cost = 1.0
+            budget = self.limiter.budget(scope)
+            if budget is not None and budget.cost is not None:
+                body, receive = await buffer_body(receive)
+                cost = budget.cost(body)
+            wait = await self.limiter.check(scope, cost)
+            if wait:
+                response = JSONResponse(
+                    {"detail": "Too many requests"},
+                    status_code=429,
+                    headers={"Retry-After": str(math.ceil(wait))}
+                )
+                return await response(scope, receive, send)
+        return await self.app(scope, receive, send)
@@ -0,0 +1,166 @@
+"""Per-user read-through cache for API responses with HTTP validators."""
+
+import hashlib
+import math
+import time
+import uuid
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple
+
+from fastapi.responses import JSONResponse, Response
+
+
+class ResponseCache:
+    """Size-bounded LRU of JSON responses, versioned per user.
+
+    Every write for a user bumps their version, which retires all of their
+    cached responses at once and changes the ETag clients revalidate with.
+    Versions live in this process only: with several workers, each keeps
+    its own and a write is only seen by the worker that handled it.
+
+    Retired responses are kept until replaced or evicted, so when a load
+    fails in a way ``stale_if`` accepts, the last response served for the
+    same request is returned instead, marked with ``Age`` and a ``Warning``.
+    """
+
+    def __init__(self, max_entries: int = 5000, clock: Callable[[], float] = time.time):
+        self.max_entries = max_entries
+        self._clock = clock
+        # Distinguishes ETags issued before a restart, when versions reset
+        self._epoch = uuid.uuid4().hex[:8]
+        self._started = clock()
+        # user_id -> (version, last modified)
+        self._versions: Dict[str, Tuple[int, float]] = {}
+        # (user_id, key) -> (version, payload, headers, stored at)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[int, Any, dict, float]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def _version(self, user_id: str) -> Tuple[int, float]:
+        return self._versions.get(user_id, (0, self._started))
+
+    def invalidate(self, user_id: str) -> None:
+        """Retire a user's cached responses after a write"""
+        version, modified = self._version(user_id)
+        # Last-Modified has one-second resolution; make every write move it
+        self._versions[user_id] = (version + 1, max(self._clock(), math.floor(modified) + 1))
+
+    def validators(self, user_id: str, key: str) -> dict:
+        """ETag, Last-Modified and Cache-Control for a user's response"""
+        version, modified = self._version(user_id)
+        digest = hashlib.sha256(f"{user_id}|{key}".encode()).hexdigest()[:16]
+        return {
+            "ETag": f'"{self._epoch}-{version}-{digest}"',
+            "Last-Modified": formatdate(math.floor(modified), usegmt=True),
+            "Cache-Control": "private, no-cache"
+        }
+
+    def _is_fresh(self, user_id: str, request_headers: Mapping[str, str], validators: dict) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or validators["ETag"] in tags or f"W/{validators['ETag']}" in tags
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return math.floor(self._version(user_id)[1]) <= since
+        return False
+
+    def _store(self, user_id: str, key: str, version: int, payload: Any, headers: dict) -> None:
+        self._entries[(user_id, key)] = (version, payload, headers, self._clock())
+        self._entries.move_to_end((user_id, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _stale(
+        self,
+        user_id: str,
+        key: str,
+        error: Exception,
+        stale_if: Optional[Callable[[Exception], bool]]
+    ) -> Optional[Response]:
+        """The last response for this request, if ``error`` allows serving it"""
+        entry = self._entries.get((user_id, key))
+        if entry is None or stale_if is None or not stale_if(error):
+            return None
+        self.stale += 1
+        _, payload, headers, stored = entry
+        return JSONResponse(payload, headers={
+            **headers,
+            "Age": str(max(0, int(self._clock() - stored))),
+            "Warning": '110 - "Response is Stale"',
+            "Cache-Control": "no-store"
+        })
+
+    async def _load(
+        self, user_id: str, key: str, version: int, load, stale_if, validators: Optional[dict] = None
+    ) -> Response:
+        try:
+            payload, headers = await load()
+        except Exception as e:
+            stale = self._stale(user_id, key, e, stale_if)
+            if stale is None:
+                raise
+            return stale
+        self._store(user_id, key, version, payload, headers)
+        return JSONResponse(payload, headers={**headers, **(validators or {})})
+
+    async def read(
+        self,
+        user_id: str,
+        key: str,
+        request_headers: Mapping[str, str],
+        load: Callable[[], Awaitable[Tuple[Any, dict]]],
+        stale_if: Optional[Callable[[Exception], bool]] = None
+    ) -> Response:
+        """Answer a read from the client's validators, the cache or ``load``.
+
+        ``load`` is a coroutine function returning the payload and any
+        extra headers to replay with it.
+        """
+        validators = self.validators(user_id, key)
+        if self._is_fresh(user_id, request_headers, validators):
+            self.not_modified += 1
+            return Response(status_code=304, headers=validators)
+
+        version = self._version(user_id)[0]
+        entry = self._entries.get((user_id, key))
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            self._entries.move_to_end((user_id, key))
+            return JSONResponse(entry[1], headers={**entry[2], **validators})
+
+        self.misses += 1
+        return await self._load(user_id, key, version, load, stale_if, validators)
+
+    async def refresh(
+        self,
+        user_id: str,
+        key: str,
+        load: Callable[[], Awaitable[Tuple[Any, dict]]],
+        stale_if: Optional[Callable[[Exception], bool]] = None
+    ) -> Response:
+        """Always ``load``, keeping the result to fall back on when a later load fails"""
+        return await self._load(user_id, key, self._version(user_id)[0], load, stale_if)
+
+    def stats(self) -> dict:
+        """Return hit counters; 304s count as hits"""
+        total = self.hits + self.misses + self.not_modified
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions,
+            "stale": self.stale,
+            "hit_ratio": round((self.hits + self.not_modified) / total, 3) if total else 0.0
+        }
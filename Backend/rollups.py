@@ -0,0 +1,288 @@
+"""Materialised per-user transaction rollups.
+
+Daily, monthly and per-category totals are kept in the
+``transaction_rollups`` table and adjusted incrementally whenever a
+transaction is created or deleted, so dashboard summaries are answered
+in O(buckets) instead of rescanning a user's whole history.
+
+Rebuild and verify a user's rollups from the raw rows with::
+
+    python rollups.py USER_ID [USER_ID ...] [--verify-only]
+"""
+
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from analytics import totals
+from db import get_database, get_supabase
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ("income", "expenses", "income_count", "expense_count")
+# Present once a user's rollups have been built from their raw rows
+BUILT_MARKER = ("meta", "built")
+# Present while a build scans the raw rows; its bucket carries the build's token
+BUILDING = ("meta", "building")
+
+
+def rollup_id(user_id: str, kind: str, bucket: str) -> str:
+    return f"{user_id}|{kind}|{bucket}"
+
+
+def rollup_deltas(rows: Iterable[dict], sign: int = 1) -> Dict[Tuple[str, str], dict]:
+    """Per-bucket changes caused by adding (or removing, ``sign=-1``) rows"""
+    deltas: Dict[Tuple[str, str], dict] = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for row in rows:
+        day = str(row["date"])[:10]
+        is_income = row["type"] == "income"
+        amount = sign * (row["amount"] or 0)
+        for key in (("day", day), ("month", day[:7]), ("category", row["category"] or "")):
+            delta = deltas[key]
+            if is_income:
+                delta["income"] += amount
+                delta["income_count"] += sign
+            else:
+                delta["expenses"] += amount
+                delta["expense_count"] += sign
+    return deltas
+
+
+class RollupStore:
+    """Incrementally maintained rollups in the ``transaction_rollups`` table.
+
+    Updates are read-modify-write, serialised per user within the process.
+    Writers in other processes can race; ``rebuild`` recomputes a user's
+    rollups from scratch and ``verify`` reports any drift.
+
+    A build started with ``start_build`` leaves a marker while the raw rows
+    are scanned. An update arriving before the build finishes removes it,
+    and ``rebuild`` then leaves the rollups unbuilt instead of missing that
+    update, so the next read builds them again.
+    """
+
+    TABLE = "transaction_rollups"
+
+    def __init__(self, get_db: Callable = get_supabase):
+        self._get_db = get_db
+        self._locks: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Lock]] = {}
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        entry = self._locks.get(user_id)
+        if entry is None or entry[0] is not loop:
+            entry = self._locks[user_id] = (loop, asyncio.Lock())
+        return entry[1]
+
+    async def _execute(self, query):
+        if asyncio.iscoroutinefunction(query.execute):
+            return (await query.execute()).data or []
+        return (await asyncio.to_thread(query.execute)).data or []
+
+    async def load(self, user_id: str) -> Optional[List[dict]]:
+        """All rollup rows for a user, or None if they were never built"""
+        db = self._get_db()
+        rows = await self._execute(db.table(self.TABLE).select("*").eq("user_id", user_id))
+        if not any((row["kind"], row["bucket"]) == BUILT_MARKER for row in rows):
+            return None
+        return [row for row in rows if row["kind"] != "meta"]
+
+    async def invalidate(self, user_id: str) -> None:
+        """Drop the built marker so the next read rebuilds from raw rows"""
+        db = self._get_db()
+        await self._execute(db.table(self.TABLE).delete().eq("id", rollup_id(user_id, *BUILT_MARKER)))
+
+    async def apply(self, user_id: str, rows: List[dict], sign: int = 1) -> None:
+        """Fold created (``sign=1``) or deleted (``sign=-1``) transactions into the rollups.
+
+        The transaction write has already happened, so a failure here is
+        logged and the user's rollups are invalidated rather than raised.
+        """
+        deltas = rollup_deltas(rows, sign)
+        if not deltas:
+            return
+        try:
+            await self._apply(user_id, deltas)
+        except Exception as e:
+            logger.warning(f"Rollup update failed for {user_id}, invalidating: {e}")
+            try:
+                await self.invalidate(user_id)
+            except Exception as e:
+                logger.error(f"Could not invalidate rollups for {user_id}: {e}")
+
+    async def _apply(self, user_id: str, deltas: Dict[Tuple[str, str], dict]) -> None:
+        db = self._get_db()
+        async with self._lock(user_id):
+            building_id = rollup_id(user_id, *BUILDING)
+            ids = [rollup_id(user_id, *key) for key in deltas] + [rollup_id(user_id, *BUILT_MARKER), building_id]
+            current = {
+                row["id"]: row
+                for row in await self._execute(db.table(self.TABLE).select("*").in_("id", ids))
+            }
+            if rollup_id(user_id, *BUILT_MARKER) not in current:
+                if building_id in current:
+                    # The scan in progress may have missed these rows
+                    await self._execute(db.table(self.TABLE).delete().eq("id", building_id))
+                # Built from scratch on first read, which will include these rows
+                return
+
+            updated, emptied = [], []
+            for (kind, bucket), delta in deltas.items():
+                key = rollup_id(user_id, kind, bucket)
+                row = current.get(key) or {
+                    "id": key, "user_id": user_id, "kind": kind, "bucket": bucket,
+                    **dict.fromkeys(COUNTERS, 0)
+                }
+                for counter in COUNTERS:
+                    row[counter] = round(row[counter] + delta[counter], 2)
+                if row["income_count"] <= 0 and row["expense_count"] <= 0:
+                    emptied.append(key)
+                else:
+                    updated.append(row)
+
+            if updated:
+                await self._execute(db.table(self.TABLE).upsert(updated))
+            if emptied:
+                await self._execute(db.table(self.TABLE).delete().in_("id", emptied))
+
+    def _marker(self, user_id: str, marker: Tuple[str, str], bucket: Optional[str] = None) -> dict:
+        kind, name = marker
+        return {
+            "id": rollup_id(user_id, kind, name), "user_id": user_id,
+            "kind": kind, "bucket": bucket or name, **dict.fromkeys(COUNTERS, 0)
+        }
+
+    async def start_build(self, user_id: str) -> str:
+        """Mark a build as started before scanning; returns the token to pass to ``rebuild``"""
+        token = uuid.uuid4().hex
+        db = self._get_db()
+        await self._execute(db.table(self.TABLE).upsert(self._marker(user_id, BUILDING, f"building:{token}")))
+        return token
+
+    def compute(self, user_id: str, rows: Iterable[dict]) -> List[dict]:
+        """Rollup rows for a user computed from scratch"""
+        computed = []
+        for (kind, bucket), counters in rollup_deltas(rows).items():
+            computed.append({
+                "id": rollup_id(user_id, kind, bucket), "user_id": user_id, "kind": kind, "bucket": bucket,
+                **{counter: round(value, 2) for counter, value in counters.items()}
+            })
+        return computed
+
+    async def rebuild(self, user_id: str, rows: Iterable[dict], token: Optional[str] = None) -> int:
+        """Replace a user's rollups with ones recomputed from their raw rows
+
+        With the ``token`` of a build begun before ``rows`` were scanned, the
+        rollups are only marked built if no update arrived meanwhile.
+        """
+        computed = self.compute(user_id, rows)
+        building_id = rollup_id(user_id, *BUILDING)
+        db = self._get_db()
+        async with self._lock(user_id):
+            await self._execute(db.table(self.TABLE).delete().eq("user_id", user_id).neq("id", building_id))
+            for start in range(0, len(computed), 1000):
+                await self._execute(db.table(self.TABLE).insert(computed[start:start + 1000]))
+            if token is not None:
+                building = await self._execute(db.table(self.TABLE).select("bucket").eq("id", building_id))
+                if not building or building[0]["bucket"] != f"building:{token}":
+                    logger.info(f"Rollups for {user_id} changed while building, deferring to the next read")
+                    return len(computed)
+                await self._execute(db.table(self.TABLE).delete().eq("id", building_id))
+            await self._execute(db.table(self.TABLE).insert(self._marker(user_id, BUILT_MARKER)))
+        return len(computed)
+
+    async def verify(self, user_id: str, rows: Iterable[dict]) -> List[str]:
+        """Describe every bucket where stored rollups disagree with the raw rows"""
+        expected = {row["id"]: row for row in self.compute(user_id, rows)}
+        stored = {row["id"]: row for row in (await self.load(user_id) or [])}
+        problems = []
+        for key in sorted(set(expected) | set(stored)):
+            want, have = expected.get(key), stored.get(key)
+            if want is None or have is None:
+                problems.append(f"{key}: {'unexpected' if want is None else 'missing'}")
+                continue
+            for counter in COUNTERS:
+                if abs(want[counter] - have[counter]) > 0.005:
+                    problems.append(f"{key}: {counter} is {have[counter]}, expected {want[counter]}")
+        return problems
+
+
+def summarize_rollups(rollups: List[dict], period: str = "daily", category_type: str = "expense") -> dict:
+    """Build the ``analytics.summarize`` response from rollup rows"""
+    by_kind = defaultdict(list)
+    for row in rollups:
+        by_kind[row["kind"]].append(row)
+
+    months = by_kind["month"]
+    income = sum(row["income"] for row in months)
+    expenses = sum(row["expenses"] for row in months)
+    count = sum(row["income_count"] + row["expense_count"] for row in months)
+
+    amount, present = ("income", "income_count") if category_type == "income" else ("expenses", "expense_count")
+    categories = {
+        row["bucket"]: round(row[amount], 2)
+        for row in sorted(by_kind["category"], key=lambda row: row["bucket"])
+        if row[present] > 0
+    }
+
+    if period == "monthly":
+        buckets = {row["bucket"]: (row["income"], row["expenses"]) for row in months}
+    else:
+        buckets = defaultdict(lambda: (0.0, 0.0))
+        for row in by_kind["day"]:
+            key = row["bucket"]
+            if period == "weekly":
+                day = date.fromisoformat(key)
+                key = (day - timedelta(days=day.weekday())).isoformat()
+            inc, exp = buckets[key]
+            buckets[key] = (inc + row["income"], exp + row["expenses"])
+
+    return {
+        "count": count,
+        "totals": totals(income, expenses),
+        "categories": categories,
+        "periods": [
+            {"date": key, "income": round(inc, 2), "expenses": round(exp, 2)}
+            for key, (inc, exp) in sorted(buckets.items())
+        ]
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    from routes.transactions import fetch_pages
+
+    parser = argparse.ArgumentParser(description="Rebuild and verify transaction rollups")
+    parser.add_argument("user_ids", nargs="+")
+    parser.add_argument("--verify-only", action="store_true", help="report drift without rebuilding")
+    args = parser.parse_args(argv)
+
+    database = get_database()
+    if not database:
+        print("No database configured")
+        return 2
+    store = RollupStore(lambda: database)
+
+    async def run() -> int:
+        failures = 0
+        for user_id in args.user_ids:
+            token = None if args.verify_only else await store.start_build(user_id)
+            rows = [row async for page in fetch_pages(database, user_id, "amount,type,category,date") for row in page]
+            if not args.verify_only:
+                built = await store.rebuild(user_id, rows, token)
+                print(f"{user_id}: rebuilt {built} rollups from {len(rows)} transactions")
+            problems = await store.verify(user_id, rows)
+            for problem in problems:
+                print(f"  {problem}")
+            print(f"{user_id}: {'OK' if not problems else f'{len(problems)} mismatches'}")
+            failures += bool(problems)
+        return 1 if failures else 0
+
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
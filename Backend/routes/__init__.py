@@ -4,10 +4,12 @@ Routes package for Kashela API
 
 from . import auth
 from . import payments
+from . import transactions
+from . import exports
 from . import uploads
 import logging
 
 # Configure route-specific logging
 logger = logging.getLogger(__name__)
 
-__all__ = ["auth", "payments", "uploads"]
+__all__ = ["auth", "payments", "transactions", "uploads", "exports"]
@@ -1,11 +1,14 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import jwt, JWTError
+from jose import jwk, jwt, JWTError
+from jose.backends.base import Key
 from pydantic import BaseModel
-import os
+from typing import Optional
 from dotenv import load_dotenv
+from config import settings
 from db import get_supabase
 from datetime import datetime, timedelta
+from token_cache import VerifiedTokenCache
 import logging
 
 # Configure route-specific logging
@@ -28,21 +31,57 @@ class TokenData(BaseModel):
     sub: str
     exp: datetime
 
-# JWT settings
-JWT_SECRET = os.getenv("JWT_SECRET_KEY", "your-secret-key")
-JWT_ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+    class Config:
+        # Instances are shared between requests through the token cache
+        frozen = True
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
+# Claims of tokens that already passed verification, kept until they expire
+token_cache = VerifiedTokenCache(settings.TOKEN_CACHE_SIZE)
+_signing_key: Optional[Key] = None
+
+def prepare_signing_key() -> Key:
+    """Build the JWT key from settings; called at startup"""
+    global _signing_key
+    _signing_key = jwk.construct(settings.JWT_SECRET_KEY, settings.JWT_ALGORITHM)
+    # Tokens verified under a previous key must be checked again
+    token_cache.clear()
+    return _signing_key
+
+def signing_key() -> Key:
+    return _signing_key or prepare_signing_key()
+
+def verify_token(token: str) -> TokenData:
+    """Check a token's signature and expiry and return its claims
+
+    Raises:
+        JWTError: The token is invalid or expired
+    """
+    payload = jwt.decode(token, signing_key(), algorithms=[settings.JWT_ALGORITHM])
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        token_data = TokenData(
+        return TokenData(
             sub=payload.get("sub"),
             exp=datetime.fromtimestamp(payload.get("exp"))
         )
-        return token_data
+    except (TypeError, ValueError) as e:
+        raise JWTError(str(e))
+
+def authenticate(token: str) -> TokenData:
+    """Claims of a token, verifying it only if it is not cached
+
+    Raises:
+        JWTError: The token is invalid or expired
+    """
+    token_data = token_cache.get(token)
+    if token_data is None:
+        token_data = verify_token(token)
+        token_cache.put(token, token_data, token_data.exp.timestamp())
+    return token_data
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
+    try:
+        return authenticate(token)
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -53,7 +92,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
 @router.post("/signup")
 async def signup(user: UserAuth):
     supabase = get_supabase()
-    if not supabase:
+    if not hasattr(supabase, "auth"):
+        # The embedded SQLite store has no user accounts
         raise HTTPException(status_code=503, detail="Authentication service unavailable")
     
     try:
@@ -76,12 +116,12 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         # Here you would typically validate against your database
         # For demo purposes, we'll use a simple check
         if form_data.username == "demo" and form_data.password == "password":
-            token_expires = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+            token_expires = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
             token_data = {
                 "sub": form_data.username,
                 "exp": token_expires.timestamp()
             }
-            token = jwt.encode(token_data, JWT_SECRET, algorithm=JWT_ALGORITHM)
+            token = jwt.encode(token_data, signing_key(), algorithm=settings.JWT_ALGORITHM)
             
             logger.info(f"Login successful for user: {form_data.username}")
             return {"access_token": token, "token_type": "bearer"}
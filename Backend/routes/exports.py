@@ -0,0 +1,93 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterable, AsyncIterator, List, Optional
+from datetime import datetime
+import csv
+import io
+import json
+import logging
+import zlib
+from .auth import get_current_user, TokenData
+from .transactions import database_error, fetch_pages, require_database
+
+# Configure route-specific logging
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Columns written to exports, in CSV column order
+EXPORT_FIELDS = ["date", "type", "category", "description", "amount", "id"]
+EXPORT_PAGE_SIZE = 1000
+
+async def csv_chunks(pages: AsyncIterable[List[dict]]) -> AsyncIterator[bytes]:
+    """Encode pages of rows as CSV, one chunk per page"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    async for page in pages:
+        writer.writerows([row.get(field) for field in EXPORT_FIELDS] for row in page)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+async def ndjson_chunks(pages: AsyncIterable[List[dict]]) -> AsyncIterator[bytes]:
+    """Encode pages of rows as newline-delimited JSON, one chunk per page"""
+    async for page in pages:
+        yield "".join(
+            json.dumps({field: row.get(field) for field in EXPORT_FIELDS}) + "\n" for row in page
+        ).encode("utf-8")
+
+async def gzip_chunks(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Compress a chunk stream incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+@router.get("/transactions")
+async def export_transactions(
+    format: str = Query("csv", regex="^(csv|ndjson)$"),
+    gzip: bool = False,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    type: Optional[str] = Query(None, regex="^(income|expense)$"),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Download the user's transactions as CSV or NDJSON.
+
+    Rows are read from the database a page at a time and written out as
+    they arrive, so memory use does not grow with the size of the history.
+    """
+    fetched = fetch_pages(
+        require_database(), current_user.sub, ",".join(EXPORT_FIELDS), EXPORT_PAGE_SIZE,
+        start_date=start_date, end_date=end_date, type=type
+    )
+    # Fetch the first page up front so database errors still get a status code
+    try:
+        first = await fetched.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except Exception as e:
+        raise database_error(e)
+
+    async def pages():
+        if first is not None:
+            yield first
+            async for page in fetched:
+                yield page
+
+    logger.info(f"Exporting transactions for user {current_user.sub} as {format}")
+    chunks = csv_chunks(pages()) if format == "csv" else ndjson_chunks(pages())
+    headers = {
+        "Content-Disposition": f'attachment; filename="transactions-{datetime.now():%Y-%m-%d}.{format}"'
+    }
+    if gzip:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
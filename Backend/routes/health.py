@@ -1,30 +1,88 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
 from datetime import datetime
-from db import get_supabase
+import asyncio
+import os
+import shutil
+from config import settings
+from db import get_database, use_sqlite
+from health_monitor import HealthMonitor, NotConfigured
+from routes import payments
 
 router = APIRouter()
 
-async def check_supabase():
+# Probes that must pass before this instance takes traffic; payments can be down
+# while transactions and uploads are still served
+READINESS_PROBES = ["upload_disk"]
+# Reported by readiness but never failing it: while the database is down every
+# instance serves stale reads and queues writes, which beats serving nothing
+DEGRADED_PROBES = ["database"]
+
+async def check_database():
+    """A one-row read through the pooled database"""
+    database = get_database()
+    if not database:
+        raise NotConfigured("No database configured")
+    await database.table("transactions").select("id").limit(1).execute()
+    return {"backend": "sqlite" if use_sqlite() else "supabase", "circuit": database.breaker.state}
+
+async def check_mpesa():
+    """Get an OAuth token through the shared cache, so Daraja is only asked near expiry"""
+    if not os.getenv("MPESA_CONSUMER_KEY") or not os.getenv("MPESA_CONSUMER_SECRET"):
+        raise NotConfigured("M-PESA credentials not configured")
     try:
-        supabase = get_supabase()
-        if not supabase:
-            return False
-        # Simple query to test connection
-        supabase.table("users").select("*").limit(1).execute()
-        return True
-    except Exception as e:
-        return False
+        await payments.token_cache.get()
+    except HTTPException as e:
+        raise ConnectionError(e.detail)
+    return {"token_expires_in": payments.token_cache.stats()["expires_in"]}
+
+async def check_upload_disk():
+    """Free space and write access on the upload volume"""
+    usage = await asyncio.to_thread(shutil.disk_usage, settings.UPLOAD_DIR)
+    free_mb = usage.free // (1024 * 1024)
+    if not os.access(settings.UPLOAD_DIR, os.W_OK):
+        raise PermissionError(f"{settings.UPLOAD_DIR} is not writable")
+    if free_mb < settings.HEALTH_MIN_FREE_DISK_MB:
+        raise OSError(f"Only {free_mb}MB free, below {settings.HEALTH_MIN_FREE_DISK_MB}MB")
+    return {"free_mb": free_mb, "used_percent": round(usage.used / usage.total * 100, 1)}
+
+PROBES = {
+    "database": check_database,
+    "mpesa": check_mpesa,
+    "upload_disk": check_upload_disk
+}
+
+monitor = HealthMonitor(PROBES, settings.HEALTH_CHECK_INTERVAL, settings.HEALTH_CHECK_TIMEOUT)
 
 @router.get("/health")
 async def health_check():
-    supabase_status = await check_supabase()
-    
+    """Latest background probe results; never waits on a dependency"""
+    age = monitor.age()
     return {
-        "status": "ok" if supabase_status else "degraded",
+        "status": monitor.status(),
         "timestamp": datetime.now().isoformat(),
-        "services": {
-            "supabase": "healthy" if supabase_status else "unhealthy",
-            "mpesa": "mocked"  # Since we're using mock implementation
-        },
-        "version": "1.0.0"
-    } 
\ No newline at end of file
+        "checked_seconds_ago": None if age is None else round(age, 1),
+        "services": monitor.results(),
+        "version": settings.API_VERSION
+    }
+
+@router.get("/health/live")
+async def liveness():
+    """The process is up and its event loop is answering"""
+    return {"status": "alive"}
+
+@router.get("/health/ready")
+async def readiness():
+    """Whether this instance should receive traffic, from the cached results"""
+    ready = monitor.ready(READINESS_PROBES)
+    results = monitor.results()
+    services = {
+        name: results.get(name, {}).get("status", "unknown") for name in READINESS_PROBES + DEGRADED_PROBES
+    }
+    if not ready:
+        status = "not_ready"
+    elif any(services[name] == "unhealthy" for name in DEGRADED_PROBES):
+        status = "degraded"
+    else:
+        status = "ready"
+    return JSONResponse(status_code=200 if ready else 503, content={"status": status, "services": services})
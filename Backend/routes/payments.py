@@ -1,14 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
 import os
 from datetime import datetime
+import time
 import uuid
-import requests
+import json
 import base64
+import asyncio
+import re
+from functools import lru_cache
 from .auth import get_current_user, TokenData
 import logging
 from dotenv import load_dotenv
+from config import settings
+from mpesa import AccessTokenCache, DarajaClient
+from payment_store import PaymentStore
+from callback_queue import CallbackQueue
+from idempotency import IdempotencyCache, KeyReused, derive_key
 
 # Configure route-specific logging
 logger = logging.getLogger(__name__)
@@ -23,36 +33,63 @@ class MPESAPayment(BaseModel):
     amount: float
     description: Optional[str] = None
 
+class MPESABatchPayment(BaseModel):
+    payments: List[MPESAPayment]
+    concurrency: Optional[int] = Field(None, ge=1)
+
 class PaymentRequest(BaseModel):
     amount: float
     phone_number: str
     description: str = None
 
-def generate_access_token():
-    """Generate M-PESA access token"""
+# Pooled, keep-alive client shared by every Daraja call in the process
+daraja = DarajaClient(
+    settings.MPESA_BASE_URL,
+    max_connections=settings.MPESA_MAX_CONNECTIONS,
+    max_concurrency=settings.MPESA_MAX_CONCURRENCY,
+    timeout=settings.MPESA_TIMEOUT,
+    retries=settings.MPESA_RETRIES
+)
+
+async def fetch_access_token():
+    """Request a new M-PESA access token from Daraja"""
     consumer_key = os.getenv("MPESA_CONSUMER_KEY")
     consumer_secret = os.getenv("MPESA_CONSUMER_SECRET")
     
     if not consumer_key or not consumer_secret:
         raise HTTPException(500, "M-PESA credentials not configured")
-        
-    # Create auth string and encode it
-    auth_string = f"{consumer_key}:{consumer_secret}"
-    auth_bytes = auth_string.encode("ascii")
-    auth_base64 = base64.b64encode(auth_bytes).decode("ascii")
     
     try:
-        response = requests.get(
-            "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials",
-            headers={
-                "Authorization": f"Basic {auth_base64}"
-            }
-        )
-        response.raise_for_status()
-        return response.json()["access_token"]
+        return await daraja.fetch_access_token(consumer_key, consumer_secret)
     except Exception as e:
         raise HTTPException(500, f"Failed to get M-PESA token: {str(e)}")
 
+# Shared by every request in the process; refreshed ahead of expiry
+token_cache = AccessTokenCache(
+    fetch_access_token,
+    refresh_margin=settings.MPESA_TOKEN_REFRESH_MARGIN
+)
+
+async def generate_access_token():
+    """Get an M-PESA access token, reusing the cached one while it is valid"""
+    return await token_cache.get()
+
+payment_store = PaymentStore(capacity=settings.PAYMENT_CACHE_SIZE, pending_ttl=settings.PAYMENT_PENDING_TTL)
+
+# Results of recent STK pushes, replayed to duplicate submissions
+idempotency_cache = IdempotencyCache(ttl=settings.IDEMPOTENCY_TTL)
+
+# Comment frames sent to SSE clients while a payment is pending
+SSE_HEARTBEAT_INTERVAL = 15.0
+
+# Callbacks are persisted here before being applied to the payment store
+callback_queue = CallbackQueue(
+    os.path.join(settings.DATA_DIR, "mpesa_callbacks.db"),
+    payment_store.apply_callbacks,
+    workers=settings.MPESA_CALLBACK_WORKERS,
+    batch_size=settings.MPESA_CALLBACK_BATCH_SIZE
+)
+
 def format_phone_number(phone_number: str) -> str:
     """Format phone number to required format"""
     # Remove any spaces or special characters
@@ -66,70 +103,137 @@ def format_phone_number(phone_number: str) -> str:
         
     return phone
 
+@lru_cache(maxsize=8)
+def stk_password(shortcode: str, passkey: str, timestamp: str) -> str:
+    """Generate the STK push password, once per timestamp"""
+    password_str = f"{shortcode}{passkey}{timestamp}"
+    return base64.b64encode(password_str.encode()).decode("ascii")
+
+async def submit_stk_push(
+    payment: MPESAPayment,
+    user_id: str,
+    phone: Optional[str] = None,
+    access_token: Optional[str] = None,
+    timestamp: Optional[str] = None
+) -> dict:
+    """Send one STK push to Daraja and record it as pending.
+
+    Batch callers pass the already formatted phone number, access token
+    and timestamp so they are computed once for the whole batch.
+    """
+    # Format phone number
+    phone = phone or format_phone_number(payment.phone_number)
+    
+    # Get access token
+    access_token = access_token or await generate_access_token()
+    
+    # Prepare STK push request
+    timestamp = timestamp or datetime.now().strftime("%Y%m%d%H%M%S")
+    shortcode = os.getenv("MPESA_SHORTCODE")
+    passkey = os.getenv("MPESA_PASSKEY")
+    
+    # Generate password
+    password = stk_password(shortcode, passkey, timestamp)
+    
+    # Transaction details
+    transaction_id = f"MPESA_{uuid.uuid4().hex[:8].upper()}"
+    callback_url = f"{os.getenv('API_BASE_URL', 'https://your-domain.com')}/payments/callback"
+    
+    # Make STK push request
+    response = await daraja.stk_push(
+        {
+            "BusinessShortCode": shortcode,
+            "Password": password,
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": int(payment.amount),
+            "PartyA": phone,
+            "PartyB": shortcode,
+            "PhoneNumber": phone,
+            "CallBackURL": callback_url,
+            "AccountReference": "Kashela",
+            "TransactionDesc": payment.description or "Payment for Kashela services"
+        },
+        access_token
+    )
+    
+    if response.status_code == 401:
+        # Daraja revoked the token early; fetch a new one on the next call
+        token_cache.invalidate()
+    if response.status_code != 200:
+        raise HTTPException(400, "Failed to initiate payment")
+        
+    stk_response = response.json()
+    
+    # Keep the transaction_id <-> CheckoutRequestID mapping for status lookups
+    try:
+        await payment_store.record_pending({
+            "transaction_id": transaction_id,
+            "checkout_request_id": stk_response.get("CheckoutRequestID"),
+            "merchant_request_id": stk_response.get("MerchantRequestID"),
+            "user_id": user_id,
+            "phone_number": phone,
+            "amount": payment.amount
+        })
+    except Exception as e:
+        # The customer already has the prompt: failing here would make a retry
+        # send a second one. The record stays in memory for status lookups.
+        logger.error(f"Could not persist payment {transaction_id}: {str(e)}")
+    
+    return {
+        "message": "Payment initiated successfully",
+        "transaction_id": transaction_id,
+        "checkout_request_id": stk_response.get("CheckoutRequestID"),
+        "status": "pending",
+        "phone_number": phone,
+        "amount": payment.amount
+    }
+
+def payment_key(user_id: str, payment: MPESAPayment, idempotency_key: Optional[str] = None, phone: Optional[str] = None) -> str:
+    """Deduplication key for a payment submission"""
+    if idempotency_key:
+        return derive_key(user_id, idempotency_key)
+    # Without a client key, treat identical payments within one window as double taps
+    window = int(time.time() // settings.IDEMPOTENCY_WINDOW)
+    phone = phone or format_phone_number(payment.phone_number)
+    return derive_key(user_id, phone, payment.amount, window)
+
+def payment_fingerprint(payment: MPESAPayment, idempotency_key: Optional[str]) -> Optional[str]:
+    """Hash of a payment, so a client key reused for another payment is refused"""
+    return derive_key(payment.json(sort_keys=True)) if idempotency_key else None
+
+def key_reused() -> HTTPException:
+    return HTTPException(
+        status_code=422,
+        detail="Idempotency-Key was already used for a different request"
+    )
+
 @router.post("/pay")
 async def initiate_payment(
     payment: MPESAPayment,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
     current_user: TokenData = Depends(get_current_user)
 ):
     try:
         logger.info(f"Initiating M-PESA payment for user {current_user.sub}, phone: {payment.phone_number}, amount: {payment.amount}")
         
-        # Format phone number
-        phone = format_phone_number(payment.phone_number)
-        
-        # Get access token
-        access_token = generate_access_token()
-        
-        # Prepare STK push request
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        shortcode = os.getenv("MPESA_SHORTCODE")
-        passkey = os.getenv("MPESA_PASSKEY")
-        
-        # Generate password
-        password_str = f"{shortcode}{passkey}{timestamp}"
-        password = base64.b64encode(password_str.encode()).decode("ascii")
-        
-        # Transaction details
-        transaction_id = f"MPESA_{uuid.uuid4().hex[:8].upper()}"
-        callback_url = f"{os.getenv('API_BASE_URL', 'https://your-domain.com')}/payments/callback"
-        
-        # Make STK push request
-        response = requests.post(
-            "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest",
-            json={
-                "BusinessShortCode": shortcode,
-                "Password": password,
-                "Timestamp": timestamp,
-                "TransactionType": "CustomerPayBillOnline",
-                "Amount": int(payment.amount),
-                "PartyA": phone,
-                "PartyB": shortcode,
-                "PhoneNumber": phone,
-                "CallBackURL": callback_url,
-                "AccountReference": "Kashela",
-                "TransactionDesc": payment.description or "Payment for Kashela services"
-            },
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            }
+        key = payment_key(current_user.sub, payment, idempotency_key)
+        result, replayed = await idempotency_cache.run(
+            key,
+            lambda: submit_stk_push(payment, current_user.sub),
+            payment_fingerprint(payment, idempotency_key)
         )
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
+            logger.info(f"Duplicate payment request for user {current_user.sub} served transaction {result['transaction_id']}")
+        else:
+            logger.info(f"Payment request processed successfully for user {current_user.sub}")
+        return result
         
-        if response.status_code != 200:
-            raise HTTPException(400, "Failed to initiate payment")
-            
-        stk_response = response.json()
-        
-        logger.info(f"Payment request processed successfully for user {current_user.sub}")
-        return {
-            "message": "Payment initiated successfully",
-            "transaction_id": transaction_id,
-            "checkout_request_id": stk_response.get("CheckoutRequestID"),
-            "status": "pending",
-            "phone_number": phone,
-            "amount": payment.amount
-        }
-        
+    except KeyReused:
+        logger.warning(f"Idempotency key reused with a different payment by user {current_user.sub}")
+        raise key_reused()
     except Exception as e:
         logger.error(f"Payment processing error for user {current_user.sub}: {str(e)}")
         raise HTTPException(
@@ -137,6 +241,99 @@ async def initiate_payment(
             detail="Payment processing failed"
         )
 
+# Kenyan mobile numbers in the 2547XXXXXXXX / 2541XXXXXXXX form Daraja expects
+VALID_PHONE = re.compile(r"^254[17]\d{8}$")
+
+@router.post("/pay/batch")
+async def initiate_batch_payment(
+    batch: MPESABatchPayment,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Submit many STK pushes at once.
+
+    Phone numbers are validated up front, one access token and one STK
+    password are shared by the whole batch, and pushes run concurrently
+    up to ``MPESA_BATCH_CONCURRENCY``. Results stream back as NDJSON in
+    completion order, followed by a summary line.
+    """
+    if not batch.payments:
+        raise HTTPException(400, "No payments supplied")
+    if len(batch.payments) > settings.MPESA_BATCH_MAX_SIZE:
+        raise HTTPException(400, f"At most {settings.MPESA_BATCH_MAX_SIZE} payments per batch")
+    
+    logger.info(f"Initiating batch of {len(batch.payments)} M-PESA payments for user {current_user.sub}")
+    
+    # Validate and normalise every phone number in one pass
+    phones = [format_phone_number(payment.phone_number) for payment in batch.payments]
+    keys = [
+        payment_key(current_user.sub, payment, f"{idempotency_key}:{index}" if idempotency_key else None, phone)
+        for index, (payment, phone) in enumerate(zip(batch.payments, phones))
+    ]
+    fingerprints = [payment_fingerprint(payment, idempotency_key) for payment in batch.payments]
+    if any(idempotency_cache.conflicts(key, fingerprint) for key, fingerprint in zip(keys, fingerprints)):
+        logger.warning(f"Idempotency key reused with a different batch by user {current_user.sub}")
+        raise key_reused()
+    
+    try:
+        access_token = await generate_access_token()
+    except Exception as e:
+        logger.error(f"Batch payment error for user {current_user.sub}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Payment processing failed")
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    semaphore = asyncio.Semaphore(
+        min(batch.concurrency or settings.MPESA_BATCH_CONCURRENCY, settings.MPESA_BATCH_CONCURRENCY)
+    )
+    
+    async def push(index: int, payment: MPESAPayment, phone: str) -> dict:
+        if not VALID_PHONE.match(phone):
+            return {"index": index, "status": "invalid", "phone_number": phone, "error": "Invalid phone number"}
+        async with semaphore:
+            try:
+                result, replayed = await idempotency_cache.run(
+                    keys[index],
+                    lambda: submit_stk_push(payment, current_user.sub, phone, access_token, timestamp),
+                    fingerprints[index]
+                )
+                return {"index": index, **result, "replayed": replayed}
+            except Exception as e:
+                logger.error(f"Batch payment item {index} failed for user {current_user.sub}: {str(e)}")
+                return {"index": index, "status": "error", "phone_number": phone, "error": "Payment processing failed"}
+    
+    async def results():
+        tasks = [
+            asyncio.ensure_future(push(index, payment, phone))
+            for index, (payment, phone) in enumerate(zip(batch.payments, phones))
+        ]
+        submitted = 0
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                submitted += result["status"] == "pending"
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"summary": {
+                "total": len(tasks),
+                "submitted": submitted,
+                "failed": len(tasks) - submitted
+            }}) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+def payment_status(payment: dict) -> dict:
+    """Shape a stored payment for status responses"""
+    return {
+        "transaction_id": payment["transaction_id"],
+        "checkout_request_id": payment.get("checkout_request_id"),
+        "status": payment["status"],
+        "result_desc": payment.get("result_desc"),
+        "mpesa_receipt": payment.get("mpesa_receipt"),
+        "amount": payment.get("amount"),
+        "timestamp": payment.get("updated_at")
+    }
+
 @router.get("/payment/{transaction_id}")
 async def get_payment_status(
     transaction_id: str,
@@ -145,15 +342,12 @@ async def get_payment_status(
     try:
         logger.info(f"Checking payment status for user {current_user.sub}, transaction: {transaction_id}")
         
-        # Here you would check the status in your database
-        # For demo, we'll return completed if it's a valid transaction ID
-        if transaction_id.startswith("MPESA_"):
-            return {
-                "transaction_id": transaction_id,
-                "status": "completed",
-                "timestamp": datetime.now().isoformat()
-            }
-        raise HTTPException(404, "Transaction not found")
+        payment = await payment_store.get(transaction_id)
+        if not payment or payment.get("user_id") != current_user.sub:
+            raise HTTPException(404, "Transaction not found")
+        return payment_status(payment)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Status check error for user {current_user.sub}: {str(e)}")
         raise HTTPException(
@@ -161,28 +355,73 @@ async def get_payment_status(
             detail="Failed to check payment status"
         )
 
+@router.get("/payment/{transaction_id}/wait")
+async def wait_for_payment_status(
+    transaction_id: str,
+    timeout: float = Query(25.0, gt=0),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Long-poll variant of the status route.
+
+    Responds as soon as the callback for this payment is applied, or with
+    the current (possibly still pending) status once ``timeout`` elapses.
+    """
+    payment = await payment_store.get(transaction_id)
+    if not payment or payment.get("user_id") != current_user.sub:
+        raise HTTPException(404, "Transaction not found")
+    
+    timeout = min(timeout, settings.PAYMENT_WAIT_TIMEOUT)
+    payment = await payment_store.wait_for_update(transaction_id, timeout)
+    return payment_status(payment)
+
+@router.get("/payment/{transaction_id}/events")
+async def stream_payment_status(
+    transaction_id: str,
+    request: Request,
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Server-Sent Events variant of the status route.
+
+    Sends the current status immediately, keeps the connection alive with
+    comments while the payment is pending and closes after the final status.
+    """
+    payment = await payment_store.get(transaction_id)
+    if not payment or payment.get("user_id") != current_user.sub:
+        raise HTTPException(404, "Transaction not found")
+    
+    async def events():
+        current = payment
+        yield f"event: status\ndata: {json.dumps(payment_status(current))}\n\n"
+        while current["status"] == "pending":
+            if await request.is_disconnected():
+                return
+            current = await payment_store.wait_for_update(transaction_id, SSE_HEARTBEAT_INTERVAL)
+            if current is None:
+                return
+            if current["status"] == "pending":
+                yield ": keep-alive\n\n"
+        yield f"event: status\ndata: {json.dumps(payment_status(current))}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/callback")
-async def mpesa_callback(data: dict):
-    """Handle M-PESA callback"""
+async def mpesa_callback(request: Request):
+    """Handle M-PESA callback.
+
+    The raw body is queued durably and acknowledged straight away; the
+    callback workers apply it to the payment store in batches.
+    """
     try:
-        # Log callback data
-        logger.info("M-PESA Callback received:", data)
-        
-        # Extract relevant information
-        result_code = data.get("Body", {}).get("stkCallback", {}).get("ResultCode")
-        checkout_request_id = data.get("Body", {}).get("stkCallback", {}).get("CheckoutRequestID")
-        
-        if result_code == 0:
-            # Payment successful
-            # Here you would update your database
-            logger.info(f"Payment successful for checkout request {checkout_request_id}")
-        else:
-            # Payment failed
-            logger.info(f"Payment failed for checkout request {checkout_request_id}")
-            
+        body = await request.body()
+        callback_queue.append(body.decode("utf-8"))
+        logger.info("M-PESA callback queued (%d bytes)", len(body))
         return {"status": "success"}
     except Exception as e:
-        logger.error(f"Error processing callback: {str(e)}")
+        logger.error(f"Error queueing callback: {str(e)}")
         return {"status": "error", "message": str(e)}
 
 @router.post("/mpesa")
@@ -206,6 +445,17 @@ async def initiate_mpesa_payment(payment: PaymentRequest):
             detail="Payment processing failed"
         )
 
+@router.get("/metrics")
+async def payment_metrics():
+    """Report M-PESA integration counters"""
+    return {
+        "token_cache": token_cache.stats(),
+        "daraja": daraja.stats(),
+        "callback_queue": callback_queue.stats(),
+        "payment_store": payment_store.stats(),
+        "idempotency": idempotency_cache.stats()
+    }
+
 @router.get("/")
 def get_payments():
     return {"message": "Payments route is working!"}
\ No newline at end of file
@@ -1,11 +1,47 @@
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import AsyncIterator, Iterator, Optional, List, Tuple
 from datetime import datetime
-from .auth import get_current_user_from_token, User
-from db import get_supabase
+import asyncio
+import base64
+import csv
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import uuid
+from .auth import get_current_user, TokenData
+from circuit_breaker import CircuitBreaker, CircuitOpen
+from config import settings
+from db import Database, PoolTimeout, QueryTimeout, get_database, is_outage
+from analytics import summarize
+from response_cache import ResponseCache
+from rollups import RollupStore, summarize_rollups
+from write_queue import WriteQueue
 
-router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Resolved per call so tests can swap the database
+rollup_store = RollupStore(lambda: get_database())
+response_cache = ResponseCache(settings.RESPONSE_CACHE_SIZE)
+# Writes accepted while the database circuit is open
+pending_writes = WriteQueue(os.path.join(settings.DATA_DIR, "pending_writes.db"))
+
+async def replay_pending_writes() -> None:
+    """Apply writes queued during an outage before serving anything newer"""
+    database = get_database()
+    if not pending_writes.maybe_pending or not database or database.breaker.state == CircuitBreaker.OPEN:
+        return
+    try:
+        await pending_writes.replay(apply_queued, transient=lambda e: is_outage(e) or isinstance(e, PoolTimeout))
+    except Exception as e:
+        logger.warning(f"Replaying queued writes failed, keeping them queued: {str(e)}")
+
+router = APIRouter(dependencies=[Depends(replay_pending_writes)])
 
 class Transaction(BaseModel):
     amount: float
@@ -15,92 +51,481 @@ class Transaction(BaseModel):
     date: Optional[datetime] = None
     image_url: Optional[str] = None
 
+# Columns clients may request through ``fields=``
+TRANSACTION_FIELDS = ["id", "amount", "description", "category", "type", "date", "image_url", "created_at"]
+# Always fetched so the next page's cursor can be built
+KEYSET_FIELDS = ["date", "id"]
+MAX_PAGE_SIZE = 500
+MAX_BULK_DELETE = 1000
+# Columns the summary needs
+SUMMARY_FIELDS = "amount,type,category,date"
+
+def require_database() -> Database:
+    database = get_database()
+    if not database:
+        raise HTTPException(status_code=503, detail="Database service unavailable")
+    return database
+
+def database_error(e: Exception) -> HTTPException:
+    """Map a failed query to a response"""
+    if isinstance(e, CircuitOpen):
+        return HTTPException(status_code=503, detail="Database unavailable", headers={"Retry-After": e.retry_after_header})
+    if isinstance(e, PoolTimeout):
+        return HTTPException(status_code=503, detail="Database busy", headers={"Retry-After": "1"})
+    if isinstance(e, QueryTimeout):
+        return HTTPException(status_code=504, detail="Database query timed out")
+    if is_outage(e):
+        return HTTPException(status_code=503, detail="Database unavailable")
+    logger.error(f"Database query failed: {str(e)}")
+    return HTTPException(status_code=500, detail="Database query failed")
+
+def unavailable(e: Exception) -> bool:
+    """Whether a failed read may be answered with the last response served"""
+    return isinstance(e, HTTPException) and e.status_code in (503, 504)
+
+async def apply_queued(entry: dict) -> None:
+    """Replay one write queued during an outage"""
+    database = require_database()
+    user_id = entry["user_id"]
+    # Both actions return only the rows they changed, so replaying an entry
+    # again after a crash leaves the rollups alone
+    if entry["action"] == "insert":
+        # Queued rows carry their ID, so a repeated replay inserts nothing
+        result = await database.table("transactions")\
+            .upsert(entry["rows"], on_conflict="id", ignore_duplicates=True)\
+            .execute()
+        sign = 1
+    else:
+        result = await database.table("transactions")\
+            .delete()\
+            .in_("id", entry["ids"])\
+            .eq("user_id", user_id)\
+            .execute()
+        sign = -1
+    if result.data:
+        response_cache.invalidate(user_id)
+    await rollup_store.apply(user_id, result.data, sign=sign)
+
+def encode_cursor(row: dict) -> str:
+    """Opaque cursor pointing just past ``row`` in (date, id) order"""
+    raw = json.dumps([row["date"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        date, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(date), str(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def select_columns(fields: Optional[str]) -> str:
+    """Translate a ``fields=`` projection into a select list"""
+    if not fields:
+        return "*"
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = sorted(set(requested) - set(TRANSACTION_FIELDS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ",".join(dict.fromkeys(requested + KEYSET_FIELDS))
+
+def page_query(
+    db,
+    user_id: str,
+    columns: str,
+    limit: int,
+    after: Optional[Tuple[str, str]] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    type: Optional[str] = None
+):
+    """Build the query for one page of a user's transactions in (date, id) order"""
+    query = db.table("transactions")\
+        .select(columns)\
+        .eq("user_id", user_id)
+    if type:
+        query = query.eq("type", type)
+    if start_date:
+        query = query.gte("date", start_date.isoformat())
+    if end_date:
+        query = query.lte("date", end_date.isoformat())
+    if after:
+        date, row_id = after
+        query = query.or_(f'date.lt."{date}",and(date.eq."{date}",id.lt."{row_id}")')
+    return query\
+        .order("date", desc=True)\
+        .order("id", desc=True)\
+        .limit(limit)
+
+def content_hash(user_id: str, data: dict) -> str:
+    """Fingerprint of a transaction's contents, used to skip re-imported rows"""
+    parts = [user_id, data["date"], float(data["amount"]), data["type"], data["category"], data["description"]]
+    return hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+
+def transaction_row(user_id: str, transaction: Transaction, created_at: str) -> dict:
+    """Shape a validated transaction for insertion"""
+    data = {
+        "user_id": user_id,
+        **jsonable_encoder(transaction),
+        "created_at": created_at
+    }
+    # Pagination orders by date, so every row needs one
+    data["date"] = data["date"] or created_at
+    return data
+
+def cache_key(request: Request) -> str:
+    """Identify a read by its path and query, independent of parameter order"""
+    return f"{request.url.path}?{sorted(request.query_params.multi_items())}"
+
+def iter_upload_rows(upload: UploadFile) -> Iterator[Tuple[int, dict]]:
+    """Yield ``(row number, fields)`` from a CSV, JSON or NDJSON upload.
+
+    CSV and NDJSON are read a line at a time; a JSON upload is one array.
+    CSV headers are matched case-insensitively, so exports re-import as is.
+    """
+    name = (upload.filename or "").lower()
+    text = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+    if name.endswith(".csv") or upload.content_type in ("text/csv", "application/vnd.ms-excel"):
+        reader = csv.DictReader(text)
+        reader.fieldnames = [field.strip().lower() for field in reader.fieldnames or []]
+        for row in reader:
+            yield reader.line_num, {key: value for key, value in row.items() if value not in (None, "")}
+    elif name.endswith((".ndjson", ".jsonl")) or upload.content_type == "application/x-ndjson":
+        for number, line in enumerate(text, start=1):
+            if line.strip():
+                yield number, json.loads(line)
+    elif name.endswith(".json") or upload.content_type == "application/json":
+        yield from enumerate(json.load(text), start=1)
+    else:
+        raise HTTPException(status_code=400, detail="Upload a .csv, .json or .ndjson file")
+
+async def fetch_pages(
+    database: Database, user_id: str, columns: str, page_size: int = 1000, **filters
+) -> AsyncIterator[List[dict]]:
+    """Walk every page of a user's transactions through the async database"""
+    if columns != "*":
+        columns = ",".join(dict.fromkeys(columns.split(",") + KEYSET_FIELDS))
+    after = None
+    while True:
+        rows = (await page_query(database, user_id, columns, page_size, after, **filters).execute()).data
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        after = (rows[-1]["date"], rows[-1]["id"])
+
 @router.post("/")
 async def create_transaction(
     transaction: Transaction,
-    current_user: User = Depends(get_current_user_from_token)
+    current_user: TokenData = Depends(get_current_user)
 ):
-    supabase = get_supabase()
-    if not supabase:
-        raise HTTPException(status_code=503, detail="Database service unavailable")
-    
+    database = require_database()
+
+    data = transaction_row(current_user.sub, transaction, datetime.now().isoformat())
     try:
-        data = {
-            "user_id": current_user.id,
-            **transaction.dict(),
-            "created_at": datetime.now().isoformat()
-        }
-        result = supabase.table("transactions").insert(data).execute()
-        return result.data[0] if result.data else data
+        result = await database.table("transactions").insert(data).execute()
+    except CircuitOpen:
+        # Never sent, so it is safe to queue; replay is applied in order
+        data = {"id": str(uuid.uuid4()), **data}
+        await pending_writes.append({"user_id": current_user.sub, "action": "insert", "rows": [data]})
+        return JSONResponse(status_code=202, content={**data, "queued": True})
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise database_error(e)
+
+    created = result.data[0] if result.data else data
+    response_cache.invalidate(current_user.sub)
+    await rollup_store.apply(current_user.sub, [created])
+    return created
 
-@router.get("/", response_model=List[Transaction])
+@router.get("/")
 async def get_transactions(
-    current_user: User = Depends(get_current_user_from_token)
+    request: Request,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    type: Optional[str] = Query(None, regex="^(income|expense)$"),
+    current_user: TokenData = Depends(get_current_user)
 ):
-    supabase = get_supabase()
-    if not supabase:
-        raise HTTPException(status_code=503, detail="Database service unavailable")
-    
+    """List the user's transactions, newest first, one page at a time.
+
+    Pages are keyset-paginated on ``(date, id)``: pass the ``X-Next-Cursor``
+    header of one response as ``cursor`` to get the next page. ``fields``
+    limits the columns returned; date range and type filters are applied
+    in the query. Pages are cached until the user's next write and carry
+    ETag/Last-Modified for conditional requests.
+    """
+    columns = select_columns(fields)
+    after = decode_cursor(cursor) if cursor else None
+
+    async def load():
+        database = require_database()
+        try:
+            result = await page_query(
+                database, current_user.sub, columns, limit + 1, after,
+                start_date=start_date, end_date=end_date, type=type
+            ).execute()
+        except Exception as e:
+            raise database_error(e)
+
+        rows = result.data[:limit]
+        headers = {"X-Next-Cursor": encode_cursor(rows[-1])} if len(result.data) > limit else {}
+        return rows, headers
+
+    return await response_cache.read(
+        current_user.sub, cache_key(request), request.headers, load, stale_if=unavailable
+    )
+
+@router.get("/summary")
+async def get_transaction_summary(
+    request: Request,
+    period: str = Query("daily", regex="^(daily|weekly|monthly)$"),
+    category_type: str = Query("expense", regex="^(income|expense)$"),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Totals, per-category sums and per-period buckets for dashboards.
+
+    Whole-history summaries are read from the user's rollups, which are
+    built from a full scan the first time. Date-ranged summaries scan the
+    matching rows. While the database is unreachable the last summary
+    served for the same request is returned, marked stale.
+    """
+    async def load():
+        rows = []
+        async for page in fetch_pages(
+            require_database(), current_user.sub, SUMMARY_FIELDS,
+            start_date=start_date, end_date=end_date
+        ):
+            rows.extend(page)
+        return rows
+
+    async def compute():
+        try:
+            if start_date or end_date:
+                return summarize(await load(), period, category_type), {}
+
+            try:
+                rollups = await rollup_store.load(current_user.sub)
+                if rollups is not None:
+                    return summarize_rollups(rollups, period, category_type), {}
+                token = await rollup_store.start_build(current_user.sub)
+            except Exception as e:
+                # Without the rollup table, scan; the scan surfaces a real outage
+                logger.warning(f"Rollups unavailable for {current_user.sub}, scanning: {str(e)}")
+                token = None
+
+            rows = await load()
+            if token is not None:
+                try:
+                    await rollup_store.rebuild(current_user.sub, rows, token)
+                except Exception as e:
+                    logger.warning(f"Could not rebuild rollups for {current_user.sub}: {str(e)}")
+            return summarize(rows, period, category_type), {}
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise database_error(e)
+
+    return await response_cache.refresh(current_user.sub, cache_key(request), compute, stale_if=unavailable)
+
+class BulkDelete(BaseModel):
+    ids: List[str]
+
+@router.get("/metrics")
+async def transaction_metrics():
+    """Report read cache, database pool and queued write counters"""
+    database = get_database()
+    return {
+        "response_cache": response_cache.stats(),
+        "database": database.stats() if database else None,
+        "pending_writes": await asyncio.to_thread(pending_writes.stats)
+    }
+
+@router.post("/bulk-delete")
+async def delete_transactions(
+    request: BulkDelete,
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Delete many of the user's transactions in one statement.
+
+    IDs that do not exist or belong to someone else are reported as
+    ``not_found``.
+    """
+    if not request.ids:
+        raise HTTPException(status_code=400, detail="No transaction IDs supplied")
+    if len(request.ids) > MAX_BULK_DELETE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_DELETE} IDs per request")
+
+    database = require_database()
+
     try:
-        result = supabase.table("transactions")\
-            .select("*")\
-            .eq("user_id", current_user.id)\
+        result = await database.table("transactions")\
+            .delete()\
+            .in_("id", request.ids)\
+            .eq("user_id", current_user.sub)\
+            .execute()
+    except CircuitOpen:
+        ids = list(dict.fromkeys(request.ids))
+        await pending_writes.append({"user_id": current_user.sub, "action": "delete", "ids": ids})
+        return JSONResponse(status_code=202, content={"queued": ids})
+    except Exception as e:
+        raise database_error(e)
+
+    if result.data:
+        response_cache.invalidate(current_user.sub)
+    await rollup_store.apply(current_user.sub, result.data, sign=-1)
+    deleted = {str(row["id"]) for row in result.data}
+    return {
+        "deleted": [row_id for row_id in dict.fromkeys(request.ids) if row_id in deleted],
+        "not_found": [row_id for row_id in dict.fromkeys(request.ids) if row_id not in deleted]
+    }
+
+@router.post("/import")
+async def import_transactions(
+    file: UploadFile = File(...),
+    batch_size: int = Query(settings.IMPORT_BATCH_SIZE, ge=1, le=settings.IMPORT_MAX_BATCH_SIZE),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Bulk-insert transactions from an uploaded statement.
+
+    Rows are validated as they are read and inserted ``batch_size`` at a
+    time. Rows whose contents match an existing transaction are skipped, so
+    re-uploading a statement is harmless. Progress is streamed as one NDJSON
+    line per batch, followed by a summary line.
+    """
+    database = require_database()
+
+    rows = iter_upload_rows(file)
+    created_at = datetime.now().isoformat()
+    seen = set()
+    counts = {"total": 0, "inserted": 0, "duplicates": 0, "invalid": 0}
+
+    def next_batch() -> Tuple[List[dict], List[dict]]:
+        """Read until ``batch_size`` valid, unseen rows are collected"""
+        batch, errors = [], []
+        for number, fields in rows:
+            counts["total"] += 1
+            try:
+                if not isinstance(fields, dict):
+                    raise ValueError("row must be an object")
+                if fields.get("type") not in ("income", "expense"):
+                    raise ValueError("type must be income or expense")
+                data = transaction_row(current_user.sub, Transaction(**fields), created_at)
+                data["content_hash"] = content_hash(current_user.sub, data)
+            except (ValidationError, ValueError, TypeError) as e:
+                counts["invalid"] += 1
+                errors.append({"row": number, "error": str(e)})
+                continue
+            if data["content_hash"] in seen:
+                counts["duplicates"] += 1
+                continue
+            seen.add(data["content_hash"])
+            batch.append(data)
+            if len(batch) >= batch_size:
+                break
+        return batch, errors
+
+    async def insert_batch(batch: List[dict]) -> List[dict]:
+        """Insert the rows not already stored in one round-trip; the unique
+        (user_id, content_hash) index skips the rest, even across concurrent imports"""
+        result = await database.table("transactions")\
+            .upsert(batch, on_conflict="user_id,content_hash", ignore_duplicates=True)\
             .execute()
         return result.data
+
+    # Parse the first batch up front so a malformed upload still gets a 400
+    try:
+        first = await asyncio.to_thread(next_batch)
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=400, detail=f"Could not read upload: {str(e)}")
+
+    async def progress():
+        pending = first
+        for number in itertools.count(1):
+            batch, errors = pending
+            if not batch and not errors:
+                break
+            inserted = []
+            try:
+                if batch:
+                    inserted = await insert_batch(batch)
+            except Exception as e:
+                yield json.dumps({"batch": number, "status": "error", "error": str(e)}) + "\n"
+                break
+            counts["inserted"] += len(inserted)
+            if inserted:
+                response_cache.invalidate(current_user.sub)
+            counts["duplicates"] += len(batch) - len(inserted)
+            await rollup_store.apply(current_user.sub, inserted)
+            yield json.dumps({
+                "batch": number,
+                "inserted": len(inserted),
+                "duplicates": len(batch) - len(inserted),
+                "errors": errors
+            }) + "\n"
+            try:
+                pending = await asyncio.to_thread(next_batch)
+            except Exception as e:
+                yield json.dumps({"batch": number + 1, "status": "error", "error": f"Could not read upload: {str(e)}"}) + "\n"
+                break
+        yield json.dumps({"summary": counts}) + "\n"
+
+    return StreamingResponse(progress(), media_type="application/x-ndjson")
 
 @router.get("/{transaction_id}")
 async def get_transaction(
     transaction_id: str,
-    current_user: User = Depends(get_current_user_from_token)
+    request: Request,
+    current_user: TokenData = Depends(get_current_user)
 ):
-    supabase = get_supabase()
-    if not supabase:
-        raise HTTPException(status_code=503, detail="Database service unavailable")
-    
-    try:
-        result = supabase.table("transactions")\
-            .select("*")\
-            .eq("id", transaction_id)\
-            .eq("user_id", current_user.id)\
-            .single()\
-            .execute()
+    async def load():
+        database = require_database()
+        try:
+            result = await database.table("transactions")\
+                .select("*")\
+                .eq("id", transaction_id)\
+                .eq("user_id", current_user.sub)\
+                .limit(1)\
+                .execute()
+        except Exception as e:
+            raise database_error(e)
         if not result.data:
             raise HTTPException(status_code=404, detail="Transaction not found")
-        return result.data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return result.data[0], {}
+
+    return await response_cache.read(
+        current_user.sub, cache_key(request), request.headers, load, stale_if=unavailable
+    )
 
 @router.delete("/{transaction_id}")
 async def delete_transaction(
     transaction_id: str,
-    current_user: User = Depends(get_current_user_from_token)
+    current_user: TokenData = Depends(get_current_user)
 ):
-    supabase = get_supabase()
-    if not supabase:
-        raise HTTPException(status_code=503, detail="Database service unavailable")
-    
+    database = require_database()
+
     try:
-        # First verify the transaction belongs to the user
-        result = supabase.table("transactions")\
-            .select("id")\
-            .eq("id", transaction_id)\
-            .eq("user_id", current_user.id)\
-            .single()\
-            .execute()
-            
-        if not result.data:
-            raise HTTPException(status_code=404, detail="Transaction not found")
-            
-        # Then delete it
-        supabase.table("transactions")\
+        # Scoped by owner, so checking and deleting is one statement
+        result = await database.table("transactions")\
             .delete()\
             .eq("id", transaction_id)\
+            .eq("user_id", current_user.sub)\
             .execute()
-            
-        return {"message": f"Transaction {transaction_id} deleted successfully"}
+    except CircuitOpen:
+        await pending_writes.append({"user_id": current_user.sub, "action": "delete", "ids": [transaction_id]})
+        return JSONResponse(status_code=202, content={
+            "message": f"Transaction {transaction_id} will be deleted once the database is reachable",
+            "queued": True
+        })
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise database_error(e)
+    if not result.data:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+
+    response_cache.invalidate(current_user.sub)
+    await rollup_store.apply(current_user.sub, result.data, sign=-1)
+    return {"message": f"Transaction {transaction_id} deleted successfully", "transaction": result.data[0]}
@@ -1,10 +1,20 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, HTTPException, Depends, Header, Query, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from starlette.requests import ClientDisconnect
 import os
 import logging
 from typing import List
 from datetime import datetime
+import asyncio
+import hashlib
+from PIL import UnidentifiedImageError
 from .auth import get_current_user, TokenData
-import shutil
+from config import settings
+from blob_store import BlobStore, FileTooLarge
+from file_responses import IMMUTABLE, file_response
+from image_pipeline import ImagePipeline, VARIANT_SIZES, strip_metadata
+from upload_sessions import OffsetMismatch, SessionBusy, SessionNotFound, SessionOverflow, UploadSessions
 
 # Configure route-specific logging
 logger = logging.getLogger(__name__)
@@ -16,37 +26,98 @@ UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 os.makedirs(os.path.join(UPLOAD_DIR, "audio"), exist_ok=True)
 os.makedirs(os.path.join(UPLOAD_DIR, "images"), exist_ok=True)
 
+# Upload contents are stored once by hash; each user's index maps names to blobs
+blob_store = BlobStore(
+    os.path.join(UPLOAD_DIR, "blobs"),
+    os.path.join(settings.DATA_DIR, "upload_index.db")
+)
+# Thumbnails and web-sized copies of images are rendered in worker processes
+image_pipeline = ImagePipeline(settings.IMAGE_WORKERS)
+# Partly received resumable uploads
+upload_sessions = UploadSessions(os.path.join(UPLOAD_DIR, "sessions"), settings.UPLOAD_SESSION_TTL)
+
 ALLOWED_IMAGE_TYPES = ["image/jpeg", "image/png", "image/gif"]
 ALLOWED_AUDIO_TYPES = ["audio/mpeg", "audio/wav", "audio/ogg"]
+# Room for multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 16 * 1024
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    content_type: str
+    size: int = Field(..., gt=0)
+
+class UploadSizeLimitMiddleware:
+    """Reject oversized uploads from their Content-Length before the body is read"""
+
+    def __init__(self, app, prefix: str = "/uploads"):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] in ("POST", "PUT", "PATCH") \
+                and scope["path"].startswith(self.prefix):
+            length = dict(scope["headers"]).get(b"content-length")
+            if length and length.isdigit() and int(length) > settings.MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD:
+                response = JSONResponse({"detail": "File too large"}, status_code=413)
+                return await response(scope, receive, send)
+        return await self.app(scope, receive, send)
+
+def upload_filename(username: str, original: str) -> str:
+    """Create timestamp-based filename with username"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{username}_{timestamp}_{os.path.basename(original or 'upload')}"
+
+async def save_upload_file(upload_file: UploadFile, file_type: str, username: str) -> dict:
+    """Stream an upload into the blob store without blocking the event loop.
 
-def save_upload_file(upload_file: UploadFile, file_type: str, username: str) -> str:
+    Returns:
+        dict: The stored entry with its ``filename``; ``duplicate`` is set
+        when identical content was already stored
+
+    Raises:
+        HTTPException: 413 once the file exceeds ``MAX_UPLOAD_SIZE``
+    """
+    filename = upload_filename(username, upload_file.filename)
+    kind = "images" if file_type == "image" else "audio"
+    
     try:
-        # Create timestamp-based filename with username
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{username}_{timestamp}_{upload_file.filename}"
-        
-        # Determine directory based on file type
-        if file_type == "image":
-            save_dir = os.path.join(UPLOAD_DIR, "images")
-        else:
-            save_dir = os.path.join(UPLOAD_DIR, "audio")
-            
-        # Ensure directory exists
-        os.makedirs(save_dir, exist_ok=True)
-        
-        # Save file
-        file_path = os.path.join(save_dir, filename)
-        with open(file_path, "wb") as buffer:
-            content = upload_file.file.read()
-            buffer.write(content)
-            
-        return filename
+        # One worker thread per upload hashes and copies chunk by chunk;
+        # photos lose their GPS and device metadata before they are stored
+        entry = await asyncio.to_thread(
+            blob_store.put, username, filename, upload_file.file, kind,
+            upload_file.content_type, settings.MAX_UPLOAD_SIZE,
+            strip_metadata if kind == "images" else None
+        )
+        return {"filename": filename, **entry}
+    except FileTooLarge:
+        raise HTTPException(status_code=413, detail="File too large")
     except Exception as e:
         logger.error(f"File upload error: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to save file")
 
+async def render_variants(key: str, source: str) -> dict:
+    """Generate every size variant of an image that is not on disk yet"""
+    targets = {
+        variant: blob_store.variant_path(key, variant)
+        for variant in VARIANT_SIZES
+    }
+    missing = {variant: path for variant, path in targets.items() if not os.path.exists(path)}
+    if not missing:
+        return {}
+    return await image_pipeline.process(key, source, missing)
+
+async def process_image(username: str, saved: dict) -> None:
+    """Background step after an image upload: render variants, record dimensions"""
+    try:
+        dimensions = await render_variants(saved["sha256"], blob_store.path(saved["sha256"]))
+        if dimensions:
+            await asyncio.to_thread(blob_store.update, username, saved["filename"], **dimensions)
+    except Exception as e:
+        logger.error(f"Image processing failed for user {username}: {saved['filename']}: {str(e)}")
+
 @router.post("/image")
 async def upload_image(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     current_user: TokenData = Depends(get_current_user)
 ):
@@ -57,13 +128,19 @@ async def upload_image(
             logger.warning(f"Invalid image type attempted by user {current_user.sub}: {file.content_type}")
             raise HTTPException(status_code=400, detail="Invalid image type")
         
-        filename = save_upload_file(file, "image", current_user.sub)
-        logger.info(f"Image saved successfully for user {current_user.sub}: {filename}")
+        saved = await save_upload_file(file, "image", current_user.sub)
+        logger.info(f"Image saved successfully for user {current_user.sub}: {saved['filename']}")
+        background_tasks.add_task(process_image, current_user.sub, saved)
         
         return {
             "message": "Image uploaded successfully",
-            "filename": filename
+            "filename": saved["filename"],
+            "sha256": saved["sha256"],
+            "size": saved["size"],
+            "duplicate": saved["duplicate"]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Image upload error for user {current_user.sub}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to upload image")
@@ -80,40 +157,205 @@ async def upload_audio(
             logger.warning(f"Invalid audio type attempted by user {current_user.sub}: {file.content_type}")
             raise HTTPException(status_code=400, detail="Invalid audio type")
         
-        filename = save_upload_file(file, "audio", current_user.sub)
-        logger.info(f"Audio saved successfully for user {current_user.sub}: {filename}")
+        saved = await save_upload_file(file, "audio", current_user.sub)
+        logger.info(f"Audio saved successfully for user {current_user.sub}: {saved['filename']}")
         
         return {
             "message": "Audio uploaded successfully",
-            "filename": filename
+            "filename": saved["filename"],
+            "sha256": saved["sha256"],
+            "size": saved["size"],
+            "duplicate": saved["duplicate"]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Audio upload error for user {current_user.sub}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to upload audio")
 
+def session_response(session: dict, status_code: int = 200) -> JSONResponse:
+    return JSONResponse(
+        {
+            "session_id": session["id"],
+            "offset": session["offset"],
+            "size": session["size"],
+            "expires_at": datetime.fromtimestamp(session["expires_at"]).isoformat()
+        },
+        status_code=status_code,
+        headers={"Upload-Offset": str(session["offset"])}
+    )
+
+def offset_conflict(e: OffsetMismatch) -> JSONResponse:
+    return JSONResponse(
+        {"detail": str(e), "offset": e.offset},
+        status_code=409,
+        headers={"Upload-Offset": str(e.offset)}
+    )
+
+@router.post("/sessions", status_code=201)
+async def create_upload_session(
+    upload: UploadSessionCreate,
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Start a resumable audio upload; send the bytes with PATCH, then complete it"""
+    if upload.content_type not in ALLOWED_AUDIO_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid audio type")
+    if upload.size > settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="File too large")
+    try:
+        session = await asyncio.to_thread(
+            upload_sessions.create, current_user.sub, upload.filename, upload.content_type, upload.size
+        )
+        logger.info(f"Upload session {session['id']} started by user {current_user.sub}: {upload.filename}")
+        response = session_response(session, status_code=201)
+        response.headers["Location"] = f"/uploads/sessions/{session['id']}"
+        return response
+    except Exception as e:
+        logger.error(f"Upload session error for user {current_user.sub}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to start upload")
+
+@router.get("/sessions/{session_id}")
+async def get_upload_session(
+    session_id: str,
+    current_user: TokenData = Depends(get_current_user)
+):
+    """How many bytes of the upload have been stored, i.e. where to resume"""
+    try:
+        session = await asyncio.to_thread(upload_sessions.get, current_user.sub, session_id)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session_response(session)
+
+@router.patch("/sessions/{session_id}")
+async def append_upload_session(
+    session_id: str,
+    request: Request,
+    upload_offset: int = Header(..., ge=0),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Append the request body at ``Upload-Offset``.
+
+    Bytes are kept as they arrive, so after a dropped connection the client
+    asks for the offset and sends only the rest.
+    """
+    try:
+        session = await upload_sessions.append(current_user.sub, session_id, upload_offset, request.stream())
+        return session_response(session)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    except SessionBusy:
+        raise HTTPException(status_code=409, detail="Upload session is already receiving data")
+    except OffsetMismatch as e:
+        return offset_conflict(e)
+    except SessionOverflow as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ClientDisconnect:
+        logger.info(f"Upload session {session_id} interrupted for user {current_user.sub}")
+        raise HTTPException(status_code=400, detail="Upload interrupted")
+    except Exception as e:
+        logger.error(f"Upload session write error for user {current_user.sub}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to save upload data")
+
+@router.post("/sessions/{session_id}/complete")
+async def complete_upload_session(
+    session_id: str,
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Move a fully received upload into storage, like a one-shot audio upload"""
+    def store(path: str, session: dict) -> dict:
+        filename = upload_filename(current_user.sub, session["filename"])
+        with open(path, "rb") as f:
+            entry = blob_store.put(
+                current_user.sub, filename, f, "audio", session["content_type"], settings.MAX_UPLOAD_SIZE
+            )
+        return {"filename": filename, **entry}
+
+    try:
+        saved = await asyncio.to_thread(upload_sessions.complete, current_user.sub, session_id, store)
+        logger.info(f"Audio saved successfully for user {current_user.sub}: {saved['filename']}")
+        return {
+            "message": "Audio uploaded successfully",
+            "filename": saved["filename"],
+            "sha256": saved["sha256"],
+            "size": saved["size"],
+            "duplicate": saved["duplicate"]
+        }
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    except SessionBusy:
+        raise HTTPException(status_code=409, detail="Upload session is still receiving data")
+    except OffsetMismatch as e:
+        return offset_conflict(e)
+    except Exception as e:
+        logger.error(f"Upload session completion error for user {current_user.sub}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to complete upload")
+
+@router.delete("/sessions/{session_id}")
+async def cancel_upload_session(
+    session_id: str,
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Abandon an upload and delete what was received"""
+    try:
+        session = await asyncio.to_thread(upload_sessions.get, current_user.sub, session_id)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    await asyncio.to_thread(upload_sessions.discard, session["id"])
+    return {"message": "Upload cancelled"}
+
 @router.get("/files/{file_type}/{filename}")
 async def get_file(
     file_type: str,
     filename: str,
+    request: Request,
+    size: str = Query("original", regex="^(original|thumb|web)$"),
     current_user: TokenData = Depends(get_current_user)
 ):
+    """Serve one of the user's uploads; images also come as ``thumb`` or ``web`` JPEGs.
+
+    Supports byte ranges for seeking in audio, and ETag revalidation.
+    """
     try:
         if file_type not in ["audio", "images"]:
             raise HTTPException(400, "Invalid file type")
-            
-        file_path = os.path.join(UPLOAD_DIR, file_type, filename)
         
         # Security check: ensure the file belongs to the user
         if not filename.startswith(f"{current_user.sub}_"):
             logger.warning(f"Unauthorized file access attempt by user {current_user.sub}: {filename}")
             raise HTTPException(403, "Access denied")
+        
+        entry = await asyncio.to_thread(blob_store.lookup, current_user.sub, filename)
+        if entry and entry["kind"] == file_type:
+            key, file_path, media_type = entry["sha256"], blob_store.path(entry["sha256"]), entry["content_type"]
+            etag = key
+        else:
+            # Uploads saved before the blob store
+            file_path, media_type = os.path.join(UPLOAD_DIR, file_type, filename), None
+            key = hashlib.sha256(file_path.encode()).hexdigest()
+            etag = None
             
         if not os.path.exists(file_path):
             logger.warning(f"File not found for user {current_user.sub}: {filename}")
             raise HTTPException(404, "File not found")
+        
+        if size != "original":
+            if file_type != "images":
+                raise HTTPException(400, "Size variants are only available for images")
+            try:
+                # Normally rendered after upload; covers older files and failed jobs
+                await render_variants(key, file_path)
+            except UnidentifiedImageError:
+                raise HTTPException(415, "File is not a readable image")
+            file_path, media_type = blob_store.variant_path(key, size), "image/jpeg"
+            etag = f"{key}-{size}"
             
         logger.info(f"File accessed by user {current_user.sub}: {filename}")
-        return FileResponse(file_path)
+        return file_response(
+            request.headers, file_path, media_type, etag,
+            cache_control=f"private, {IMMUTABLE}", method=request.method
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"File access error for user {current_user.sub}: {str(e)}")
         raise HTTPException(500, "Failed to access file") 
\ No newline at end of file
@@ -11,8 +11,10 @@ setup(
         "supabase==2.3.4",
         "SpeechRecognition==3.10.0",
         "Pillow==10.0.0",
+        "numpy==1.26.4",
         "pytesseract==0.3.10",
         "PyJWT==2.8.0",
+        "httpx==0.25.2",
         "python-multipart==0.0.6",
         "pydantic==2.6.1",
         "starlette==0.36.3",
@@ -0,0 +1,397 @@
+"""Embedded SQLite storage for single-node and offline deployments.
+
+``SQLiteStore`` offers the subset of the Supabase ``table()`` query
+builder the app uses, so it can stand in for the remote client anywhere:
+directly, where code calls ``execute()`` in a worker thread, or behind
+``db.Database``.
+
+Reads run on per-thread connections, which WAL mode lets proceed
+alongside writes. All writes go to one writer thread that commits
+whatever has queued up in a single transaction, so concurrent requests
+share fsyncs instead of contending for the write lock.
+"""
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# table -> (primary key, {column: SQLite type})
+TABLES: Dict[str, Tuple[str, Dict[str, str]]] = {
+    "transactions": ("id", {
+        "id": "TEXT", "user_id": "TEXT NOT NULL", "amount": "REAL", "description": "TEXT",
+        "category": "TEXT", "type": "TEXT", "date": "TEXT", "image_url": "TEXT",
+        "created_at": "TEXT", "content_hash": "TEXT"
+    }),
+    "transaction_rollups": ("id", {
+        "id": "TEXT", "user_id": "TEXT NOT NULL", "kind": "TEXT", "bucket": "TEXT",
+        "income": "REAL", "expenses": "REAL", "income_count": "INTEGER", "expense_count": "INTEGER"
+    }),
+    "payments": ("transaction_id", {
+        "transaction_id": "TEXT", "checkout_request_id": "TEXT", "merchant_request_id": "TEXT",
+        "user_id": "TEXT", "phone_number": "TEXT", "amount": "REAL", "status": "TEXT",
+        "result_code": "INTEGER", "result_desc": "TEXT", "mpesa_receipt": "TEXT",
+        "created_at": "TEXT", "updated_at": "TEXT"
+    })
+}
+
+INDEXES = [
+    # Pages walk this index newest first; it also holds every column the
+    # summary reads, so summaries never touch the table
+    "CREATE INDEX IF NOT EXISTS transactions_user_date"
+    " ON transactions (user_id, date, id, type, category, amount)",
+    # Imports skip rows already stored by conflicting on this index
+    "DROP INDEX IF EXISTS transactions_user_hash",
+    "CREATE UNIQUE INDEX IF NOT EXISTS transactions_user_content_hash"
+    " ON transactions (user_id, content_hash)",
+    "CREATE INDEX IF NOT EXISTS transaction_rollups_user ON transaction_rollups (user_id)",
+    "CREATE INDEX IF NOT EXISTS payments_checkout ON payments (checkout_request_id)"
+]
+
+OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+# Writes committed together at most
+WRITE_BATCH_SIZE = 256
+
+
+class SQLiteResult:
+    def __init__(self, data, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+def _split_terms(text: str) -> List[str]:
+    """Split a PostgREST logical expression on top-level commas"""
+    parts, depth, current = [], 0, ""
+    for char in text:
+        if char == "," and depth == 0:
+            parts.append(current)
+            current = ""
+            continue
+        depth += char == "("
+        depth -= char == ")"
+        current += char
+    parts.append(current)
+    return parts
+
+
+class SQLiteQuery:
+    """One query against a table, built with the Supabase client's methods"""
+
+    def __init__(self, store: "SQLiteStore", table: str):
+        if table not in TABLES:
+            raise ValueError(f"Unknown table: {table}")
+        self._store = store
+        self._table = table
+        self._key, self._columns = TABLES[table]
+        self._action = "select"
+        self._select = list(self._columns)
+        self._payload = None
+        self._conflict: List[str] = [self._key]
+        self._ignore_duplicates = False
+        self._where: List[Tuple[str, list]] = []
+        self._order: List[str] = []
+        self._limit: Optional[int] = None
+        self._single: Optional[str] = None
+
+    def _column(self, name: str) -> str:
+        name = name.strip()
+        if name not in self._columns:
+            raise ValueError(f"Unknown column {self._table}.{name}")
+        return name
+
+    def select(self, columns: str = "*", count: Optional[str] = None) -> "SQLiteQuery":
+        if columns.strip() != "*":
+            self._select = [self._column(column) for column in columns.split(",")]
+        return self
+
+    def insert(self, rows) -> "SQLiteQuery":
+        self._action, self._payload = "insert", rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows, on_conflict: Optional[str] = None, ignore_duplicates: bool = False) -> "SQLiteQuery":
+        self._action, self._payload = "upsert", rows if isinstance(rows, list) else [rows]
+        if on_conflict:
+            self._conflict = [self._column(column) for column in on_conflict.split(",")]
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, values: dict) -> "SQLiteQuery":
+        self._action, self._payload = "update", values
+        return self
+
+    def delete(self) -> "SQLiteQuery":
+        self._action = "delete"
+        return self
+
+    def _filter(self, op: str, column: str, value: Any) -> "SQLiteQuery":
+        self._where.append((f"{self._column(column)} {OPERATORS[op]} ?", [value]))
+        return self
+
+    def eq(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter("eq", column, value)
+
+    def neq(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter("neq", column, value)
+
+    def gt(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter("gt", column, value)
+
+    def gte(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter("gte", column, value)
+
+    def lt(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter("lt", column, value)
+
+    def lte(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter("lte", column, value)
+
+    def in_(self, column: str, values) -> "SQLiteQuery":
+        values = list(values)
+        if not values:
+            self._where.append(("0", []))
+        else:
+            self._where.append((f"{self._column(column)} IN ({','.join('?' * len(values))})", values))
+        return self
+
+    def _compile_term(self, term: str) -> Tuple[str, list]:
+        for group, joiner in (("and(", " AND "), ("or(", " OR ")):
+            if term.startswith(group):
+                compiled = [self._compile_term(part) for part in _split_terms(term[len(group):-1])]
+                return "(" + joiner.join(sql for sql, _ in compiled) + ")", [p for _, params in compiled for p in params]
+        column, op, value = term.split(".", 2)
+        return f"{self._column(column)} {OPERATORS[op]} ?", [value.strip('"')]
+
+    def or_(self, expression: str) -> "SQLiteQuery":
+        """A PostgREST ``or`` filter such as ``date.lt.X,and(date.eq.X,id.lt.Y)``"""
+        self._where.append(self._compile_term(f"or({expression})"))
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "SQLiteQuery":
+        self._order.append(f"{self._column(column)} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, count: int) -> "SQLiteQuery":
+        self._limit = int(count)
+        return self
+
+    def single(self) -> "SQLiteQuery":
+        self._single = "single"
+        return self
+
+    def maybe_single(self) -> "SQLiteQuery":
+        self._single = "maybe"
+        return self
+
+    def _where_clause(self) -> Tuple[str, list]:
+        if not self._where:
+            return "", []
+        return " WHERE " + " AND ".join(sql for sql, _ in self._where), [p for _, params in self._where for p in params]
+
+    def _select_sql(self, columns: List[str]) -> Tuple[str, list]:
+        where, params = self._where_clause()
+        sql = f"SELECT {', '.join(columns)} FROM {self._table}{where}"
+        if self._order:
+            sql += " ORDER BY " + ", ".join(self._order)
+        if self._limit is not None:
+            sql += f" LIMIT {self._limit}"
+        return sql, params
+
+    def _rows(self, conn: sqlite3.Connection, columns: List[str]) -> List[dict]:
+        sql, params = self._select_sql(columns)
+        return [dict(zip(columns, row)) for row in conn.execute(sql, params)]
+
+    def _write(self, conn: sqlite3.Connection) -> List[dict]:
+        """Apply this write on the writer's connection; returns the affected rows"""
+        columns = list(self._columns)
+        if self._action in ("insert", "upsert"):
+            rows = []
+            for item in self._payload:
+                row = {self._column(column): value for column, value in item.items()}
+                if row.get(self._key) is None and self._key == "id":
+                    row["id"] = uuid.uuid4().hex
+                rows.append(row)
+            # One prepared statement per distinct column set, run for every row
+            by_columns: Dict[Tuple[str, ...], List[dict]] = {}
+            for row in rows:
+                by_columns.setdefault(tuple(row), []).append(row)
+            inserted = []
+            for names, group in by_columns.items():
+                sql = f"INSERT INTO {self._table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+                if self._action == "upsert":
+                    updates = [f"{name} = excluded.{name}" for name in names if name not in self._conflict]
+                    action = "NOTHING" if self._ignore_duplicates or not updates else f"UPDATE SET {', '.join(updates)}"
+                    sql += f" ON CONFLICT ({', '.join(self._conflict)}) DO {action}"
+                if self._ignore_duplicates:
+                    # Like PostgREST, report only the rows that were inserted
+                    inserted += [row for row in group if conn.execute(sql, tuple(row[name] for name in names)).rowcount]
+                    continue
+                conn.executemany(sql, [tuple(row[name] for name in names) for row in group])
+            if self._ignore_duplicates:
+                rows = inserted
+            if self._action == "insert" or self._ignore_duplicates:
+                return [{**dict.fromkeys(columns), **row} for row in rows]
+            keys = [row[self._key] for row in rows]
+            stored = {
+                row[self._key]: row for row in (
+                    dict(zip(columns, values)) for values in conn.execute(
+                        f"SELECT {', '.join(columns)} FROM {self._table} WHERE {self._key} IN ({','.join('?' * len(keys))})",
+                        keys
+                    )
+                )
+            }
+            return [stored[key] for key in dict.fromkeys(keys)]
+
+        matched = self._rows(conn, columns)
+        if not matched:
+            return []
+        where, params = self._where_clause()
+        if self._action == "delete":
+            conn.execute(f"DELETE FROM {self._table}{where}", params)
+            return matched
+        values = {self._column(column): value for column, value in self._payload.items()}
+        conn.execute(
+            f"UPDATE {self._table} SET {', '.join(f'{name} = ?' for name in values)}{where}",
+            list(values.values()) + params
+        )
+        return [{**row, **values} for row in matched]
+
+    def execute(self) -> SQLiteResult:
+        """Run the query; blocking, so call from a worker thread"""
+        if self._action != "select":
+            return SQLiteResult(self._store.write(self._write))
+        data = self._rows(self._store.reader(), self._select)
+        if self._single == "single":
+            if len(data) != 1:
+                raise ValueError("JSON object requested, multiple (or no) rows returned")
+            return SQLiteResult(data[0])
+        if self._single == "maybe":
+            return SQLiteResult(data[0] if data else None)
+        return SQLiteResult(data, count=len(data))
+
+
+class SQLiteStore:
+    """An SQLite database file in WAL mode with a single batching writer"""
+
+    def __init__(self, path: str, batch_size: int = WRITE_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._queue: "queue.Queue[Optional[Tuple[Callable, Future]]]" = queue.Queue()
+
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for table, (key, columns) in TABLES.items():
+            definition = ", ".join(f"{name} {kind}" for name, kind in columns.items())
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definition}, PRIMARY KEY ({key}))")
+        for index in INDEXES:
+            conn.execute(index)
+        conn.close()
+
+        self.writes = 0
+        self.commits = 0
+        self.failed_writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Statements are compiled once per connection and reused from this cache
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, cached_statements=512)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def table(self, name: str) -> SQLiteQuery:
+        return SQLiteQuery(self, name)
+
+    def reader(self) -> sqlite3.Connection:
+        """This thread's read connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            conn.execute("PRAGMA query_only=1")
+        return conn
+
+    def write(self, apply: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run ``apply`` on the writer thread and wait until it is committed"""
+        future: Future = Future()
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="sqlite-writer", daemon=True)
+                self._writer.start()
+            self._queue.put((apply, future))
+        return future.result()
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stopping = True
+                batch.pop()
+            if not batch:
+                break
+
+            results = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for apply, _ in batch:
+                    # A failing write is rolled back alone; the rest of the batch commits
+                    conn.execute("SAVEPOINT write")
+                    try:
+                        results.append((apply(conn), None))
+                        conn.execute("RELEASE write")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write")
+                        conn.execute("RELEASE write")
+                        results.append((None, e))
+                conn.execute("COMMIT")
+            except Exception as e:
+                logger.error(f"SQLite commit failed: {str(e)}")
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                results = [(None, e)] * len(batch)
+
+            self.commits += 1
+            for (_, future), (result, error) in zip(batch, results):
+                self.writes += 1
+                if error is not None:
+                    self.failed_writes += 1
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        conn.close()
+
+    def close(self) -> None:
+        """Finish queued writes and stop the writer; a later write starts a new one"""
+        with self._lock:
+            writer, self._writer = self._writer, None
+            if writer is not None:
+                self._queue.put(None)
+        if writer is not None:
+            writer.join()
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "writes": self.writes,
+            "commits": self.commits,
+            "failed_writes": self.failed_writes,
+            "writes_per_commit": round(self.writes / self.commits, 2) if self.commits else 0.0,
+            "queued": self._queue.qsize()
+        }
@@ -1,13 +1,27 @@
 import pytest
 from fastapi.testclient import TestClient
 from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
 import jwt
 import os
+import tempfile
+import threading
+import time
 from dotenv import load_dotenv
-from main import app
+
+# Without Supabase credentials the app falls back to an SQLite file; keep it out of the tree
+os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "kashela.db"))
+
+from main import app, rate_limiter  # noqa: E402
 
 load_dotenv()
 
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    """Start every test with full rate-limit buckets"""
+    rate_limiter.reset()
+
 @pytest.fixture
 def client():
     return TestClient(app)
@@ -37,4 +51,374 @@ def mock_token(test_user):
 @pytest.fixture
 def auth_headers(mock_token):
     """Return headers with authorization token"""
-    return {"Authorization": f"Bearer {mock_token}"} 
\ No newline at end of file
+    return {"Authorization": f"Bearer {mock_token}"} 
+
+class FakeDaraja:
+    """Local stand-in for the Safaricom Daraja API.
+
+    Serves the OAuth and STK push endpoints over real HTTP so the pooled
+    client, retries and timeouts are exercised end to end.
+    """
+
+    def __init__(self, expires_in=3599, delay=0.0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.token_calls = 0
+        self.stk_calls = 0
+        self.stk_payloads = []
+        self.fail_with = []  # status codes returned before succeeding
+        self.peers = set()
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.peers.add(self.client_address)
+                    fake.token_calls += 1
+                    calls = fake.token_calls
+                time.sleep(fake.delay)
+                self._reply(200, {"access_token": f"token-{calls}", "expires_in": str(fake.expires_in)})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with fake._lock:
+                    fake.peers.add(self.client_address)
+                    fake.stk_calls += 1
+                    calls = fake.stk_calls
+                    status = fake.fail_with.pop(0) if fake.fail_with else 200
+                    if status == 200:
+                        fake.stk_payloads.append(payload)
+                time.sleep(fake.delay)
+                if status != 200:
+                    self._reply(status, {"errorMessage": "fake failure"})
+                    return
+                self._reply(200, {
+                    "MerchantRequestID": f"merchant-{calls}",
+                    "CheckoutRequestID": f"ws_CO_{calls:06d}",
+                    "ResponseCode": "0",
+                    "CustomerMessage": "Success. Request accepted for processing"
+                })
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fake_daraja():
+    server = FakeDaraja()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def authenticated_app(test_user):
+    """The app with every request authenticated as the test user"""
+    from routes.auth import TokenData, get_current_user
+
+    app.dependency_overrides[get_current_user] = lambda: TokenData(
+        sub=test_user["id"],
+        exp=datetime.utcnow() + timedelta(days=1)
+    )
+    yield app
+    app.dependency_overrides.pop(get_current_user, None)
+
+
+@pytest.fixture
+def mpesa_app(authenticated_app, fake_daraja, monkeypatch):
+    """Point the payments routes at the fake Daraja server"""
+    from mpesa import AccessTokenCache, DarajaClient
+    from routes import payments
+
+    monkeypatch.setenv("MPESA_CONSUMER_KEY", "key")
+    monkeypatch.setenv("MPESA_CONSUMER_SECRET", "secret")
+    monkeypatch.setenv("MPESA_SHORTCODE", "174379")
+    monkeypatch.setenv("MPESA_PASSKEY", "passkey")
+    monkeypatch.setattr(payments, "daraja", DarajaClient(fake_daraja.url, backoff_base=0.01))
+    monkeypatch.setattr(payments, "token_cache", AccessTokenCache(payments.fetch_access_token))
+    return authenticated_app
+
+
+class FakeResult:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    """Chainable subset of the postgrest query builder used by the routes"""
+
+    OPS = {
+        "eq": lambda a, b: a == b,
+        "neq": lambda a, b: a != b,
+        "gt": lambda a, b: a is not None and a > b,
+        "gte": lambda a, b: a is not None and a >= b,
+        "lt": lambda a, b: a is not None and a < b,
+        "lte": lambda a, b: a is not None and a <= b,
+        "in": lambda a, b: a in b,
+    }
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.action = "select"
+        self.columns = "*"
+        self.payload = None
+        self.filters = []
+        self.ordering = []
+        self.row_limit = None
+        self.single_row = False
+        self.on_conflict = None
+        self.ignore_duplicates = False
+
+    def select(self, columns="*", count=None):
+        self.columns = columns
+        return self
+
+    def insert(self, rows):
+        self.action, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False):
+        self.action, self.payload = "upsert", rows
+        self.on_conflict = on_conflict.split(",") if on_conflict else None
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, values):
+        self.action, self.payload = "update", values
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    def _filter(self, op, column, value):
+        self.filters.append(lambda row: self.OPS[op](row.get(column), value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter("eq", column, value)
+
+    def neq(self, column, value):
+        return self._filter("neq", column, value)
+
+    def gt(self, column, value):
+        return self._filter("gt", column, value)
+
+    def gte(self, column, value):
+        return self._filter("gte", column, value)
+
+    def lt(self, column, value):
+        return self._filter("lt", column, value)
+
+    def lte(self, column, value):
+        return self._filter("lte", column, value)
+
+    def in_(self, column, values):
+        return self._filter("in", column, set(values))
+
+    def or_(self, expression):
+        self.filters.append(parse_postgrest_or(expression))
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    def maybe_single(self):
+        return self.single()
+
+    def _project(self, row):
+        if self.columns == "*":
+            return dict(row)
+        return {column.strip(): row.get(column.strip()) for column in self.columns.split(",")}
+
+    def _matches(self, row):
+        return all(check(row) for check in self.filters)
+
+    def execute(self):
+        self.db.calls += 1
+        if self.db.latency:
+            time.sleep(self.db.latency)
+        if self.db.fail:
+            raise ConnectionError("database unavailable")
+        rows = self.db.tables.setdefault(self.table, [])
+        key = self.db.primary_keys.get(self.table, "id")
+        conflict = self.on_conflict or [key]
+
+        if self.action in ("insert", "upsert"):
+            payload = self.payload if isinstance(self.payload, list) else [self.payload]
+            written = []
+            stored = {tuple(row.get(column) for column in conflict): row for row in rows}
+            for item in payload:
+                item = dict(item)
+                if key == "id" and item.get("id") is None:
+                    self.db.sequence += 1
+                    item["id"] = str(self.db.sequence)
+                # Nulls never conflict, as in Postgres
+                match = tuple(item.get(column) for column in conflict)
+                existing = None if None in match else stored.get(match)
+                if existing is not None and self.action == "upsert":
+                    if self.ignore_duplicates:
+                        continue
+                    existing.update(item)
+                    written.append(dict(existing))
+                else:
+                    rows.append(item)
+                    stored[tuple(item.get(column) for column in conflict)] = item
+                    written.append(dict(item))
+            return FakeResult(written)
+
+        matched = [row for row in rows if self._matches(row)]
+        if self.action == "delete":
+            self.db.tables[self.table] = [row for row in rows if not self._matches(row)]
+            return FakeResult([dict(row) for row in matched])
+        if self.action == "update":
+            for row in matched:
+                row.update(self.payload)
+            return FakeResult([dict(row) for row in matched])
+
+        for column, desc in reversed(self.ordering):
+            matched.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        if self.row_limit is not None:
+            matched = matched[:self.row_limit]
+        data = [self._project(row) for row in matched]
+        if self.single_row:
+            if len(data) != 1:
+                raise ValueError("JSON object requested, multiple (or no) rows returned")
+            return FakeResult(data[0])
+        return FakeResult(data, count=len(data))
+
+
+def parse_postgrest_or(expression):
+    """Compile a postgrest ``or=(...)`` filter such as
+    ``date.lt.X,and(date.eq.X,id.lt.Y)`` into a row predicate"""
+
+    def split(text):
+        parts, depth, current = [], 0, ""
+        for char in text:
+            if char == "," and depth == 0:
+                parts.append(current)
+                current = ""
+                continue
+            depth += char == "("
+            depth -= char == ")"
+            current += char
+        parts.append(current)
+        return parts
+
+    def compile_term(term):
+        for group, combine in (("and(", all), ("or(", any)):
+            if term.startswith(group):
+                checks = [compile_term(part) for part in split(term[len(group):-1])]
+                return lambda row: combine(check(row) for check in checks)
+        column, op, value = term.split(".", 2)
+        value = value.strip('"')
+        return lambda row: FakeQuery.OPS[op](row.get(column), value)
+
+    checks = [compile_term(part) for part in split(expression)]
+    return lambda row: any(check(row) for check in checks)
+
+
+class FakeSupabase:
+    """In-memory stand-in for the Supabase client's table API"""
+
+    def __init__(self, latency=0.0):
+        self.tables = {}
+        self.primary_keys = {"payments": "transaction_id"}
+        self.sequence = 0
+        self.calls = 0
+        self.latency = latency
+        self.fail = False
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+@pytest.fixture
+def fake_supabase():
+    return FakeSupabase()
+
+
+@pytest.fixture
+def transactions_app(authenticated_app, fake_supabase, tmp_path, monkeypatch):
+    """Serve the transactions and export routes from the in-memory database"""
+    from db import Database
+    from response_cache import ResponseCache
+    from routes import transactions
+    from write_queue import WriteQueue
+
+    database = Database(lambda: fake_supabase)
+    monkeypatch.setattr(transactions, "get_database", lambda: database)
+    monkeypatch.setattr(transactions, "response_cache", ResponseCache())
+    monkeypatch.setattr(transactions, "pending_writes", WriteQueue(str(tmp_path / "pending_writes.db")))
+    return authenticated_app
+
+
+@pytest.fixture
+def uploads_app(authenticated_app, tmp_path, monkeypatch):
+    """Save uploads under a temporary directory"""
+    from blob_store import BlobStore
+    from routes import uploads
+    from upload_sessions import UploadSessions
+
+    monkeypatch.setattr(uploads, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(uploads, "blob_store", BlobStore(str(tmp_path / "blobs"), str(tmp_path / "index.db")))
+    monkeypatch.setattr(uploads, "upload_sessions", UploadSessions(str(tmp_path / "sessions")))
+    return authenticated_app
+
+
+@pytest.fixture
+def seed_transactions(fake_supabase, test_user):
+    """Insert synthetic transactions; every three rows share a timestamp"""
+    categories = ["Food", "Transport", "Rent", "Sales", "Airtime"]
+
+    def seed(count, user_id=None, start=datetime(2026, 1, 1)):
+        rows = fake_supabase.tables.setdefault("transactions", [])
+        created = []
+        for i in range(count):
+            row = {
+                "id": f"{len(rows) + 1:08d}",
+                "user_id": user_id or test_user["id"],
+                "amount": float(i % 97 + 1),
+                "description": f"Synthetic transaction {i}",
+                "category": categories[i % len(categories)],
+                "type": "income" if i % 4 == 0 else "expense",
+                "date": (start + timedelta(minutes=i // 3 * 7)).isoformat(),
+                "image_url": None,
+                "created_at": start.isoformat()
+            }
+            rows.append(row)
+            created.append(row)
+        return created
+
+    return seed
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from config import settings
+from routes import auth
+from token_cache import VerifiedTokenCache
+
+
+def make_token(sub="test-user-id", expires_in=timedelta(minutes=30), key=None):
+    exp = datetime.now() + expires_in
+    return jwt.encode({"sub": sub, "exp": exp.timestamp()}, key or settings.JWT_SECRET_KEY, algorithm="HS256")
+
+
+@pytest.fixture
+def fresh_token_cache(monkeypatch):
+    cache = VerifiedTokenCache()
+    monkeypatch.setattr(auth, "token_cache", cache)
+    return cache
+
+
+def test_tokens_are_verified_once(fresh_token_cache, monkeypatch):
+    token = make_token()
+    verified = []
+    verify = auth.verify_token
+    monkeypatch.setattr(auth, "verify_token", lambda t: verified.append(t) or verify(t))
+
+    async def run():
+        return [await auth.get_current_user(token) for _ in range(5)]
+
+    users = asyncio.run(run())
+
+    assert {user.sub for user in users} == {"test-user-id"}
+    assert verified == [token]
+    assert fresh_token_cache.stats()["hits"] == 4
+
+
+def test_invalid_tokens_are_rejected_every_time(fresh_token_cache):
+    forged = make_token(key="not-the-secret")
+    expired = make_token(expires_in=timedelta(minutes=-1))
+
+    for token in (forged, forged, expired, "garbage"):
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(auth.get_current_user(token))
+        assert error.value.status_code == 401
+    assert fresh_token_cache.stats()["entries"] == 0
+
+
+def test_cached_claims_expire_with_the_token():
+    now = [1_000_000.0]
+    cache = VerifiedTokenCache(max_entries=2, clock=lambda: now[0])
+    cache.put("a", "claims-a", now[0] + 60)
+    cache.put("b", "claims-b", now[0] + 600)
+    cache.put("stale", "claims", now[0] - 1)
+
+    assert cache.get("a") == "claims-a"
+    cache.put("c", "claims-c", now[0] + 600)
+    now[0] += 61
+
+    assert cache.get("b") is None
+    assert cache.get("a") is None
+    assert cache.get("c") == "claims-c"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_rotating_the_key_drops_cached_tokens(fresh_token_cache, monkeypatch):
+    token = make_token()
+    asyncio.run(auth.get_current_user(token))
+
+    monkeypatch.setattr(settings, "JWT_SECRET_KEY", "rotated-secret")
+    auth.prepare_signing_key()
+    try:
+        with pytest.raises(HTTPException):
+            asyncio.run(auth.get_current_user(token))
+    finally:
+        monkeypatch.undo()
+        auth.prepare_signing_key()
+
+
+def test_me_with_a_real_token(fresh_token_cache):
+    from main import app
+
+    response = TestClient(app).get("/auth/me", headers={"Authorization": f"Bearer {make_token()}"})
+
+    assert response.status_code == 200
+    assert response.json()["username"] == "test-user-id"
+
+
+def test_auth_overhead_per_request(fresh_token_cache):
+    """Benchmark: uncached verification against a cache hit"""
+    token = make_token()
+    calls = 5000
+
+    async def run(dependency):
+        started = time.perf_counter()
+        for _ in range(calls):
+            await dependency(token)
+        return (time.perf_counter() - started) / calls
+
+    async def uncached(token):
+        return auth.verify_token(token)
+
+    before = asyncio.run(run(uncached))
+    after = asyncio.run(run(auth.get_current_user))
+    assert after * 5 < before
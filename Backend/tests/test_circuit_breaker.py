@@ -0,0 +1,279 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from circuit_breaker import CircuitBreaker, CircuitOpen
+from db import Database, QueryTimeout
+from routes import transactions
+import write_queue
+from write_queue import WriteQueue
+
+
+@pytest.fixture
+def clock():
+    return [0.0]
+
+
+@pytest.fixture
+def breaker(transactions_app, clock):
+    """Give the routes' database a breaker that opens after two outages"""
+    database = transactions.get_database()
+    database.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: clock[0])
+    return database.breaker
+
+
+def test_breaker_opens_then_probes_once():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=lambda: now[0])
+
+    for _ in range(3):
+        assert breaker.before() is False
+        breaker.failure()
+    with pytest.raises(CircuitOpen) as refused:
+        breaker.before()
+    now[0] += 10
+    probe = breaker.before()
+    with pytest.raises(CircuitOpen):
+        breaker.before()
+    breaker.failure()
+
+    assert refused.value.retry_after == 10
+    assert probe is True
+    assert breaker.state == CircuitBreaker.OPEN
+    now[0] += 10
+    assert breaker.before() is True
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats() == {
+        "state": "closed", "consecutive_failures": 0, "opened": 2, "rejected": 2, "probes": 2
+    }
+
+
+def test_only_outages_count(fake_supabase):
+    database = Database(lambda: fake_supabase, breaker=CircuitBreaker(failure_threshold=2))
+
+    class Rejected:
+        def execute(self):
+            raise ValueError("invalid input syntax")
+
+    async def run(builder):
+        try:
+            await database.run(builder)
+        except Exception as e:
+            return type(e)
+
+    fake_supabase.fail = True
+    first = asyncio.run(run(fake_supabase.table("transactions").select("*")))
+    rejected = asyncio.run(run(Rejected()))
+    errors = [asyncio.run(run(fake_supabase.table("transactions").select("*"))) for _ in range(3)]
+
+    assert first is ConnectionError
+    assert rejected is ValueError
+    assert errors == [ConnectionError, ConnectionError, CircuitOpen]
+    assert fake_supabase.calls == 3
+
+
+def test_reads_fall_back_to_stale_responses(transactions_app, seed_transactions, fake_supabase, breaker, test_user):
+    seed_transactions(30)
+    client = TestClient(transactions_app)
+    page = client.get("/transactions/", params={"limit": 10})
+    summary = client.get("/transactions/summary", params={"period": "weekly"})
+
+    # A write from another worker retires the cached page just before the outage
+    transactions.response_cache.invalidate(test_user["id"])
+    fake_supabase.fail = True
+    stale_page = client.get("/transactions/", params={"limit": 10})
+    uncached = client.get("/transactions/", params={"limit": 11})
+    stale_summary = client.get("/transactions/summary", params={"period": "weekly"})
+    calls = fake_supabase.calls
+    refused = client.get("/transactions/", params={"limit": 12})
+
+    assert stale_page.status_code == 200
+    assert stale_page.json() == page.json()
+    assert stale_page.headers["x-next-cursor"] == page.headers["x-next-cursor"]
+    assert stale_page.headers["warning"] == '110 - "Response is Stale"'
+    assert "age" in stale_page.headers and "etag" not in stale_page.headers
+    assert uncached.status_code == 503
+    assert stale_summary.json() == summary.json()
+    assert "warning" in stale_summary.headers
+    assert refused.status_code == 503
+    assert refused.headers["retry-after"] == "30"
+    assert fake_supabase.calls == calls
+    assert client.get("/transactions/metrics").json()["response_cache"]["stale"] == 2
+
+
+def test_writes_are_queued_and_replayed(transactions_app, seed_transactions, fake_supabase, breaker, clock):
+    seeded = seed_transactions(6)
+    client = TestClient(transactions_app)
+    fake_supabase.fail = True
+    for limit in (1, 2):
+        assert client.get("/transactions/", params={"limit": limit}).status_code == 503
+    assert breaker.state == CircuitBreaker.OPEN
+
+    created = client.post("/transactions/", json={
+        "amount": 42.0, "description": "Offline sale", "category": "Sales", "type": "income"
+    })
+    deleted = client.delete(f"/transactions/{seeded[0]['id']}")
+    bulk = client.post("/transactions/bulk-delete", json={"ids": [seeded[1]["id"], seeded[2]["id"]]})
+
+    assert (created.status_code, deleted.status_code, bulk.status_code) == (202, 202, 202)
+    assert created.json()["queued"] is True
+    assert client.get("/transactions/metrics").json()["pending_writes"]["pending"] == 3
+
+    fake_supabase.fail = False
+    clock[0] += 30
+    listed = client.get("/transactions/", params={"limit": 50}).json()
+
+    expected = {created.json()["id"]} | {row["id"] for row in seeded[3:]}
+    assert {row["id"] for row in listed} == expected
+    assert breaker.state == CircuitBreaker.CLOSED
+    metrics = client.get("/transactions/metrics").json()["pending_writes"]
+    assert (metrics["pending"], metrics["replayed"]) == (0, 3)
+    summary = client.get("/transactions/summary", params={"category_type": "income"}).json()
+    assert summary == transactions.summarize(
+        [row for row in fake_supabase.tables["transactions"]], "daily", "income"
+    )
+
+
+def test_write_queue_survives_restarts_and_failed_replays(tmp_path):
+    path = str(tmp_path / "pending.db")
+    queue = WriteQueue(path)
+    asyncio.run(queue.append({"action": "delete", "ids": ["a"]}))
+    asyncio.run(queue.append({"action": "delete", "ids": ["b"]}))
+
+    applied = []
+
+    async def apply(entry):
+        if entry["ids"] == ["b"]:
+            raise ConnectionError("still down")
+        applied.append(entry["ids"])
+
+    restarted = WriteQueue(path)
+    with pytest.raises(ConnectionError):
+        asyncio.run(restarted.replay(apply))
+
+    assert applied == [["a"]]
+    assert [entry["ids"] for entry in WriteQueue(path).entries()] == [["b"]]
+    assert restarted.stats()["replay_failures"] == 1
+
+
+def test_write_queue_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "pending.db")
+    workers = [WriteQueue(path), WriteQueue(path)]
+    for i in range(10):
+        asyncio.run(workers[i % 2].append({"action": "delete", "ids": [str(i)]}))
+    applied = []
+
+    async def apply(entry):
+        applied.append(entry["ids"][0])
+        # Let the other worker try to replay while this entry is in flight
+        await asyncio.sleep(0.001)
+
+    async def run():
+        return await asyncio.gather(*(worker.replay(apply) for worker in workers))
+
+    counts = asyncio.run(run())
+
+    assert applied == [str(i) for i in range(10)]
+    assert sum(counts) == 10
+    assert all(len(worker) == 0 for worker in workers)
+
+
+def test_failing_writes_are_dead_lettered(tmp_path):
+    queue = WriteQueue(str(tmp_path / "pending.db"))
+    for ids in (["bad"], ["good"]):
+        asyncio.run(queue.append({"action": "delete", "ids": ids}))
+    applied = []
+    down = [True]
+
+    async def apply(entry):
+        if down[0]:
+            raise ConnectionError("still down")
+        if entry["ids"] == ["bad"]:
+            raise ValueError("rejected")
+        applied.append(entry["ids"])
+
+    # Outages never use up attempts
+    for _ in range(write_queue.MAX_ATTEMPTS + 1):
+        with pytest.raises(ConnectionError):
+            asyncio.run(queue.replay(apply, transient=lambda e: isinstance(e, ConnectionError)))
+    down[0] = False
+    for _ in range(write_queue.MAX_ATTEMPTS - 1):
+        with pytest.raises(ValueError):
+            asyncio.run(queue.replay(apply))
+    assert applied == []
+
+    assert asyncio.run(queue.replay(apply)) == 1
+    assert applied == [["good"]]
+    assert len(queue) == 0
+    assert [entry["ids"] for entry in queue.entries(dead=True)] == [["bad"]]
+    stats = queue.stats()
+    assert (stats["pending"], stats["dead"], stats["dead_lettered"]) == (0, 1, 1)
+
+
+def test_replayed_writes_count_once_in_rollups(transactions_app, seed_transactions, fake_supabase, test_user):
+    seeded = seed_transactions(10)
+    client = TestClient(transactions_app)
+    assert client.get("/transactions/summary").status_code == 200
+    row = {
+        "id": "queued-1", "user_id": test_user["id"], "amount": 42.0, "description": "Offline sale",
+        "category": "Sales", "type": "income", "date": "2026-10-18T09:00:00"
+    }
+    entries = [
+        {"user_id": test_user["id"], "action": "insert", "rows": [row]},
+        {"user_id": test_user["id"], "action": "delete", "ids": [seeded[0]["id"]]}
+    ]
+
+    async def replay_twice():
+        # As if the process died after applying each entry but before dequeuing it
+        for entry in entries:
+            await transactions.apply_queued(entry)
+            await transactions.apply_queued(entry)
+
+    asyncio.run(replay_twice())
+
+    rows = [row for row in fake_supabase.tables["transactions"] if row["user_id"] == test_user["id"]]
+    assert len(rows) == 10
+    summary = client.get("/transactions/summary", params={"category_type": "income"}).json()
+    assert summary == transactions.summarize(rows, "daily", "income")
+
+
+def test_empty_write_queue_is_skipped_without_disk(tmp_path, monkeypatch):
+    queue = WriteQueue(str(tmp_path / "pending.db"))
+    assert queue.maybe_pending
+
+    async def apply(entry):
+        pass
+
+    asyncio.run(queue.replay(apply))
+    assert not queue.maybe_pending
+
+    asyncio.run(queue.append({"action": "delete", "ids": ["a"]}))
+    assert queue.maybe_pending
+    asyncio.run(queue.replay(apply))
+    assert not queue.maybe_pending
+
+    # Writes queued by another process are picked up after a while
+    monkeypatch.setattr(write_queue, "RECHECK_INTERVAL", 0.0)
+    assert queue.maybe_pending
+
+
+def test_open_circuit_fails_fast(fake_supabase):
+    """Benchmark: 50 reads against a database that stopped answering"""
+    fake_supabase.latency = 0.5
+
+    async def measure(breaker):
+        database = Database(lambda: fake_supabase, query_timeout=0.05, breaker=breaker)
+        started = time.perf_counter()
+        for _ in range(50):
+            try:
+                await database.table("transactions").select("*").execute()
+            except (QueryTimeout, CircuitOpen):
+                pass
+        return time.perf_counter() - started
+
+    without = asyncio.run(measure(CircuitBreaker(failure_threshold=10 ** 6)))
+    with_breaker = asyncio.run(measure(CircuitBreaker(failure_threshold=5)))
+    assert with_breaker < without / 5
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+from db import Database, PoolTimeout, QueryTimeout
+from routes import transactions
+
+
+def test_pool_bounds_concurrent_queries(fake_supabase):
+    fake_supabase.latency = 0.05
+    database = Database(lambda: fake_supabase, pool_size=4)
+
+    async def run():
+        await asyncio.gather(*(database.table("transactions").select("*").execute() for _ in range(20)))
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - started
+
+    stats = database.stats()
+    assert stats["peak_in_use"] == 4
+    assert stats["peak_waiting"] == 16
+    assert stats["queries"] == 20
+    assert (stats["in_use"], stats["waiting"]) == (0, 0)
+    assert stats["avg_wait_ms"] > 0
+    assert 0.25 <= elapsed < 1.0
+
+
+def test_timeouts(fake_supabase):
+    fake_supabase.latency = 0.3
+    database = Database(lambda: fake_supabase, pool_size=1, query_timeout=0.1, acquire_timeout=0.05)
+
+    async def run():
+        return await asyncio.gather(
+            database.table("transactions").select("*").execute(),
+            database.table("transactions").select("*").execute(),
+            return_exceptions=True
+        )
+
+    errors = asyncio.run(run())
+
+    assert {type(error) for error in errors} == {QueryTimeout, PoolTimeout}
+    assert database.stats()["query_timeouts"] == 1
+    assert database.stats()["pool_timeouts"] == 1
+
+
+def test_async_builders_are_awaited():
+    class Builder:
+        def eq(self, column, value):
+            return self
+
+        async def execute(self):
+            await asyncio.sleep(0)
+            return "result"
+
+    class Client:
+        def table(self, name):
+            return Builder()
+
+    database = Database(Client)
+
+    assert asyncio.run(database.table("transactions").eq("id", 1).execute()) == "result"
+
+
+def test_routes_report_database_errors(transactions_app, seed_transactions, monkeypatch):
+    seed_transactions(5)
+    client = TestClient(transactions_app)
+
+    async def busy(builder):
+        raise PoolTimeout("full")
+
+    async def slow(builder):
+        raise QueryTimeout("slow")
+
+    database = transactions.get_database()
+    monkeypatch.setattr(database, "run", busy)
+    saturated = client.get("/transactions/")
+    monkeypatch.setattr(database, "run", slow)
+    timed_out = client.get("/transactions/summary")
+
+    assert saturated.status_code == 503
+    assert saturated.headers["retry-after"] == "1"
+    assert timed_out.status_code == 504
+    assert client.get("/transactions/metrics").json()["database"]["pool_size"] == 10
+
+
+def test_slow_queries_do_not_stall_the_event_loop(transactions_app, seed_transactions, fake_supabase):
+    """Benchmark: loop responsiveness while ten slow reads are in flight"""
+    seed_transactions(50)
+    fake_supabase.latency = 0.1
+    database = transactions.get_database()
+
+    async def measure(read):
+        ticks = []
+
+        async def ticker():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0.005)
+                ticks.append(time.perf_counter() - started)
+
+        task = asyncio.ensure_future(ticker())
+        started = time.perf_counter()
+        await asyncio.gather(*(read() for _ in range(10)))
+        elapsed = time.perf_counter() - started
+        task.cancel()
+        return elapsed, max(ticks, default=elapsed)
+
+    async def blocking_read():
+        # The previous access pattern: the synchronous client called on the loop
+        return transactions.page_query(fake_supabase, "test-user-id", "*", 50).execute()
+
+    async def pooled_read():
+        return await transactions.page_query(database, "test-user-id", "*", 50).execute()
+
+    before, before_stall = asyncio.run(measure(blocking_read))
+    after, after_stall = asyncio.run(measure(pooled_read))
+    assert after < before / 3
+    assert after_stall < 0.05
@@ -0,0 +1,131 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from routes import exports
+
+
+def test_csv_export(transactions_app, seed_transactions):
+    seeded = seed_transactions(2500)
+    seed_transactions(10, user_id="someone-else")
+
+    response = TestClient(transactions_app).get("/exports/transactions")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "attachment" in response.headers["content-disposition"]
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 2500
+    assert {row["id"] for row in rows} == {row["id"] for row in seeded}
+    assert rows[0]["date"] == max(row["date"] for row in seeded)
+
+
+def test_ndjson_export_with_filters(transactions_app, seed_transactions):
+    seeded = seed_transactions(600)
+    start, end = seeded[100]["date"], seeded[400]["date"]
+
+    response = TestClient(transactions_app).get(
+        "/exports/transactions",
+        params={"format": "ndjson", "type": "income", "start_date": start, "end_date": end}
+    )
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    expected = [row for row in seeded if row["type"] == "income" and start <= row["date"] <= end]
+    assert sorted(line["id"] for line in lines) == sorted(row["id"] for row in expected)
+    assert set(lines[0]) == set(exports.EXPORT_FIELDS)
+
+
+def test_gzip_export(transactions_app, seed_transactions):
+    seed_transactions(1200)
+    client = TestClient(transactions_app)
+
+    plain = client.get("/exports/transactions").content
+    compressed = client.get("/exports/transactions", params={"gzip": True})
+
+    assert compressed.headers["content-encoding"] == "gzip"
+    # httpx decodes the body; the bytes on the wire are the compressed stream
+    assert compressed.content == plain
+    assert compressed.num_bytes_downloaded < len(plain) / 3
+
+
+def test_empty_export_has_header(transactions_app):
+    response = TestClient(transactions_app).get("/exports/transactions")
+
+    assert response.text.strip() == ",".join(exports.EXPORT_FIELDS)
+
+
+def test_database_error_before_streaming(transactions_app, fake_supabase):
+    fake_supabase.fail = True
+
+    response = TestClient(transactions_app).get("/exports/transactions")
+
+    assert response.status_code == 503
+    assert response.json()["detail"] == "Database unavailable"
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs /proc to read RSS")
+@pytest.mark.parametrize("params", [{}, {"format": "ndjson", "gzip": "true"}])
+def test_million_row_export_in_constant_memory(transactions_app, monkeypatch, params):
+    """Load test: 1M rows stream out without RSS growing with the export size"""
+    total = 1_000_000
+
+    async def synthetic_pages(database, user_id, columns, page_size=1000, **filters):
+        for start in range(0, total, page_size):
+            yield [
+                {
+                    "id": f"{i:08d}", "date": "2026-01-01T00:00:00", "type": "expense",
+                    "category": "Food", "description": f"Synthetic transaction {i}", "amount": 12.5
+                }
+                for i in range(start, min(start + page_size, total))
+            ]
+
+    monkeypatch.setattr(exports, "fetch_pages", synthetic_pages)
+
+    async def run():
+        baseline = rss_bytes()
+        peak = baseline
+        sent = 0
+        query = "&".join(f"{key}={value}" for key, value in params.items()).encode()
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": "/exports/transactions", "raw_path": b"/exports/transactions",
+            "root_path": "", "query_string": query, "headers": [(b"host", b"testserver")],
+            "client": ("127.0.0.1", 1234), "server": ("testserver", 80)
+        }
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await asyncio.Event().wait()
+
+        async def send(message):
+            nonlocal sent, peak
+            if message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+                peak = max(peak, rss_bytes())
+
+        await transactions_app(scope, receive, send)
+        return sent, peak - baseline
+
+    started = time.perf_counter()
+    sent, growth = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+
+    assert sent > (0 if params else 50_000_000)
+    # Buffering the whole export would need hundreds of MB
+    assert growth < 32 * 1024 * 1024
+    assert elapsed < 60
@@ -0,0 +1,108 @@
+import hashlib
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from file_responses import RangeNotSatisfiable, UploadStaticFiles, parse_range
+
+AUDIO = bytes(range(256)) * 400
+
+
+@pytest.fixture
+def uploaded(uploads_app):
+    client = TestClient(uploads_app)
+    filename = client.post(
+        "/uploads/audio", files={"file": ("voice-note.mp3", AUDIO, "audio/mpeg")}
+    ).json()["filename"]
+    return client, f"/uploads/files/audio/{filename}"
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_range("bytes=900-", 1000) == (900, 999)
+    assert parse_range("bytes=-100", 1000) == (900, 999)
+    assert parse_range("bytes=-5000", 1000) == (0, 999)
+    assert parse_range("bytes=500-5000", 1000) == (500, 999)
+    for ignored in ("bytes=0-1,5-9", "items=0-9", "bytes=9-0", "bytes=a-b", "bytes=-"):
+        assert parse_range(ignored, 1000) is None
+    for unsatisfiable in ("bytes=1000-", "bytes=-0"):
+        with pytest.raises(RangeNotSatisfiable):
+            parse_range(unsatisfiable, 1000)
+
+
+def test_range_requests_return_partial_content(uploaded):
+    client, url = uploaded
+
+    first = client.get(url, headers={"Range": "bytes=0-1023"})
+    tail = client.get(url, headers={"Range": "bytes=-100"})
+    seek = client.get(url, headers={"Range": f"bytes={len(AUDIO) - 10}-"})
+
+    assert first.status_code == 206
+    assert first.content == AUDIO[:1024]
+    assert first.headers["content-range"] == f"bytes 0-1023/{len(AUDIO)}"
+    assert first.headers["content-length"] == "1024"
+    assert first.headers["content-type"] == "audio/mpeg"
+    assert tail.content == AUDIO[-100:]
+    assert seek.content == AUDIO[-10:]
+
+
+def test_unsatisfiable_and_multi_ranges(uploaded):
+    client, url = uploaded
+
+    past_end = client.get(url, headers={"Range": f"bytes={len(AUDIO)}-"})
+    multi = client.get(url, headers={"Range": "bytes=0-1,10-20"})
+
+    assert past_end.status_code == 416
+    assert past_end.headers["content-range"] == f"bytes */{len(AUDIO)}"
+    assert multi.status_code == 200
+    assert multi.content == AUDIO
+
+
+def test_strong_etag_and_revalidation(uploaded):
+    client, url = uploaded
+
+    full = client.get(url)
+    etag = full.headers["etag"]
+    revalidated = client.get(url, headers={"If-None-Match": etag})
+    stale_range = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"something-else"'})
+    fresh_range = client.get(url, headers={"Range": "bytes=0-9", "If-Range": etag})
+
+    assert etag == f'"{hashlib.sha256(AUDIO).hexdigest()}"'
+    assert full.headers["accept-ranges"] == "bytes"
+    assert full.headers["cache-control"] == "private, max-age=31536000, immutable"
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert stale_range.status_code == 200
+    assert stale_range.content == AUDIO
+    assert fresh_range.status_code == 206
+
+
+def test_static_mount_supports_ranges_and_caching(tmp_path):
+    (tmp_path / "clip.mp3").write_bytes(AUDIO)
+    client = TestClient(Starlette(routes=[Mount("/uploads", UploadStaticFiles(directory=str(tmp_path)))]))
+
+    full = client.get("/uploads/clip.mp3")
+    part = client.get("/uploads/clip.mp3", headers={"Range": "bytes=100-199"})
+    revalidated = client.get("/uploads/clip.mp3", headers={"If-None-Match": full.headers["etag"]})
+
+    assert full.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert full.headers["content-length"] == str(len(AUDIO))
+    assert part.status_code == 206
+    assert part.content == AUDIO[100:200]
+    assert revalidated.status_code == 304
+    assert os.path.getsize(tmp_path / "clip.mp3") == len(AUDIO)
+
+
+def test_static_mount_hides_private_directories(tmp_path):
+    (tmp_path / "blobs").mkdir()
+    (tmp_path / "blobs" / "photo.jpg").write_bytes(b"private")
+    (tmp_path / "clip.mp3").write_bytes(AUDIO)
+    mount = UploadStaticFiles(directory=str(tmp_path), private=["blobs"])
+    client = TestClient(Starlette(routes=[Mount("/uploads", mount)]))
+
+    assert client.get("/uploads/blobs/photo.jpg").status_code == 404
+    assert client.get("/uploads/./blobs/photo.jpg").status_code == 404
+    assert client.get("/uploads/clip.mp3").status_code == 200
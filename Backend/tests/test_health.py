@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from config import settings
+from db import Database
+from health_monitor import HealthMonitor, NotConfigured
+from routes import health, payments
+
+
+@pytest.fixture
+def health_app(mpesa_app, fake_supabase, monkeypatch):
+    """Probe the in-memory database and the fake Daraja server"""
+    database = Database(lambda: fake_supabase)
+    monkeypatch.setattr(health, "get_database", lambda: database)
+    monkeypatch.setattr(health, "monitor", HealthMonitor(health.PROBES, interval=30, timeout=1))
+    return mpesa_app
+
+
+def test_probe_results_and_latencies():
+    now = [1000.0]
+
+    async def healthy():
+        return {"version": 3}
+
+    async def broken():
+        raise ConnectionError("refused")
+
+    async def hung():
+        await asyncio.sleep(1)
+
+    async def missing():
+        raise NotConfigured("no credentials")
+
+    monitor = HealthMonitor(
+        {"a": healthy, "b": broken, "c": hung, "d": missing}, interval=10, timeout=0.05, clock=lambda: now[0]
+    )
+    assert monitor.status() == "starting"
+    assert not monitor.ready(["a"])
+
+    results = asyncio.run(monitor.run_once())
+
+    assert {name: result["status"] for name, result in results.items()} == {
+        "a": "healthy", "b": "unhealthy", "c": "unhealthy", "d": "unconfigured"
+    }
+    assert results["a"]["version"] == 3
+    assert results["b"]["error"] == "refused"
+    assert 40 <= results["c"]["latency_ms"] < 500
+    assert monitor.status() == "degraded"
+    assert monitor.ready(["a"]) and not monitor.ready(["a", "b"])
+    now[0] += 60
+    assert not monitor.ready(["a"])
+
+
+def test_background_probes_run_on_an_interval():
+    calls = []
+
+    async def probe():
+        calls.append(time.perf_counter())
+
+    monitor = HealthMonitor({"a": probe}, interval=0.05)
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.13)
+        monitor.stop()
+
+    asyncio.run(run())
+
+    assert monitor.runs == len(calls) >= 2
+    assert calls[1] - calls[0] >= 0.05
+
+
+def test_endpoints_serve_cached_results(health_app, fake_supabase, fake_daraja):
+    client = TestClient(health_app)
+    assert client.get("/health").json()["status"] == "starting"
+    assert client.get("/health/ready").status_code == 503
+
+    asyncio.run(health.monitor.run_once())
+    calls, token_calls = fake_supabase.calls, fake_daraja.token_calls
+    report = client.get("/health").json()
+    ready = client.get("/health/ready")
+
+    assert report["status"] == "ok"
+    assert set(report["services"]) == {"database", "mpesa", "upload_disk"}
+    assert report["services"]["database"]["circuit"] == "closed"
+    assert 3590 < report["services"]["mpesa"]["token_expires_in"] <= 3599
+    assert all("latency_ms" in service for service in report["services"].values())
+    assert ready.status_code == 200
+    assert client.get("/health/live").json() == {"status": "alive"}
+    assert (fake_supabase.calls, fake_daraja.token_calls) == (calls, token_calls)
+
+
+def test_dependency_outages_degrade_but_do_not_fail_readiness(health_app, fake_supabase, monkeypatch):
+    client = TestClient(health_app)
+    monkeypatch.setenv("MPESA_CONSUMER_KEY", "")
+    monkeypatch.setattr(settings, "HEALTH_MIN_FREE_DISK_MB", 0)
+    fake_supabase.fail = True
+    asyncio.run(health.monitor.run_once())
+
+    degraded = client.get("/health/ready")
+    fake_supabase.fail = False
+    asyncio.run(health.monitor.run_once())
+
+    assert degraded.status_code == 200
+    assert degraded.json() == {"status": "degraded", "services": {"database": "unhealthy", "upload_disk": "healthy"}}
+    assert client.get("/health").json()["services"]["mpesa"]["status"] == "unconfigured"
+    assert client.get("/health/ready").json()["status"] == "ready"
+
+
+def test_mpesa_probe_reuses_the_shared_token(health_app, fake_daraja):
+    async def run():
+        for _ in range(5):
+            await health.monitor.run_once()
+        await payments.generate_access_token()
+
+    asyncio.run(run())
+
+    assert health.monitor.results()["mpesa"]["status"] == "healthy"
+    assert fake_daraja.token_calls == 1
+
+
+def test_low_disk_space_is_unhealthy(health_app, monkeypatch):
+    monkeypatch.setattr(settings, "HEALTH_MIN_FREE_DISK_MB", 10 ** 12)
+
+    results = asyncio.run(health.monitor.run_once())
+
+    assert results["upload_disk"]["status"] == "unhealthy"
+    assert "below" in results["upload_disk"]["error"]
+    assert TestClient(health_app).get("/health/ready").status_code == 503
+
+
+def test_health_checks_do_not_touch_the_database(health_app, fake_supabase):
+    """Benchmark: 100 health checks against a database 50ms away"""
+    fake_supabase.latency = 0.05
+    client = TestClient(health_app)
+    asyncio.run(health.monitor.run_once())
+
+    def live_probe():
+        # The previous endpoint ran a query on every request
+        fake_supabase.table("transactions").select("*").limit(1).execute()
+
+    started = time.perf_counter()
+    for _ in range(20):
+        live_probe()
+    live = (time.perf_counter() - started) / 20
+    calls = fake_supabase.calls
+    started = time.perf_counter()
+    for _ in range(100):
+        assert client.get("/health").status_code == 200
+    cached = (time.perf_counter() - started) / 100
+    assert fake_supabase.calls == calls
+    assert cached < live / 5
@@ -0,0 +1,135 @@
+import asyncio
+
+import httpx
+import pytest
+
+from idempotency import IdempotencyCache
+from routes import payments
+
+PAYMENT = {"phone_number": "0712345678", "amount": 250.0}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = IdempotencyCache()
+    monkeypatch.setattr(payments, "idempotency_cache", cache)
+    return cache
+
+
+def api(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver")
+
+
+def test_concurrent_duplicates_share_one_stk_push(mpesa_app, fake_daraja, cache):
+    fake_daraja.delay = 0.2
+
+    async def run():
+        async with api(mpesa_app) as client:
+            return await asyncio.gather(*(
+                client.post("/payments/pay", json=PAYMENT, headers={"Idempotency-Key": "tap-1"})
+                for _ in range(10)
+            ))
+
+    responses = asyncio.run(run())
+
+    assert fake_daraja.stk_calls == 1
+    assert len({response.json()["transaction_id"] for response in responses}) == 1
+    assert sum(response.headers.get("Idempotent-Replayed") == "true" for response in responses) == 9
+    assert cache.stats()["joined"] == 9
+    assert cache.stats()["hit_rate"] == 0.9
+
+
+def test_retry_after_completion_is_replayed(mpesa_app, fake_daraja, cache):
+    async def run():
+        async with api(mpesa_app) as client:
+            first = await client.post("/payments/pay", json=PAYMENT, headers={"Idempotency-Key": "retry"})
+            second = await client.post("/payments/pay", json=PAYMENT, headers={"Idempotency-Key": "retry"})
+            return first, second
+
+    first, second = asyncio.run(run())
+
+    assert fake_daraja.stk_calls == 1
+    assert second.json() == first.json()
+    assert cache.stats()["hits"] == 1
+
+
+def test_key_reused_for_another_payment_is_refused(mpesa_app, fake_daraja, cache):
+    async def run():
+        async with api(mpesa_app) as client:
+            first = await client.post("/payments/pay", json=PAYMENT, headers={"Idempotency-Key": "reused"})
+            other = await client.post(
+                "/payments/pay", json={**PAYMENT, "amount": 500.0}, headers={"Idempotency-Key": "reused"}
+            )
+            retry = await client.post("/payments/pay", json=PAYMENT, headers={"Idempotency-Key": "reused"})
+            return first, other, retry
+
+    first, other, retry = asyncio.run(run())
+
+    assert other.status_code == 422
+    assert retry.json() == first.json()
+    assert fake_daraja.stk_calls == 1
+    assert cache.stats()["reused"] == 1
+
+
+def test_distinct_keys_are_not_deduplicated(mpesa_app, fake_daraja, cache):
+    async def run():
+        async with api(mpesa_app) as client:
+            return await asyncio.gather(*(
+                client.post("/payments/pay", json=PAYMENT, headers={"Idempotency-Key": f"k-{i}"})
+                for i in range(3)
+            ))
+
+    responses = asyncio.run(run())
+
+    assert fake_daraja.stk_calls == 3
+    assert len({response.json()["transaction_id"] for response in responses}) == 3
+
+
+def test_double_tap_without_key_is_derived(mpesa_app, fake_daraja, cache):
+    async def run():
+        async with api(mpesa_app) as client:
+            taps = await asyncio.gather(*(client.post("/payments/pay", json=PAYMENT) for _ in range(2)))
+            other = await client.post("/payments/pay", json={**PAYMENT, "amount": 300.0})
+            return taps, other
+
+    taps, other = asyncio.run(run())
+
+    assert fake_daraja.stk_calls == 2
+    assert taps[0].json()["transaction_id"] == taps[1].json()["transaction_id"]
+    assert other.json()["transaction_id"] != taps[0].json()["transaction_id"]
+
+
+def test_failures_are_not_cached(mpesa_app, fake_daraja, cache):
+    fake_daraja.fail_with = [400]
+
+    async def run():
+        async with api(mpesa_app) as client:
+            failed = await client.post("/payments/pay", json=PAYMENT, headers={"Idempotency-Key": "flaky"})
+            retried = await client.post("/payments/pay", json=PAYMENT, headers={"Idempotency-Key": "flaky"})
+            return failed, retried
+
+    failed, retried = asyncio.run(run())
+
+    assert failed.status_code == 500
+    assert retried.status_code == 200
+    assert fake_daraja.stk_calls == 2
+
+
+def test_entries_expire_after_ttl():
+    now = [0.0]
+    cache = IdempotencyCache(ttl=10, clock=lambda: now[0])
+    calls = []
+
+    async def operation():
+        calls.append(1)
+        return len(calls)
+
+    async def run():
+        first = await cache.run("key", operation)
+        now[0] = 5
+        second = await cache.run("key", operation)
+        now[0] = 11
+        third = await cache.run("key", operation)
+        return first, second, third
+
+    assert asyncio.run(run()) == ((1, False), (1, True), (2, False))
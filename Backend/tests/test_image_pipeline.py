@@ -0,0 +1,144 @@
+import asyncio
+import io
+import os
+import time
+
+from fastapi.testclient import TestClient
+from PIL import Image, PngImagePlugin
+
+from image_pipeline import ImagePipeline, render_variants, strip_metadata
+from routes import uploads
+
+
+def photo(width=3000, height=2000, orientation=None, mode="RGB", fmt="JPEG"):
+    """A noisy synthetic photo, optionally tagged with an EXIF orientation"""
+    noise = Image.effect_noise((width, height), 64)
+    image = Image.merge("RGB", (noise, noise.rotate(180), noise.transpose(Image.FLIP_LEFT_RIGHT)))
+    if mode != "RGB":
+        image = image.convert(mode)
+    exif = Image.Exif()
+    exif[0x010F] = "Phone maker"
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, exif=exif) if fmt == "JPEG" else image.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def test_variants_are_upright_small_and_stripped(tmp_path):
+    source = tmp_path / "photo.jpg"
+    # Orientation 6: stored landscape, displayed rotated to portrait
+    source.write_bytes(photo(orientation=6))
+    targets = {"thumb": str(tmp_path / "thumb.jpg"), "web": str(tmp_path / "web.jpg")}
+
+    dimensions = render_variants(str(source), targets)
+
+    assert dimensions == {"width": 2000, "height": 3000}
+    with Image.open(targets["thumb"]) as thumb:
+        assert thumb.size == (171, 256)
+        assert not thumb.getexif()
+    with Image.open(targets["web"]) as web:
+        assert web.size == (853, 1280)
+    assert os.path.getsize(targets["web"]) < os.path.getsize(source)
+
+
+def test_metadata_is_stripped_losslessly(tmp_path):
+    jpeg, png, other = tmp_path / "photo.jpg", tmp_path / "scan.png", tmp_path / "note.mp3"
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    # GPS IFD with a latitude reference, as phones write it
+    exif.get_ifd(0x8825)[1] = "S"
+    image = Image.open(io.BytesIO(photo(300, 200)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", exif=exif, quality=90)
+    jpeg.write_bytes(buffer.getvalue())
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Location", "-1.2921,36.8219")
+    image.save(png, "PNG", pnginfo=info)
+    other.write_bytes(b"ID3 not really audio")
+
+    assert strip_metadata(str(jpeg)) and strip_metadata(str(png))
+    assert not strip_metadata(str(jpeg)) and not strip_metadata(str(other))
+
+    with Image.open(jpeg) as stripped:
+        assert dict(stripped.getexif()) == {0x0112: 6}
+        assert stripped.tobytes() == Image.open(io.BytesIO(buffer.getvalue())).tobytes()
+    with Image.open(png) as stripped:
+        assert "Location" not in stripped.info
+        assert stripped.tobytes() == image.tobytes()
+    assert other.read_bytes() == b"ID3 not really audio"
+
+
+def test_transparent_images_are_flattened(tmp_path):
+    source = tmp_path / "logo.png"
+    source.write_bytes(photo(400, 300, mode="RGBA", fmt="PNG"))
+
+    render_variants(str(source), {"thumb": str(tmp_path / "thumb.jpg")})
+
+    with Image.open(tmp_path / "thumb.jpg") as thumb:
+        assert thumb.mode == "RGB"
+
+
+def test_upload_renders_variants_in_the_background(uploads_app, tmp_path, test_user):
+    client = TestClient(uploads_app)
+    content = photo(2400, 1600)
+
+    filename = client.post(
+        "/uploads/image", files={"file": ("receipt.jpg", content, "image/jpeg")}
+    ).json()["filename"]
+
+    entry = uploads.blob_store.lookup(test_user["id"], filename)
+    assert (entry["width"], entry["height"]) == (2400, 1600)
+    thumb = client.get(f"/uploads/files/images/{filename}", params={"size": "thumb"})
+    assert thumb.headers["content-type"] == "image/jpeg"
+    assert Image.open(io.BytesIO(thumb.content)).size == (256, 171)
+    web = client.get(f"/uploads/files/images/{filename}", params={"size": "web"})
+    assert Image.open(io.BytesIO(web.content)).size == (1280, 853)
+    with Image.open(io.BytesIO(client.get(f"/uploads/files/images/{filename}").content)) as original:
+        assert not original.getexif()
+        assert original.tobytes() == Image.open(io.BytesIO(content)).tobytes()
+
+
+def test_variants_of_non_images_are_rejected(uploads_app, test_user):
+    client = TestClient(uploads_app)
+    filename = client.post(
+        "/uploads/audio", files={"file": ("note.mp3", b"ID3 not really audio", "audio/mpeg")}
+    ).json()["filename"]
+
+    assert client.get(f"/uploads/files/audio/{filename}", params={"size": "thumb"}).status_code == 400
+    assert client.get(f"/uploads/files/audio/{filename}", params={"size": "huge"}).status_code == 422
+
+
+def test_pool_throughput_by_size(tmp_path):
+    """Benchmark: 8 phone-sized photos through pools of 1, 2 and 4 processes"""
+    sources = []
+    for i in range(8):
+        source = tmp_path / f"photo-{i}.jpg"
+        source.write_bytes(photo(2000, 1500))
+        sources.append(str(source))
+
+    async def run(pipeline, tag):
+        # Warm the pool so process start-up is not timed
+        await pipeline.process(f"warm-{tag}", sources[0], {"thumb": str(tmp_path / f"warm-{tag}.jpg")})
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            pipeline.process(
+                f"{tag}-{i}", source,
+                {"thumb": str(tmp_path / f"{tag}-{i}-thumb.jpg"), "web": str(tmp_path / f"{tag}-{i}-web.jpg")}
+            )
+            for i, source in enumerate(sources)
+        ))
+        return len(sources) / (time.perf_counter() - started)
+
+    rates = {}
+    for workers in (1, 2, 4):
+        pipeline = ImagePipeline(workers)
+        try:
+            rates[workers] = asyncio.run(run(pipeline, f"pool{workers}"))
+        finally:
+            # Let the workers exit so they do not compete with later tests
+            pipeline.shutdown(wait=True)
+        assert pipeline.stats()["processed"] == len(sources) + 1
+
+    if (os.cpu_count() or 1) >= 2:
+        assert rates[2] > rates[1] * 1.3
@@ -34,4 +34,4 @@ def test_mpesa_payment_status(auth_headers):
     response = client.get(f"/payments/payment/{transaction_id}", headers=auth_headers)
     assert response.status_code == 200
     data = response.json()
-    assert data["status"] == "completed" 
\ No newline at end of file
+    assert data["status"] == "pending" 
\ No newline at end of file
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from callback_queue import CallbackQueue
+from main import app
+from payment_store import PaymentStore
+from routes import payments
+
+
+def stk_callback(checkout_request_id, result_code=0):
+    callback = {
+        "MerchantRequestID": "merchant-1",
+        "CheckoutRequestID": checkout_request_id,
+        "ResultCode": result_code,
+        "ResultDesc": "The service request is processed successfully."
+    }
+    if result_code == 0:
+        callback["CallbackMetadata"] = {"Item": [
+            {"Name": "Amount", "Value": 100},
+            {"Name": "MpesaReceiptNumber", "Value": f"R{checkout_request_id}"}
+        ]}
+    return {"Body": {"stkCallback": callback}}
+
+
+def lookup(store, checkout_request_id):
+    return asyncio.run(store.get_by_checkout(checkout_request_id))
+
+
+async def drain(queue, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while queue.stats()["depth"] and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+def store():
+    return PaymentStore(get_db=lambda: None)
+
+
+@pytest.fixture
+def queue(tmp_path, store):
+    queue = CallbackQueue(str(tmp_path / "callbacks.db"), store.apply_callbacks, batch_size=50)
+    yield queue
+    queue.close()
+
+
+def test_callback_endpoint_acknowledges_after_queueing(queue, monkeypatch):
+    monkeypatch.setattr(payments, "callback_queue", queue)
+    client = TestClient(app)
+
+    latencies = []
+    for i in range(100):
+        started = time.perf_counter()
+        response = client.post("/payments/callback", json=stk_callback(f"ws_{i}"))
+        latencies.append(time.perf_counter() - started)
+        assert response.json() == {"status": "success"}
+
+    assert queue.stats()["depth"] == 100
+    assert sorted(latencies)[94] < 0.02
+
+
+def test_workers_batch_apply_callbacks(queue, store):
+    for i in range(500):
+        queue.append(json.dumps(stk_callback(f"ws_{i}", result_code=0 if i % 2 else 1032)))
+
+    async def run():
+        await queue.start()
+        await drain(queue)
+        await queue.stop()
+
+    asyncio.run(run())
+
+    stats = queue.stats()
+    assert stats["depth"] == 0
+    assert stats["applied"] == 500
+    assert stats["batches"] <= 20
+    assert lookup(store, "ws_1")["status"] == "completed"
+    assert lookup(store, "ws_1")["mpesa_receipt"] == "Rws_1"
+    assert lookup(store, "ws_2")["status"] == "failed"
+
+
+def test_claimed_callbacks_replayed_after_crash(tmp_path, store):
+    path = str(tmp_path / "callbacks.db")
+    crashed = CallbackQueue(path, store.apply_callbacks, batch_size=10)
+    for i in range(25):
+        crashed.append(json.dumps(stk_callback(f"ws_{i}")))
+    # A worker claims a batch and the process dies before applying it
+    assert len(crashed._claim()) == 10
+    crashed.close()
+
+    restarted = CallbackQueue(path, store.apply_callbacks, batch_size=10)
+
+    async def run():
+        await restarted.start()
+        await drain(restarted)
+        await restarted.stop()
+
+    asyncio.run(run())
+    restarted.close()
+
+    assert restarted.stats()["applied"] == 25
+    assert all(lookup(store, f"ws_{i}") for i in range(25))
+
+
+def test_failed_batches_are_retried(queue, store):
+    attempts = []
+
+    async def flaky(payloads):
+        attempts.append(len(payloads))
+        if len(attempts) == 1:
+            raise RuntimeError("store unavailable")
+        await store.apply_callbacks(payloads)
+
+    queue.apply = flaky
+    queue.retry_delay = 0.01
+    for i in range(5):
+        queue.append(json.dumps(stk_callback(f"ws_{i}")))
+
+    async def run():
+        await queue.start()
+        await drain(queue)
+        await queue.stop()
+
+    asyncio.run(run())
+
+    assert queue.stats()["failed_batches"] == 1
+    assert queue.stats()["applied"] == 5
+    assert lookup(store, "ws_4")["status"] == "completed"
+
+
+def test_malformed_callbacks_are_set_aside(queue, store):
+    queue.append("not json")
+    queue.append(json.dumps(stk_callback("ws_ok")))
+
+    asyncio.run(queue.drain_once())
+
+    stats = queue.stats()
+    assert stats["dead"] == 1
+    assert stats["depth"] == 0
+    assert lookup(store, "ws_ok")
@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from mpesa import DarajaClient
+
+PAYMENT = {"phone_number": "0712345678", "amount": 100.0, "description": "Test payment"}
+
+
+def test_connections_are_kept_alive(fake_daraja):
+    client = DarajaClient(fake_daraja.url)
+
+    async def run():
+        for _ in range(10):
+            await client.fetch_access_token("key", "secret")
+        await client.aclose()
+
+    asyncio.run(run())
+    assert fake_daraja.token_calls == 10
+    assert len(fake_daraja.peers) == 1
+
+
+def test_transient_failures_are_retried(fake_daraja):
+    fake_daraja.fail_with = [503, 503]
+    client = DarajaClient(fake_daraja.url, backoff_base=0.01)
+
+    response = asyncio.run(client.stk_push({"Amount": 1}, "token"))
+
+    assert response.status_code == 200
+    assert client.stats()["retries"] == 2
+    assert len(fake_daraja.stk_payloads) == 1
+
+
+def test_stk_push_not_retried_when_it_may_have_been_processed(fake_daraja):
+    fake_daraja.fail_with = [500]
+    client = DarajaClient(fake_daraja.url, backoff_base=0.01)
+
+    response = asyncio.run(client.stk_push({"Amount": 1}, "token"))
+
+    assert response.status_code == 500
+    assert fake_daraja.stk_calls == 1
+
+
+def test_per_call_timeout(fake_daraja):
+    fake_daraja.delay = 0.5
+    client = DarajaClient(fake_daraja.url, retries=0)
+
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(client.request("GET", "/oauth/v1/generate", timeout=0.05))
+    assert client.stats()["failures"] == 1
+
+
+def test_concurrency_is_bounded(fake_daraja):
+    fake_daraja.delay = 0.1
+    client = DarajaClient(fake_daraja.url, max_concurrency=3)
+    peak = []
+
+    async def run():
+        async def watch():
+            while True:
+                peak.append(client.in_flight)
+                await asyncio.sleep(0.005)
+
+        watcher = asyncio.ensure_future(watch())
+        await asyncio.gather(*(client.stk_push({"Amount": 1}, "token") for _ in range(9)))
+        watcher.cancel()
+
+    started = time.perf_counter()
+    asyncio.run(run())
+
+    assert max(peak) == 3
+    assert time.perf_counter() - started >= 0.3
+
+
+def test_unrelated_endpoints_stay_fast_during_stk_pushes(mpesa_app, fake_daraja):
+    """Load test: slow STK pushes must not stall the event loop"""
+    fake_daraja.delay = 0.5
+
+    async def run():
+        transport = httpx.ASGITransport(app=mpesa_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            pushes = [
+                asyncio.ensure_future(client.post(
+                    "/payments/pay", json=PAYMENT, headers={"Idempotency-Key": f"load-{i}"}
+                ))
+                for i in range(20)
+            ]
+            await asyncio.sleep(0.05)
+
+            latencies = []
+            while not all(push.done() for push in pushes):
+                started = time.perf_counter()
+                response = await client.get("/")
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200
+                await asyncio.sleep(0.02)
+            return await asyncio.gather(*pushes), latencies
+
+    started = time.perf_counter()
+    responses, latencies = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+
+    assert all(response.status_code == 200 for response in responses)
+    assert len({response.json()["checkout_request_id"] for response in responses}) == 20
+    assert fake_daraja.token_calls == 1
+    # 20 pushes at 0.5s each finish in a couple of concurrency-limited waves
+    assert elapsed < 3
+    assert len(latencies) > 10
+    assert max(latencies) < 0.1
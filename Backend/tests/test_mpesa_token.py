@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from mpesa import AccessTokenCache, DarajaClient
+
+
+def make_cache(fake_daraja, **kwargs):
+    daraja = DarajaClient(fake_daraja.url)
+    return AccessTokenCache(lambda: daraja.fetch_access_token("key", "secret"), **kwargs)
+
+
+def test_token_is_reused_until_expiry(fake_daraja):
+    cache = make_cache(fake_daraja)
+
+    async def run():
+        return {await cache.get() for _ in range(50)}
+
+    assert asyncio.run(run()) == {"token-1"}
+    assert fake_daraja.token_calls == 1
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 49
+    assert stats["refreshes"] == 1
+
+
+def test_concurrent_misses_share_one_fetch(fake_daraja):
+    fake_daraja.delay = 0.2
+    cache = make_cache(fake_daraja)
+
+    async def run():
+        return await asyncio.gather(*(cache.get() for _ in range(20)))
+
+    assert asyncio.run(run()) == ["token-1"] * 20
+    assert fake_daraja.token_calls == 1
+
+
+def test_token_refreshed_in_background_before_expiry(fake_daraja):
+    now = [0.0]
+    cache = make_cache(fake_daraja, refresh_margin=60, clock=lambda: now[0])
+
+    async def run():
+        assert await cache.get() == "token-1"
+        # Inside the refresh window the current token is still served
+        now[0] = 3599 - 30
+        assert await cache.get() == "token-1"
+        for _ in range(200):
+            if cache.stats()["refreshes"] == 2:
+                break
+            await asyncio.sleep(0.01)
+        return await cache.get()
+
+    assert asyncio.run(run()) == "token-2"
+    assert fake_daraja.token_calls == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_scheduler_keeps_token_warm(fake_daraja):
+    fake_daraja.expires_in = 1
+    cache = make_cache(fake_daraja, refresh_margin=0.5)
+
+    async def run():
+        cache.start()
+        try:
+            for _ in range(60):
+                if fake_daraja.token_calls >= 3:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            cache.stop()
+
+    asyncio.run(run())
+    assert fake_daraja.token_calls >= 3
+    assert cache.stats()["misses"] == 0
+
+
+def test_failed_fetch_is_counted_and_retried(fake_daraja):
+    daraja = DarajaClient(fake_daraja.url)
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("upstream down")
+        return await daraja.fetch_access_token("key", "secret")
+
+    cache = AccessTokenCache(flaky)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await cache.get()
+        return await cache.get()
+
+    assert asyncio.run(run()) == "token-1"
+    assert cache.stats()["failures"] == 1
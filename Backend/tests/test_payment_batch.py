@@ -0,0 +1,108 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from config import settings
+from idempotency import IdempotencyCache
+from routes import payments
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    monkeypatch.setattr(payments, "idempotency_cache", IdempotencyCache())
+
+
+def post_batch(app, body, headers=None):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            return await client.post("/payments/pay/batch", json=body, headers=headers)
+
+    return asyncio.run(run())
+
+
+def lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def collection(count):
+    return [{"phone_number": f"07{i:08d}", "amount": 100 + i} for i in range(count)]
+
+
+def test_batch_shares_token_and_password(mpesa_app, fake_daraja):
+    fake_daraja.delay = 0.2
+
+    started = time.perf_counter()
+    response = post_batch(mpesa_app, {"payments": collection(10), "concurrency": 5})
+    elapsed = time.perf_counter() - started
+
+    results = lines(response)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert results[-1] == {"summary": {"total": 10, "submitted": 10, "failed": 0}}
+    assert sorted(result["index"] for result in results[:-1]) == list(range(10))
+    assert fake_daraja.token_calls == 1
+    assert len({(p["Timestamp"], p["Password"]) for p in fake_daraja.stk_payloads}) == 1
+    assert {p["PhoneNumber"] for p in fake_daraja.stk_payloads} == {f"2547{i:08d}" for i in range(10)}
+    # Two waves of five concurrent pushes
+    assert 0.4 <= elapsed < 1.0
+
+
+def test_invalid_numbers_rejected_without_upstream_call(mpesa_app, fake_daraja):
+    body = {"payments": [{"phone_number": "12", "amount": 50}, {"phone_number": "0712345678", "amount": 50}]}
+
+    results = {result.get("index"): result for result in lines(post_batch(mpesa_app, body))}
+
+    assert results[0]["status"] == "invalid"
+    assert results[1]["status"] == "pending"
+    assert results[None]["summary"]["failed"] == 1
+    assert fake_daraja.stk_calls == 1
+
+
+def test_item_failures_do_not_abort_batch(mpesa_app, fake_daraja):
+    fake_daraja.fail_with = [400]
+
+    results = lines(post_batch(mpesa_app, {"payments": collection(3), "concurrency": 1}))
+
+    assert [result["status"] for result in results[:-1]].count("error") == 1
+    assert results[-1]["summary"]["submitted"] == 2
+
+
+def test_batch_retry_with_key_is_replayed(mpesa_app, fake_daraja):
+    body = {"payments": collection(4)}
+    headers = {"Idempotency-Key": "collection-1"}
+
+    first = lines(post_batch(mpesa_app, body, headers))
+    second = lines(post_batch(mpesa_app, body, headers))
+
+    assert fake_daraja.stk_calls == 4
+    assert all(result["replayed"] for result in second[:-1])
+    assert {r["transaction_id"] for r in first[:-1]} == {r["transaction_id"] for r in second[:-1]}
+
+
+def test_batch_key_reused_for_another_batch_is_refused(mpesa_app, fake_daraja):
+    headers = {"Idempotency-Key": "collection-2"}
+
+    post_batch(mpesa_app, {"payments": collection(4)}, headers)
+    changed = collection(4)
+    changed[2]["amount"] += 1
+    response = post_batch(mpesa_app, {"payments": changed}, headers)
+
+    assert response.status_code == 422
+    assert fake_daraja.stk_calls == 4
+
+
+def test_oversized_batch_rejected(mpesa_app):
+    response = post_batch(mpesa_app, {"payments": collection(settings.MPESA_BATCH_MAX_SIZE + 1)})
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("concurrency", [0, -1])
+def test_invalid_concurrency_rejected(mpesa_app, fake_daraja, concurrency):
+    response = post_batch(mpesa_app, {"payments": collection(2), "concurrency": concurrency})
+
+    assert response.status_code == 422
+    assert fake_daraja.stk_calls == 0
@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+from idempotency import IdempotencyCache
+from payment_store import PaymentStore
+from routes import payments
+from test_mpesa_callbacks import stk_callback
+
+PAYMENT = {"phone_number": "0712345678", "amount": 100.0}
+
+
+def pending(transaction_id, checkout_request_id, user_id="test-user-id"):
+    return {
+        "transaction_id": transaction_id,
+        "checkout_request_id": checkout_request_id,
+        "user_id": user_id,
+        "amount": 100.0
+    }
+
+
+def test_recorded_payment_served_from_memory(fake_supabase):
+    store = PaymentStore(get_db=lambda: fake_supabase)
+
+    async def run():
+        await store.record_pending(pending("MPESA_1", "ws_1"))
+        writes = fake_supabase.calls
+        started = time.perf_counter()
+        for _ in range(1000):
+            await store.get("MPESA_1")
+        elapsed = (time.perf_counter() - started) / 1000
+        return writes, elapsed, await store.get_by_checkout("ws_1")
+
+    writes, per_lookup, by_checkout = asyncio.run(run())
+
+    assert fake_supabase.calls == writes == 1
+    assert fake_supabase.tables["payments"][0]["status"] == "pending"
+    assert by_checkout["transaction_id"] == "MPESA_1"
+    assert per_lookup < 0.0005
+    assert store.stats()["hits"] == 1001
+
+
+def test_evicted_payments_fall_back_to_database(fake_supabase):
+    store = PaymentStore(capacity=2, get_db=lambda: fake_supabase)
+
+    async def run():
+        for i in range(3):
+            await store.record_pending(pending(f"MPESA_{i}", f"ws_{i}"))
+        return await store.get("MPESA_0"), await store.get("MPESA_0")
+
+    first, second = asyncio.run(run())
+
+    assert first["checkout_request_id"] == "ws_0"
+    assert second == first
+    assert store.stats()["cached"] == 2
+    assert store.stats()["misses"] == 1
+
+
+def test_callbacks_write_through_to_both_layers(fake_supabase):
+    store = PaymentStore(get_db=lambda: fake_supabase)
+
+    async def run():
+        await store.record_pending(pending("MPESA_1", "ws_1"))
+        await store.record_pending(pending("MPESA_2", "ws_2"))
+        await store.apply_callbacks([stk_callback("ws_1"), stk_callback("ws_2", result_code=1032)])
+        return await store.get("MPESA_1"), await store.get("MPESA_2")
+
+    completed, failed = asyncio.run(run())
+
+    assert completed["status"] == "completed"
+    assert completed["mpesa_receipt"] == "Rws_1"
+    assert failed["status"] == "failed"
+    rows = {row["transaction_id"]: row for row in fake_supabase.tables["payments"]}
+    assert rows["MPESA_1"]["status"] == "completed"
+    assert rows["MPESA_2"]["status"] == "failed"
+
+
+def test_callbacks_applied_by_another_process_are_seen(fake_supabase):
+    polling = PaymentStore(get_db=lambda: fake_supabase, pending_ttl=0.05)
+    draining = PaymentStore(get_db=lambda: fake_supabase)
+
+    async def run():
+        await polling.record_pending(pending("MPESA_1", "ws_1"))
+        await polling.record_pending(pending("MPESA_2", "ws_2"))
+        before = await polling.get("MPESA_1")
+        await draining.apply_callbacks([stk_callback("ws_1"), stk_callback("ws_2")])
+        started = time.perf_counter()
+        waited = await polling.wait_for_update("MPESA_2", timeout=5)
+        wait_time = time.perf_counter() - started
+        await asyncio.sleep(0.05)
+        return before, await polling.get("MPESA_1"), waited, wait_time
+
+    before, after, waited, wait_time = asyncio.run(run())
+
+    assert before["status"] == "pending"
+    assert after["status"] == "completed"
+    assert waited["status"] == "completed"
+    assert wait_time < 1
+    assert polling.stats()["waiting"] == 0
+
+
+def test_early_callback_merged_when_push_is_recorded():
+    store = PaymentStore(get_db=lambda: None)
+
+    async def run():
+        await store.apply_callbacks([stk_callback("ws_1")])
+        await store.record_pending(pending("MPESA_1", "ws_1"))
+        return await store.get("MPESA_1")
+
+    assert asyncio.run(run())["status"] == "completed"
+
+
+def test_status_route_follows_callbacks(mpesa_app, tmp_path, monkeypatch):
+    store = PaymentStore(get_db=lambda: None)
+    monkeypatch.setattr(payments, "payment_store", store)
+    client = TestClient(mpesa_app)
+
+    initiated = client.post("/payments/pay", json=PAYMENT).json()
+    transaction_id = initiated["transaction_id"]
+
+    status = client.get(f"/payments/payment/{transaction_id}")
+    assert status.status_code == 200
+    assert status.json()["status"] == "pending"
+    assert status.json()["checkout_request_id"] == initiated["checkout_request_id"]
+
+    asyncio.run(store.apply_callbacks([stk_callback(initiated["checkout_request_id"])]))
+
+    status = client.get(f"/payments/payment/{transaction_id}")
+    assert status.json()["status"] == "completed"
+    assert client.get("/payments/payment/MPESA_UNKNOWN").status_code == 404
+
+
+def test_accepted_push_survives_database_failure(mpesa_app, fake_supabase, fake_daraja, monkeypatch):
+    monkeypatch.setattr(payments, "payment_store", PaymentStore(get_db=lambda: fake_supabase))
+    monkeypatch.setattr(payments, "idempotency_cache", IdempotencyCache())
+    fake_supabase.fail = True
+    client = TestClient(mpesa_app)
+
+    first = client.post("/payments/pay", json=PAYMENT, headers={"Idempotency-Key": "db-down"})
+    retry = client.post("/payments/pay", json=PAYMENT, headers={"Idempotency-Key": "db-down"})
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+    assert fake_daraja.stk_calls == 1
+    status = client.get(f"/payments/payment/{first.json()['transaction_id']}")
+    assert status.json()["status"] == "pending"
+
+
+def test_status_hidden_from_other_users(mpesa_app):
+    store = payments.payment_store
+    asyncio.run(store.record_pending(pending("MPESA_OTHER", "ws_other", user_id="someone-else")))
+
+    response = TestClient(mpesa_app).get("/payments/payment/MPESA_OTHER")
+
+    assert response.status_code == 404
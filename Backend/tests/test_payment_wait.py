@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from payment_store import PaymentStore
+from routes import payments
+from test_mpesa_callbacks import stk_callback
+
+
+def pending(i, user_id="test-user-id"):
+    return {"transaction_id": f"MPESA_{i}", "checkout_request_id": f"ws_{i}", "user_id": user_id}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = PaymentStore(get_db=lambda: None)
+    monkeypatch.setattr(payments, "payment_store", store)
+    return store
+
+
+def api(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver")
+
+
+def test_long_poll_wakes_on_callback(mpesa_app, store):
+    async def run():
+        await store.record_pending(pending(1))
+        async with api(mpesa_app) as client:
+            request = asyncio.ensure_future(client.get("/payments/payment/MPESA_1/wait?timeout=5"))
+            await asyncio.sleep(0.1)
+            assert not request.done()
+            started = time.perf_counter()
+            await store.apply_callbacks([stk_callback("ws_1")])
+            response = await request
+            return response, time.perf_counter() - started
+
+    response, wake_latency = asyncio.run(run())
+
+    assert response.json()["status"] == "completed"
+    assert wake_latency < 0.1
+    assert store.stats()["waiting"] == 0
+
+
+def test_long_poll_times_out_with_pending_status(mpesa_app, store):
+    async def run():
+        await store.record_pending(pending(1))
+        async with api(mpesa_app) as client:
+            return await client.get("/payments/payment/MPESA_1/wait?timeout=0.1")
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "pending"
+
+
+def test_long_poll_rejects_other_users(mpesa_app, store):
+    async def run():
+        await store.record_pending(pending(1, user_id="someone-else"))
+        async with api(mpesa_app) as client:
+            return await client.get("/payments/payment/MPESA_1/wait?timeout=0.1")
+
+    assert asyncio.run(run()).status_code == 404
+
+
+def test_sse_streams_initial_and_final_status(mpesa_app, store):
+    async def run():
+        await store.record_pending(pending(1))
+        async with api(mpesa_app) as client:
+            request = asyncio.ensure_future(client.get("/payments/payment/MPESA_1/events"))
+            await asyncio.sleep(0.1)
+            await store.apply_callbacks([stk_callback("ws_1", result_code=1032)])
+            return await request
+
+    response = asyncio.run(run())
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [line for line in response.text.splitlines() if line.startswith("data: ")]
+    assert len(events) == 2
+    assert '"status": "pending"' in events[0]
+    assert '"status": "failed"' in events[1]
+
+
+def test_parked_waiters_cost_no_cpu(store):
+    count = 5000
+
+    async def run():
+        for i in range(count):
+            await store.record_pending(pending(i))
+        waiters = [asyncio.ensure_future(store.wait_for_update(f"MPESA_{i}", 10)) for i in range(count)]
+        await asyncio.sleep(0.1)
+        assert store.stats()["waiting"] == count
+
+        cpu = time.process_time()
+        await asyncio.sleep(0.5)
+        idle_cpu = time.process_time() - cpu
+
+        await store.apply_callbacks([stk_callback(f"ws_{i}") for i in range(count)])
+        results = await asyncio.gather(*waiters)
+        return idle_cpu, results
+
+    idle_cpu, results = asyncio.run(run())
+
+    assert idle_cpu < 0.05
+    assert all(result["status"] == "completed" for result in results)
+    assert store.stats()["waiting"] == 0
+
+
+def test_long_poll_needs_fewer_requests_than_polling(mpesa_app, store):
+    """Benchmark: status requests per payment, plain polling vs long-poll"""
+    payments_count, settle_after, poll_interval = 50, 0.5, 0.05
+
+    async def settle(offset):
+        await asyncio.sleep(settle_after)
+        await store.apply_callbacks([stk_callback(f"ws_{i}") for i in range(offset, offset + payments_count)])
+
+    async def poll(client, i, counter):
+        while True:
+            counter.append(1)
+            response = await client.get(f"/payments/payment/MPESA_{i}")
+            if response.json()["status"] != "pending":
+                return
+            await asyncio.sleep(poll_interval)
+
+    async def long_poll(client, i, counter):
+        while True:
+            counter.append(1)
+            response = await client.get(f"/payments/payment/MPESA_{i}/wait?timeout=5")
+            if response.json()["status"] != "pending":
+                return
+
+    async def run(strategy, offset):
+        for i in range(offset, offset + payments_count):
+            await store.record_pending(pending(i))
+        counter = []
+        async with api(mpesa_app) as client:
+            settler = asyncio.ensure_future(settle(offset))
+            await asyncio.gather(*(strategy(client, i, counter) for i in range(offset, offset + payments_count)))
+            await settler
+        return len(counter)
+
+    polled = asyncio.run(run(poll, 0))
+    long_polled = asyncio.run(run(long_poll, payments_count))
+
+    assert long_polled == payments_count
+    assert polled >= 5 * long_polled
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from config import settings
+from main import app, rate_limiter
+from rate_limit import (
+    MemoryBuckets, RateLimit, RateLimiter, RateLimitMiddleware, RedisBuckets, RouteBudget, build_backend
+)
+
+
+def bearer(sub):
+    exp = (datetime.now() + timedelta(minutes=30)).timestamp()
+    return {"Authorization": f"Bearer {jwt.encode({'sub': sub, 'exp': exp}, settings.JWT_SECRET_KEY, algorithm='HS256')}"}
+
+
+def scope(path="/pay", method="POST", ip="10.0.0.1", headers=()):
+    return {"type": "http", "method": method, "path": path, "client": (ip, 1234), "headers": list(headers)}
+
+
+def limiter(per_ip=RateLimit(1.0, 3), per_user=None, **kwargs):
+    return RateLimiter([RouteBudget("pay", "POST", "/pay", per_ip, per_user)], MemoryBuckets(), **kwargs)
+
+
+def test_bucket_allows_a_burst_then_refills():
+    now = [100.0]
+    buckets = MemoryBuckets(clock=lambda: now[0])
+    limit = RateLimit(2.0, 3)
+
+    async def take():
+        return await buckets.take("k", limit)
+
+    waits = [asyncio.run(take()) for _ in range(4)]
+    now[0] += 0.5
+    refilled = asyncio.run(take())
+
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] == pytest.approx(0.5)
+    assert refilled == 0.0
+
+
+def test_idle_buckets_are_evicted():
+    now = [0.0]
+    buckets = MemoryBuckets(sweep_interval=10, clock=lambda: now[0])
+    limit = RateLimit(1.0, 5)
+
+    async def run():
+        for i in range(1000):
+            await buckets.take(f"ip-{i}", limit)
+        await buckets.take("busy", limit, cost=5)
+
+    asyncio.run(run())
+    assert buckets.stats()["keys"] == 1001
+    now[0] += 2
+    assert buckets.sweep() == 1000
+    assert buckets.stats()["keys"] == 1
+
+
+def test_users_and_addresses_have_separate_budgets():
+    users = {"token-a": "alice", "token-b": "bob"}
+    limits = limiter(per_ip=RateLimit(1.0, 100), per_user=RateLimit(1.0, 2), identify=users.get)
+
+    def check(token, ip):
+        return asyncio.run(limits.check(scope(ip=ip, headers=[(b"authorization", f"Bearer {token}".encode())])))
+
+    alice = [check("token-a", ip) for ip in ("10.0.0.1", "10.0.0.2", "10.0.0.3")]
+    bob = check("token-b", "10.0.0.1")
+
+    assert alice[:2] == [0.0, 0.0] and alice[2] > 0
+    assert bob == 0.0
+    assert asyncio.run(limits.check(scope(path="/elsewhere"))) == 0.0
+
+
+def test_forwarded_address_only_from_a_trusted_proxy():
+    forwarded = [(b"x-forwarded-for", b"1.2.3.4, 203.0.113.9")]
+
+    assert limiter().client_ip(scope(), dict(forwarded)) == "10.0.0.1"
+    assert limiter(trust_proxy=True).client_ip(scope(), dict(forwarded)) == "203.0.113.9"
+
+
+def test_login_is_throttled():
+    client = TestClient(app)
+    credentials = {"username": "demo", "password": "wrong"}
+
+    statuses = [client.post("/auth/login", data=credentials).status_code for _ in range(settings.LOGIN_BURST)]
+    limited = client.post("/auth/login", data=credentials)
+
+    assert 429 not in statuses
+    assert limited.status_code == 429
+    assert int(limited.headers["retry-after"]) >= 1
+    assert client.get("/").status_code == 200
+
+
+def test_payment_budget_is_per_user(mpesa_app):
+    client = TestClient(mpesa_app)
+    payment = {"phone_number": "254712345678", "amount": 10}
+
+    alice = [
+        client.post("/payments/pay", json={**payment, "amount": 10 + i}, headers=bearer("alice")).status_code
+        for i in range(settings.PAYMENT_BURST + 1)
+    ]
+    bob = client.post("/payments/pay", json=payment, headers=bearer("bob"))
+
+    assert alice[:settings.PAYMENT_BURST] == [200] * settings.PAYMENT_BURST
+    assert alice[-1] == 429
+    assert bob.status_code == 200
+    assert rate_limiter.stats()["limited"] >= 1
+
+
+def test_batch_is_charged_per_payment(mpesa_app):
+    client = TestClient(mpesa_app)
+    batch = {"payments": [
+        {"phone_number": "254712345678", "amount": 10 + i} for i in range(settings.MPESA_BATCH_MAX_SIZE)
+    ]}
+
+    first = client.post("/payments/pay/batch", json=batch, headers=bearer("alice"))
+    single = client.post("/payments/pay", json={"phone_number": "254712345678", "amount": 5}, headers=bearer("alice"))
+    elsewhere = client.post("/payments/pay", json={"phone_number": "254712345678", "amount": 5}, headers=bearer("bob"))
+
+    assert first.status_code == 200
+    summary = json.loads(first.text.splitlines()[-1])["summary"]
+    assert summary["total"] == settings.MPESA_BATCH_MAX_SIZE
+    assert single.status_code == 429
+    # The batch used up the address's budget as well as alice's
+    assert elsewhere.status_code == 429
+
+
+def test_redis_backend_fails_open():
+    class Unreachable:
+        def register_script(self, script):
+            async def run(keys, args):
+                raise ConnectionError("connection refused")
+            return run
+
+    buckets = RedisBuckets(Unreachable())
+
+    assert asyncio.run(buckets.take("k", RateLimit(1.0, 1))) == 0.0
+    assert buckets.stats()["errors"] == 1
+
+
+def test_redis_backend_needs_the_redis_package():
+    try:
+        import redis  # noqa: F401
+    except ImportError:
+        with pytest.raises(RuntimeError):
+            build_backend("redis://localhost:6379/0")
+    else:
+        assert isinstance(build_backend("redis://localhost:6379/0"), RedisBuckets)
+    assert isinstance(build_backend(""), MemoryBuckets)
+
+
+def test_middleware_overhead():
+    """Benchmark: a plain endpoint with and without the limiter in front"""
+    async def ok(request):
+        return PlainTextResponse("ok")
+
+    inner = Starlette(routes=[Route("/pay", ok, methods=["POST"]), Route("/other", ok)])
+    generous = RateLimit(1e9, 10 ** 9)
+    limited = RateLimitMiddleware(inner, limiter(per_ip=generous))
+    requests = 20000
+
+    async def run(asgi, path):
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            pass
+
+        started = time.perf_counter()
+        for i in range(requests):
+            request = {
+                **scope(path=path, method="POST" if path == "/pay" else "GET", ip=f"10.0.{i % 250}.{i % 7}"),
+                "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http",
+                "query_string": b"", "root_path": "", "server": ("testserver", 80)
+            }
+            await asgi(request, receive, send)
+        return (time.perf_counter() - started) / requests
+
+    baseline = asyncio.run(run(inner, "/pay"))
+    unlimited_route = asyncio.run(run(limited, "/other")) - asyncio.run(run(inner, "/other"))
+    limited_route = asyncio.run(run(limited, "/pay")) - baseline
+    assert limited_route < 20e-6
+    # Routes without a budget skip the limiter entirely
+    assert unlimited_route < 10e-6
@@ -0,0 +1,102 @@
+import asyncio
+from email.utils import formatdate
+
+from fastapi.testclient import TestClient
+
+from response_cache import ResponseCache
+from routes import transactions
+
+
+def test_repeat_reads_skip_the_database(transactions_app, seed_transactions, fake_supabase):
+    seeded = seed_transactions(120)
+    client = TestClient(transactions_app)
+
+    first = client.get("/transactions/", params={"limit": 50})
+    calls = fake_supabase.calls
+    second = client.get("/transactions/", params={"limit": 50})
+    single = client.get(f"/transactions/{seeded[0]['id']}")
+    again = client.get(f"/transactions/{seeded[0]['id']}")
+
+    assert second.json() == first.json()
+    assert second.headers["x-next-cursor"] == first.headers["x-next-cursor"]
+    assert second.headers["etag"] == first.headers["etag"]
+    assert again.json() == single.json()
+    assert fake_supabase.calls - calls == 1
+    assert client.get("/transactions/metrics").json()["response_cache"]["hits"] == 2
+
+
+def test_conditional_requests_get_304_without_a_query(transactions_app, seed_transactions, fake_supabase):
+    seed_transactions(10)
+    client = TestClient(transactions_app)
+    first = client.get("/transactions/")
+
+    calls = fake_supabase.calls
+    by_etag = client.get("/transactions/", headers={"If-None-Match": first.headers["etag"]})
+    by_date = client.get("/transactions/", headers={"If-Modified-Since": first.headers["last-modified"]})
+
+    assert by_etag.status_code == 304
+    assert by_date.status_code == 304
+    assert by_etag.headers["etag"] == first.headers["etag"]
+    assert fake_supabase.calls == calls
+    assert transactions.response_cache.stats()["not_modified"] == 2
+
+
+def test_writes_invalidate(transactions_app, seed_transactions):
+    seeded = seed_transactions(10)
+    client = TestClient(transactions_app)
+    before = client.get("/transactions/")
+
+    client.post("/transactions/", json={
+        "amount": 99.0, "description": "Airtime", "category": "Airtime", "type": "expense", "date": "2030-01-01T00:00:00"
+    })
+    after_create = client.get("/transactions/", headers={"If-None-Match": before.headers["etag"]})
+    client.delete(f"/transactions/{seeded[0]['id']}")
+    after_delete = client.get("/transactions/", headers={"If-None-Match": after_create.headers["etag"]})
+
+    assert after_create.status_code == 200
+    assert after_create.json()[0]["description"] == "Airtime"
+    assert after_delete.status_code == 200
+    assert seeded[0]["id"] not in {row["id"] for row in after_delete.json()}
+    assert client.get(f"/transactions/{seeded[0]['id']}").status_code == 404
+
+
+def test_validators_are_per_user_and_per_request():
+    cache = ResponseCache()
+
+    assert cache.validators("alice", "/a")["ETag"] != cache.validators("bob", "/a")["ETag"]
+    assert cache.validators("alice", "/a")["ETag"] != cache.validators("alice", "/b")["ETag"]
+    assert ResponseCache().validators("alice", "/a")["ETag"] != cache.validators("alice", "/a")["ETag"]
+
+
+def test_every_write_moves_last_modified():
+    now = [1_000_000.2]
+    cache = ResponseCache(clock=lambda: now[0])
+    seen = cache.validators("alice", "/")["Last-Modified"]
+
+    cache.invalidate("alice")
+    cache.invalidate("alice")
+
+    stamp = cache.validators("alice", "/")["Last-Modified"]
+    assert stamp == formatdate(1_000_002, usegmt=True)
+    async def load():
+        return [], {}
+
+    assert asyncio.run(cache.read("alice", "/", {"if-modified-since": seen}, load)).status_code == 200
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2)
+    loads = []
+
+    def load(key):
+        async def run():
+            loads.append(key)
+            return key, {}
+        return run
+
+    for key in ("/a", "/b", "/a", "/c", "/a", "/b"):
+        asyncio.run(cache.read("alice", key, {}, load(key)))
+
+    assert loads == ["/a", "/b", "/c", "/b"]
+    assert cache.stats()["evictions"] == 2
+    assert cache.stats()["hit_ratio"] == round(2 / 6, 3)
@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from rollups import RollupStore, summarize_rollups
+from routes import transactions
+from test_transaction_summary import random_rows, summarize_reference
+
+
+def remaining(fake_supabase, user_id):
+    return [row for row in fake_supabase.tables["transactions"] if row["user_id"] == user_id]
+
+
+def test_incremental_updates_match_full_scan(transactions_app, seed_transactions, fake_supabase, test_user):
+    """Consistency: rollups after a mix of creates and deletes equal a fresh scan"""
+    seeded = seed_transactions(900)
+    client = TestClient(transactions_app)
+    assert client.get("/transactions/summary").status_code == 200
+
+    for row in random_rows(60, seed=11):
+        response = client.post("/transactions/", json={**row, "description": "Incremental"})
+        assert response.status_code == 200
+    for row in seeded[::7]:
+        assert client.delete(f"/transactions/{row['id']}").status_code == 200
+
+    rows = remaining(fake_supabase, test_user["id"])
+    for period in ("daily", "weekly", "monthly"):
+        for category_type in ("income", "expense"):
+            response = client.get(
+                "/transactions/summary", params={"period": period, "category_type": category_type}
+            )
+            assert response.json() == summarize_reference(rows, period, category_type)
+
+    store = RollupStore(lambda: fake_supabase)
+    assert asyncio.run(store.verify(test_user["id"], rows)) == []
+
+
+def test_emptied_buckets_are_removed(fake_supabase):
+    store = RollupStore(lambda: fake_supabase)
+    row = {"amount": 25.0, "type": "expense", "category": "Food", "date": "2026-10-18T09:00:00"}
+
+    async def run():
+        await store.rebuild("user", [])
+        await store.apply("user", [row])
+        await store.apply("user", [row], sign=-1)
+        return await store.load("user")
+
+    assert asyncio.run(run()) == []
+
+
+def test_updates_are_skipped_until_built(fake_supabase):
+    store = RollupStore(lambda: fake_supabase)
+    row = {"amount": 25.0, "type": "income", "category": "Sales", "date": "2026-10-18T09:00:00"}
+
+    asyncio.run(store.apply("user", [row]))
+
+    assert asyncio.run(store.load("user")) is None
+    assert not fake_supabase.tables.get(RollupStore.TABLE)
+
+
+def test_failed_update_invalidates(fake_supabase, monkeypatch):
+    store = RollupStore(lambda: fake_supabase)
+    row = {"amount": 25.0, "type": "income", "category": "Sales", "date": "2026-10-18T09:00:00"}
+    asyncio.run(store.rebuild("user", [row]))
+
+    async def broken(user_id, deltas):
+        raise ConnectionError("database unavailable")
+
+    monkeypatch.setattr(store, "_apply", broken)
+    asyncio.run(store.apply("user", [row]))
+
+    assert asyncio.run(store.load("user")) is None
+
+
+def test_rebuild_repairs_drift(fake_supabase):
+    store = RollupStore(lambda: fake_supabase)
+    rows = random_rows(500)
+    asyncio.run(store.rebuild("user", rows))
+    fake_supabase.tables[RollupStore.TABLE][0]["income"] += 10
+
+    assert len(asyncio.run(store.verify("user", rows))) == 1
+    asyncio.run(store.rebuild("user", rows))
+    assert asyncio.run(store.verify("user", rows)) == []
+
+
+def test_update_during_build_is_not_lost(fake_supabase):
+    store = RollupStore(lambda: fake_supabase)
+    rows = random_rows(50)
+    late = {"amount": 25.0, "type": "income", "category": "Sales", "date": "2026-10-18T09:00:00"}
+
+    async def run():
+        token = await store.start_build("user")
+        # Created after the scan read ``rows``, before the build was written
+        await store.apply("user", [late])
+        await store.rebuild("user", rows, token)
+        unbuilt = await store.load("user")
+        token = await store.start_build("user")
+        await store.rebuild("user", rows + [late], token)
+        return unbuilt, await store.verify("user", rows + [late])
+
+    unbuilt, problems = asyncio.run(run())
+
+    assert unbuilt is None
+    assert problems == []
+
+
+def test_summary_scans_without_the_rollup_table(transactions_app, seed_transactions, fake_supabase, monkeypatch):
+    seed_transactions(300)
+    expected = summarize_reference(fake_supabase.tables["transactions"], "weekly")
+
+    async def missing_table(user_id):
+        raise Exception('relation "transaction_rollups" does not exist')
+
+    monkeypatch.setattr(transactions.rollup_store, "load", missing_table)
+    response = TestClient(transactions_app).get("/transactions/summary", params={"period": "weekly"})
+
+    assert response.status_code == 200
+    assert response.json() == expected
+
+
+@pytest.mark.parametrize("period", ["daily", "weekly", "monthly"])
+def test_rollup_summary_matches_reference(period):
+    rows = random_rows(5000)
+    rollups = RollupStore(None).compute("user", rows)
+
+    assert summarize_rollups(rollups, period) == summarize_reference(rows, period)
+
+
+def test_rollups_outpace_full_scan(transactions_app, seed_transactions, fake_supabase):
+    """Benchmark: 20k-row history, summary from rollups vs a full scan"""
+    seed_transactions(20_000)
+    client = TestClient(transactions_app)
+
+    started = time.perf_counter()
+    scanned = client.get("/transactions/summary", params={"period": "weekly"})
+    full_scan = time.perf_counter() - started
+
+    calls = fake_supabase.calls
+    started = time.perf_counter()
+    rolled_up = client.get("/transactions/summary", params={"period": "weekly"})
+    from_rollups = time.perf_counter() - started
+
+    assert rolled_up.json() == scanned.json()
+    assert fake_supabase.calls - calls == 1
+    assert from_rollups * 10 < full_scan
@@ -0,0 +1,210 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import db
+from config import settings
+from db import Database
+from payment_store import PaymentStore
+from response_cache import ResponseCache
+from routes import transactions
+from sqlite_store import SQLiteStore
+from test_transactions import fetch_all_pages
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / "kashela.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def sqlite_app(transactions_app, store, monkeypatch):
+    """Serve the transactions routes from the embedded store instead of the remote fake"""
+    database = Database(lambda: store)
+    monkeypatch.setattr(transactions, "get_database", lambda: database)
+    monkeypatch.setattr(transactions, "response_cache", ResponseCache())
+    return transactions_app
+
+
+def test_database_is_in_wal_mode_and_summaries_use_the_covering_index(store):
+    query = transactions.page_query(store, "u", transactions.SUMMARY_FIELDS + ",id", 1000, ("2026-01-01", "x"))
+    sql, params = query._select_sql(query._select)
+    plan = " ".join(row[3] for row in store.reader().execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+    assert store.reader().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert "COVERING INDEX transactions_user_date" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_routes_match_the_remote_backend(transactions_app, seed_transactions, fake_supabase, store, monkeypatch):
+    seeded = seed_transactions(700)
+    seed_transactions(50, user_id="someone-else")
+    for row in fake_supabase.tables["transactions"]:
+        row.setdefault("content_hash", None)
+    store.table("transactions").insert(fake_supabase.tables["transactions"]).execute()
+    client = TestClient(transactions_app)
+    requests = [
+        {"limit": 64},
+        {"limit": 100, "fields": "date,amount,type"},
+        {"limit": 50, "type": "income", "start_date": "2026-01-03T00:00:00"}
+    ]
+    summaries = [{"period": "weekly"}, {"period": "daily", "end_date": "2026-01-05T00:00:00"}]
+
+    def responses():
+        return (
+            [fetch_all_pages(client, params) for params in requests],
+            [client.get("/transactions/summary", params=params).json() for params in summaries]
+        )
+
+    remote = responses()
+    database = Database(lambda: store)
+    monkeypatch.setattr(transactions, "get_database", lambda: database)
+    monkeypatch.setattr(transactions, "response_cache", ResponseCache())
+    local = responses()
+
+    assert local == remote
+    assert len(local[0][0][0]) == len(seeded)
+
+
+def test_writes_through_the_routes(sqlite_app, store, test_user):
+    client = TestClient(sqlite_app)
+
+    created = client.post("/transactions/", json={
+        "amount": 250.0, "description": "Lunch", "category": "Food", "type": "expense"
+    }).json()
+    extra = [
+        client.post("/transactions/", json={
+            "amount": 10.0 + i, "description": "Fare", "category": "Transport", "type": "expense"
+        }).json()["id"]
+        for i in range(3)
+    ]
+
+    assert client.get(f"/transactions/{created['id']}").json()["description"] == "Lunch"
+    assert client.delete(f"/transactions/{created['id']}").status_code == 200
+    assert client.get(f"/transactions/{created['id']}").status_code == 404
+    assert client.post("/transactions/bulk-delete", json={"ids": extra[:2]}).status_code == 200
+    rows = store.table("transactions").select("id").eq("user_id", test_user["id"]).execute().data
+    assert [row["id"] for row in rows] == extra[2:]
+
+
+def test_concurrent_writes_share_commits(store):
+    def insert(i):
+        store.table("transactions").insert({"user_id": "u", "amount": i, "date": f"2026-01-01T00:00:{i % 60:02d}"}).execute()
+
+    threads = [threading.Thread(target=insert, args=(i,)) for i in range(200)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = store.stats()
+    assert len(store.table("transactions").select("id").execute().data) == 200
+    assert stats["writes"] == 200
+    assert stats["commits"] < 200
+
+
+def test_a_failed_write_is_rolled_back_alone(store):
+    store.table("transactions").insert({"id": "taken", "user_id": "u"}).execute()
+    gate = threading.Event()
+
+    # Hold the writer so both writes below land in the same batch
+    blocked = threading.Thread(target=store.write, args=(lambda conn: gate.wait(),))
+    blocked.start()
+    time.sleep(0.05)
+    results = {}
+
+    def write(name, row):
+        try:
+            results[name] = store.table("transactions").insert(row).execute().data
+        except sqlite3.IntegrityError as e:
+            results[name] = e
+
+    writers = [
+        threading.Thread(target=write, args=("duplicate", {"id": "taken", "user_id": "u"})),
+        threading.Thread(target=write, args=("fresh", {"id": "new", "user_id": "u"}))
+    ]
+    for thread in writers:
+        thread.start()
+    time.sleep(0.05)
+    gate.set()
+    for thread in [blocked, *writers]:
+        thread.join()
+
+    assert isinstance(results["duplicate"], sqlite3.IntegrityError)
+    assert results["fresh"][0]["id"] == "new"
+    assert {row["id"] for row in store.table("transactions").select("id").execute().data} == {"taken", "new"}
+    assert store.stats()["failed_writes"] == 1
+
+
+def test_upsert_ignoring_duplicates_returns_only_new_rows(store):
+    def upsert(*hashes):
+        rows = [{"user_id": "u", "amount": 1.0, "content_hash": h} for h in hashes]
+        return store.table("transactions")\
+            .upsert(rows, on_conflict="user_id,content_hash", ignore_duplicates=True)\
+            .execute().data
+
+    assert [row["content_hash"] for row in upsert("a", "b")] == ["a", "b"]
+    assert [row["content_hash"] for row in upsert("b", "c")] == ["c"]
+    assert upsert("a", "c") == []
+    assert len(store.table("transactions").select("id").execute().data) == 3
+
+
+def test_payments_survive_a_restart(store):
+    async def run():
+        await PaymentStore(get_db=lambda: store).record_pending({
+            "transaction_id": "MPESA_1", "checkout_request_id": "ws_1", "user_id": "u", "amount": 100.0
+        })
+        store.close()
+        return await PaymentStore(get_db=lambda: store).get("MPESA_1")
+
+    payment = asyncio.run(run())
+
+    assert payment["status"] == "pending"
+    assert payment["checkout_request_id"] == "ws_1"
+
+
+def test_falls_back_to_sqlite_without_supabase_credentials(tmp_path, monkeypatch):
+    monkeypatch.delenv("SUPABASE_URL", raising=False)
+    monkeypatch.delenv("SUPABASE_KEY", raising=False)
+    monkeypatch.setattr(settings, "DATABASE_BACKEND", "auto")
+    monkeypatch.setattr(settings, "SQLITE_PATH", str(tmp_path / "offline.db"))
+    for cached in (db.get_sqlite, db.get_supabase, db.get_database):
+        cached.cache_clear()
+    try:
+        assert isinstance(db.get_supabase(), SQLiteStore)
+        assert db.get_database().client() is db.get_supabase()
+        assert (tmp_path / "offline.db").exists()
+    finally:
+        db.get_sqlite().close()
+        for cached in (db.get_sqlite, db.get_supabase, db.get_database):
+            cached.cache_clear()
+
+
+def test_local_reads_and_writes_against_the_remote_backend(fake_supabase, seed_transactions, store):
+    """Benchmark: page reads and single inserts, embedded vs a remote backend 30ms away"""
+    seed_transactions(2000)
+    store.table("transactions").insert(fake_supabase.tables["transactions"]).execute()
+    fake_supabase.latency = 0.03
+
+    async def measure(database):
+        started = time.perf_counter()
+        async for _ in transactions.fetch_pages(database, "test-user-id", transactions.SUMMARY_FIELDS, page_size=200):
+            pass
+        reads = time.perf_counter() - started
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            database.table("transactions").insert({"user_id": "test-user-id", "amount": i}).execute()
+            for i in range(50)
+        ))
+        return reads, time.perf_counter() - started
+
+    remote_reads, remote_writes = asyncio.run(measure(Database(lambda: fake_supabase)))
+    local_reads, local_writes = asyncio.run(measure(Database(lambda: store)))
+    assert local_reads < remote_reads / 3
+    assert local_writes < remote_writes / 3
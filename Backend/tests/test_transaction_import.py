@@ -0,0 +1,101 @@
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+from test_transaction_summary import random_rows, summarize_reference
+
+
+def statement_csv(rows):
+    lines = ["Date,Type,Category,Description,Amount"]
+    lines += [f"{row['date']},{row['type']},{row['category']},\"{row['category']}, Nairobi\",{row['amount']}" for row in rows]
+    return "\n".join(lines) + "\n"
+
+
+def upload(client, name, content, **params):
+    response = client.post("/transactions/import", params=params, files={"file": (name, content)})
+    assert response.status_code == 200, response.text
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def stored(fake_supabase, user_id):
+    return [row for row in fake_supabase.tables.get("transactions", []) if row["user_id"] == user_id]
+
+
+def test_csv_import_in_batches(transactions_app, fake_supabase, test_user):
+    rows = random_rows(1200)
+
+    progress = upload(TestClient(transactions_app), "statement.csv", statement_csv(rows), batch_size=500)
+
+    assert [line["inserted"] for line in progress[:-1]] == [500, 500, 200]
+    assert progress[-1]["summary"] == {"total": 1200, "inserted": 1200, "duplicates": 0, "invalid": 0}
+    saved = stored(fake_supabase, test_user["id"])
+    assert len(saved) == 1200
+    assert saved[0]["description"] == f"{rows[0]['category']}, Nairobi"
+    assert all(row["content_hash"] for row in saved)
+
+
+def test_reupload_is_deduplicated(transactions_app, fake_supabase, test_user):
+    client = TestClient(transactions_app)
+    rows = random_rows(300)
+    upload(client, "statement.csv", statement_csv(rows))
+
+    progress = upload(client, "statement.csv", statement_csv(rows + rows[:10]))
+
+    assert progress[-1]["summary"] == {"total": 310, "inserted": 0, "duplicates": 310, "invalid": 0}
+    assert len(stored(fake_supabase, test_user["id"])) == 300
+
+
+def test_invalid_rows_are_reported(transactions_app, fake_supabase, test_user):
+    content = "\n".join([
+        json.dumps({"amount": 10, "type": "expense", "category": "Food", "description": "Lunch"}),
+        json.dumps({"amount": "lots", "type": "expense", "category": "Food", "description": "Dinner"}),
+        json.dumps({"amount": 5, "type": "refund", "category": "Food", "description": "Tea"}),
+        "",
+        json.dumps({"amount": 20, "type": "income", "category": "Sales", "description": "Sale"}),
+    ])
+
+    progress = upload(TestClient(transactions_app), "statement.ndjson", content)
+
+    assert [error["row"] for error in progress[0]["errors"]] == [2, 3]
+    assert progress[-1]["summary"] == {"total": 4, "inserted": 2, "duplicates": 0, "invalid": 2}
+    assert len(stored(fake_supabase, test_user["id"])) == 2
+
+
+def test_json_import_updates_rollups(transactions_app, fake_supabase, test_user):
+    client = TestClient(transactions_app)
+    client.get("/transactions/summary")
+    rows = random_rows(400)
+
+    upload(client, "statement.json", json.dumps([{**row, "description": "Imported"} for row in rows]))
+
+    response = client.get("/transactions/summary", params={"period": "monthly"})
+    assert response.json() == summarize_reference(stored(fake_supabase, test_user["id"]), "monthly")
+
+
+def test_unsupported_upload(transactions_app):
+    response = TestClient(transactions_app).post(
+        "/transactions/import", files={"file": ("statement.pdf", b"%PDF", "application/pdf")}
+    )
+
+    assert response.status_code == 400
+
+
+def test_bulk_import_outpaces_single_inserts(transactions_app, fake_supabase):
+    """Benchmark: rows per second against a database with 2ms round-trips"""
+    fake_supabase.latency = 0.002
+    client = TestClient(transactions_app)
+
+    rows = random_rows(100, seed=1)
+    started = time.perf_counter()
+    for row in rows:
+        assert client.post("/transactions/", json={**row, "description": "Single"}).status_code == 200
+    single_rate = len(rows) / (time.perf_counter() - started)
+
+    rows = random_rows(5000, seed=2)
+    started = time.perf_counter()
+    progress = upload(client, "statement.csv", statement_csv(rows))
+    bulk_rate = len(rows) / (time.perf_counter() - started)
+
+    assert progress[-1]["summary"]["inserted"] == 5000
+    assert bulk_rate > 10 * single_rate
@@ -0,0 +1,116 @@
+import random
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from analytics import summarize, totals
+
+
+def summarize_reference(rows, period="daily", category_type="expense"):
+    """Row-at-a-time port of the frontend reductions"""
+    income = expenses = 0.0
+    categories, periods = {}, {}
+    for row in rows:
+        day = date.fromisoformat(str(row["date"])[:10])
+        if period == "weekly":
+            day -= timedelta(days=day.weekday())
+        key = day.isoformat()[:7] if period == "monthly" else day.isoformat()
+        bucket = periods.setdefault(key, {"income": 0.0, "expenses": 0.0})
+        if row["type"] == "income":
+            income += row["amount"]
+            bucket["income"] += row["amount"]
+        else:
+            expenses += row["amount"]
+            bucket["expenses"] += row["amount"]
+        if (row["type"] == "income") == (category_type == "income"):
+            categories[row["category"]] = categories.get(row["category"], 0.0) + row["amount"]
+
+    return {
+        "count": len(rows),
+        "totals": totals(income, expenses),
+        "categories": {name: round(total, 2) for name, total in sorted(categories.items())},
+        "periods": [
+            {"date": key, "income": round(v["income"], 2), "expenses": round(v["expenses"], 2)}
+            for key, v in sorted(periods.items())
+        ]
+    }
+
+
+def random_rows(count, seed=7):
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    return [
+        {
+            "amount": round(rng.uniform(1, 5000), 2),
+            "type": rng.choice(["income", "expense", "expense"]),
+            "category": rng.choice(["Food", "Rent", "Sales", "Transport", "Airtime"]),
+            "date": (start + timedelta(minutes=rng.randrange(0, 60 * 24 * 540))).isoformat()
+        }
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.parametrize("period", ["daily", "weekly", "monthly"])
+@pytest.mark.parametrize("category_type", ["income", "expense"])
+def test_vectorised_summary_matches_reference(period, category_type):
+    rows = random_rows(5000)
+
+    assert summarize(rows, period, category_type) == summarize_reference(rows, period, category_type)
+
+
+def test_weeks_start_on_monday():
+    rows = [{"amount": 10.0, "type": "expense", "category": "Food", "date": "2026-10-18T09:00:00"}]
+
+    assert summarize(rows, "weekly")["periods"][0]["date"] == "2026-10-12"
+
+
+def test_empty_history():
+    assert summarize([], "monthly") == {"count": 0, "totals": totals(0.0, 0.0), "categories": {}, "periods": []}
+
+
+def test_summary_endpoint(transactions_app, seed_transactions):
+    seeded = seed_transactions(2500)
+    seed_transactions(10, user_id="someone-else")
+
+    response = TestClient(transactions_app).get("/transactions/summary", params={"period": "monthly"})
+
+    assert response.status_code == 200
+    assert response.json() == summarize_reference(seeded, "monthly")
+
+
+def test_summary_endpoint_date_range(transactions_app, seed_transactions):
+    seeded = seed_transactions(600)
+    start, end = seeded[100]["date"], seeded[400]["date"]
+
+    response = TestClient(transactions_app).get(
+        "/transactions/summary", params={"start_date": start, "end_date": end, "category_type": "income"}
+    )
+
+    expected = [row for row in seeded if start <= row["date"] <= end]
+    assert response.json() == summarize_reference(expected, "daily", "income")
+
+
+def test_summary_payload_is_small_for_long_history(transactions_app, seed_transactions):
+    seed_transactions(20_000)
+
+    response = TestClient(transactions_app).get("/transactions/summary", params={"period": "monthly"})
+
+    assert response.json()["count"] == 20_000
+    assert len(response.content) < 1000
+
+
+def test_vectorised_grouping_outpaces_row_reductions():
+    """Benchmark: 100k rows, weekly buckets"""
+    rows = random_rows(100_000)
+
+    started = time.perf_counter()
+    summarize(rows, "weekly")
+    vectorised = time.perf_counter() - started
+
+    started = time.perf_counter()
+    summarize_reference(rows, "weekly")
+    reference = time.perf_counter() - started
+
+    assert vectorised < reference
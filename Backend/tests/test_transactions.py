@@ -0,0 +1,120 @@
+import json
+
+from fastapi.testclient import TestClient
+
+
+def fetch_all_pages(client, params):
+    rows, cursor, pages = [], None, 0
+    while True:
+        response = client.get("/transactions/", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        rows.extend(response.json())
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return rows, pages
+
+
+def test_keyset_pagination_visits_every_row_once(transactions_app, seed_transactions):
+    seeded = seed_transactions(1000)
+    client = TestClient(transactions_app)
+
+    rows, pages = fetch_all_pages(client, {"limit": 64})
+
+    assert pages == 16
+    assert [row["id"] for row in rows] == [
+        row["id"] for row in sorted(seeded, key=lambda r: (r["date"], r["id"]), reverse=True)
+    ]
+
+
+def test_other_users_rows_are_not_listed(transactions_app, seed_transactions):
+    seed_transactions(5)
+    seed_transactions(5, user_id="someone-else")
+
+    rows = TestClient(transactions_app).get("/transactions/").json()
+
+    assert len(rows) == 5
+    assert "X-Next-Cursor" not in TestClient(transactions_app).get("/transactions/").headers
+
+
+def test_projection_returns_only_requested_fields(transactions_app, seed_transactions):
+    seed_transactions(3)
+
+    rows = TestClient(transactions_app).get("/transactions/", params={"fields": "amount,type"}).json()
+
+    assert set(rows[0]) == {"amount", "type", "date", "id"}
+
+
+def test_unknown_fields_and_bad_cursors_rejected(transactions_app):
+    client = TestClient(transactions_app)
+
+    assert client.get("/transactions/", params={"fields": "amount,password"}).status_code == 400
+    assert client.get("/transactions/", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_date_and_type_filters(transactions_app, seed_transactions):
+    seeded = seed_transactions(300)
+    client = TestClient(transactions_app)
+    start, end = seeded[30]["date"], seeded[120]["date"]
+
+    rows, _ = fetch_all_pages(client, {"start_date": start, "end_date": end, "type": "income", "limit": 10})
+
+    expected = [r for r in seeded if start <= r["date"] <= end and r["type"] == "income"]
+    assert sorted(row["id"] for row in rows) == sorted(row["id"] for row in expected)
+    assert client.get("/transactions/", params={"type": "refund"}).status_code == 422
+
+
+def test_created_transactions_are_dated_and_listed(transactions_app):
+    client = TestClient(transactions_app)
+
+    created = client.post("/transactions/", json={
+        "amount": 120.5, "description": "Lunch", "category": "Food", "type": "expense"
+    }).json()
+
+    assert created["date"]
+    assert client.get(f"/transactions/{created['id']}").json()["amount"] == 120.5
+    assert client.get("/transactions/missing").status_code == 404
+
+
+def test_first_page_is_a_fraction_of_full_history(transactions_app, seed_transactions, fake_supabase):
+    """Benchmark: synthetic user with 100k transactions"""
+    seed_transactions(100_000)
+    client = TestClient(transactions_app)
+    full_history = json.dumps(fake_supabase.tables["transactions"]).encode()
+
+    response = client.get("/transactions/", params={"fields": "date,amount,type,category", "limit": 50})
+
+    assert len(response.json()) == 50
+    assert len(response.content) * 500 < len(full_history)
+
+
+def test_delete_is_one_statement_scoped_to_the_owner(transactions_app, seed_transactions, fake_supabase):
+    mine = seed_transactions(3)
+    theirs = seed_transactions(1, user_id="someone-else")
+    client = TestClient(transactions_app)
+
+    calls = fake_supabase.calls
+    response = client.delete(f"/transactions/{mine[0]['id']}")
+
+    assert response.status_code == 200
+    assert response.json()["transaction"]["id"] == mine[0]["id"]
+    # One delete plus the rollup lookup
+    assert fake_supabase.calls - calls == 2
+    assert client.delete(f"/transactions/{mine[0]['id']}").status_code == 404
+    assert client.delete(f"/transactions/{theirs[0]['id']}").status_code == 404
+    assert len(fake_supabase.tables["transactions"]) == 3
+
+
+def test_bulk_delete(transactions_app, seed_transactions, fake_supabase):
+    mine = seed_transactions(10)
+    theirs = seed_transactions(1, user_id="someone-else")
+    client = TestClient(transactions_app)
+    ids = [row["id"] for row in mine[:4]] + [theirs[0]["id"], "missing"]
+
+    calls = fake_supabase.calls
+    response = client.post("/transactions/bulk-delete", json={"ids": ids})
+
+    assert response.json() == {"deleted": ids[:4], "not_found": ids[4:]}
+    assert fake_supabase.calls - calls == 2
+    assert len(fake_supabase.tables["transactions"]) == 7
+    assert client.post("/transactions/bulk-delete", json={"ids": []}).status_code == 400
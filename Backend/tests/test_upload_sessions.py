@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from routes import uploads
+from upload_sessions import SessionNotFound, UploadSessions
+
+AUDIO = os.urandom(1_000_000)
+
+
+def start_session(client, size=len(AUDIO)):
+    response = client.post("/uploads/sessions", json={
+        "filename": "voice-note.mp3", "content_type": "audio/mpeg", "size": size
+    })
+    assert response.status_code == 201
+    return response.json()["session_id"]
+
+
+def send(client, session_id, offset, data):
+    return client.patch(f"/uploads/sessions/{session_id}", content=data, headers={"Upload-Offset": str(offset)})
+
+
+def dropped_patch(app, session_id, offset, data, chunk_size=64 * 1024):
+    """Send ``data`` as a PATCH body, then drop the connection before it ends"""
+    async def run():
+        body = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "PATCH",
+            "scheme": "http", "path": f"/uploads/sessions/{session_id}",
+            "raw_path": f"/uploads/sessions/{session_id}".encode(), "root_path": "", "query_string": b"",
+            "headers": [
+                (b"host", b"testserver"),
+                (b"upload-offset", str(offset).encode()),
+                (b"content-length", str(len(data) * 2).encode())
+            ],
+            "client": ("127.0.0.1", 1234), "server": ("testserver", 80)
+        }
+
+        async def receive():
+            if body:
+                return {"type": "http.request", "body": body.pop(0), "more_body": True}
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            pass
+
+        await app(scope, receive, send)
+
+    asyncio.run(run())
+
+
+def test_chunked_upload_round_trip(uploads_app):
+    client = TestClient(uploads_app)
+    session_id = start_session(client)
+
+    offset = 0
+    for start in range(0, len(AUDIO), 300_000):
+        response = send(client, session_id, offset, AUDIO[start:start + 300_000])
+        assert response.status_code == 200
+        offset = response.json()["offset"]
+        assert response.headers["upload-offset"] == str(offset)
+    saved = client.post(f"/uploads/sessions/{session_id}/complete").json()
+
+    assert saved["sha256"] == hashlib.sha256(AUDIO).hexdigest()
+    assert saved["size"] == len(AUDIO)
+    assert client.get(f"/uploads/files/audio/{saved['filename']}").content == AUDIO
+    assert client.get(f"/uploads/sessions/{session_id}").status_code == 404
+
+
+def test_resume_after_dropped_connections(uploads_app):
+    client = TestClient(uploads_app)
+    session_id = start_session(client)
+
+    dropped_patch(uploads_app, session_id, 0, AUDIO[:400_000])
+    first = client.get(f"/uploads/sessions/{session_id}").json()["offset"]
+    dropped_patch(uploads_app, session_id, first, AUDIO[first:first + 250_000])
+    second = client.get(f"/uploads/sessions/{session_id}").json()["offset"]
+    finished = send(client, session_id, second, AUDIO[second:])
+    saved = client.post(f"/uploads/sessions/{session_id}/complete").json()
+
+    assert (first, second) == (400_000, 650_000)
+    assert finished.json()["offset"] == len(AUDIO)
+    assert saved["sha256"] == hashlib.sha256(AUDIO).hexdigest()
+    assert uploads.upload_sessions.stats()["interrupted"] == 2
+
+
+def test_offsets_and_sizes_are_enforced(uploads_app):
+    client = TestClient(uploads_app)
+    session_id = start_session(client, size=100)
+    send(client, session_id, 0, b"x" * 40)
+
+    stale = send(client, session_id, 0, b"x" * 40)
+    early = client.post(f"/uploads/sessions/{session_id}/complete")
+    overflow = send(client, session_id, 40, b"y" * 100)
+
+    assert stale.status_code == 409
+    assert stale.headers["upload-offset"] == "40"
+    assert early.status_code == 409
+    assert overflow.status_code == 413
+    assert client.get(f"/uploads/sessions/{session_id}").json()["offset"] == 100
+    assert client.post(f"/uploads/sessions/{session_id}/complete").status_code == 200
+
+
+def test_session_creation_is_validated(uploads_app):
+    client = TestClient(uploads_app)
+
+    wrong_type = client.post("/uploads/sessions", json={"filename": "a.exe", "content_type": "application/x-msdownload", "size": 10})
+    too_large = client.post("/uploads/sessions", json={
+        "filename": "long.mp3", "content_type": "audio/mpeg", "size": 10 ** 9
+    })
+    unknown = send(client, "not-a-session", 0, b"data")
+
+    assert wrong_type.status_code == 400
+    assert too_large.status_code == 413
+    assert unknown.status_code == 404
+
+
+def test_cancel_removes_partial_data(uploads_app, tmp_path):
+    client = TestClient(uploads_app)
+    session_id = start_session(client)
+    send(client, session_id, 0, AUDIO[:1000])
+
+    assert client.delete(f"/uploads/sessions/{session_id}").status_code == 200
+    assert os.listdir(tmp_path / "sessions") == []
+
+
+def test_sessions_are_private_and_expire(tmp_path):
+    now = [1_000_000.0]
+    sessions = UploadSessions(str(tmp_path), ttl=3600, clock=lambda: now[0])
+    idle = sessions.create("alice", "idle.mp3", "audio/mpeg", 10)
+    now[0] += 1800
+    active = sessions.create("alice", "active.mp3", "audio/mpeg", 10)
+    (tmp_path / "orphan.part").write_bytes(b"left behind by a crash")
+    os.utime(tmp_path / "orphan.part", (0, 0))
+
+    with pytest.raises(SessionNotFound):
+        sessions.get("bob", active["id"])
+    now[0] += 1801
+
+    with pytest.raises(SessionNotFound):
+        sessions.get("alice", idle["id"])
+    assert sessions.collect_expired() == 1
+    assert sorted(os.listdir(tmp_path)) == sorted([f"{active['id']}.json", f"{active['id']}.part"])
+    assert sessions.get("alice", active["id"])["offset"] == 0
@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+
+from blob_store import BlobStore
+from config import settings
+from routes import uploads
+
+IMAGE = os.path.join(os.path.dirname(__file__), "test_files", "test_image.jpg")
+
+
+def stored_blobs(root):
+    return [name for _, _, files in os.walk(root / "blobs") for name in files]
+
+
+def upload_image(client, content, name="receipt.jpg"):
+    return client.post("/uploads/image", files={"file": (name, content, "image/jpeg")})
+
+
+def test_image_round_trip(uploads_app, test_user):
+    with open(IMAGE, "rb") as f:
+        content = f.read()
+    client = TestClient(uploads_app)
+
+    response = upload_image(client, content)
+
+    assert response.status_code == 200
+    filename = response.json()["filename"]
+    assert filename.startswith(f"{test_user['id']}_")
+    assert client.get(f"/uploads/files/images/{filename}").content == content
+
+
+def test_duplicate_uploads_share_one_blob(uploads_app, tmp_path, monkeypatch):
+    client = TestClient(uploads_app)
+    content = os.urandom(100_000)
+
+    first = upload_image(client, content, "receipt.jpg").json()
+    second = upload_image(client, content, "receipt-again.jpg").json()
+
+    assert first["sha256"] == second["sha256"]
+    assert (first["duplicate"], second["duplicate"]) == (False, True)
+    sha = first["sha256"]
+    assert stored_blobs(tmp_path) == [sha]
+    assert (tmp_path / "blobs" / sha[:2] / sha[2:4] / sha).exists()
+    for saved in (first, second):
+        response = client.get(f"/uploads/files/images/{saved['filename']}")
+        assert response.content == content
+        assert response.headers["content-type"] == "image/jpeg"
+
+
+def test_index_is_per_user(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"), str(tmp_path / "index.db"))
+    store.put("alice", "alice_receipt.jpg", io.BytesIO(b"receipt"), "images", "image/jpeg")
+
+    assert store.lookup("alice", "alice_receipt.jpg")["size"] == 7
+    assert store.lookup("bob", "alice_receipt.jpg") is None
+
+
+def test_index_is_shared_between_processes(tmp_path):
+    workers = [BlobStore(str(tmp_path / "blobs"), str(tmp_path / "index.db")) for _ in range(4)]
+
+    def upload(i):
+        workers[i % 4].put("alice", f"alice_{i}.jpg", io.BytesIO(str(i).encode()), "images", "image/jpeg")
+
+    threads = [threading.Thread(target=upload, args=(i,)) for i in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    workers[1].update("alice", "alice_7.jpg", width=640, height=480)
+
+    assert all(workers[0].lookup("alice", f"alice_{i}.jpg") for i in range(40))
+    assert workers[2].lookup("alice", "alice_7.jpg")["width"] == 640
+
+
+def test_json_indexes_are_imported(tmp_path):
+    user = "6f1c2d3e-0000-4000-8000-000000000001"
+    (tmp_path / "index").mkdir()
+    legacy = tmp_path / "index" / f"{hashlib.sha256(user.encode()).hexdigest()[:32]}.json"
+    legacy.write_text(json.dumps({f"{user}_20240101_000000_receipt.jpg": {"sha256": "ab" * 32, "size": 3}}))
+
+    store = BlobStore(str(tmp_path / "blobs"), str(tmp_path / "index.db"))
+
+    assert store.lookup(user, f"{user}_20240101_000000_receipt.jpg")["size"] == 3
+    assert not legacy.exists()
+
+
+def test_legacy_flat_uploads_are_still_served(uploads_app, tmp_path, test_user):
+    name = f"{test_user['id']}_20240101_000000_old.jpg"
+    (tmp_path / "images").mkdir()
+    (tmp_path / "images" / name).write_bytes(b"legacy")
+
+    response = TestClient(uploads_app).get(f"/uploads/files/images/{name}")
+
+    assert response.content == b"legacy"
+
+
+def test_invalid_type_is_a_client_error(uploads_app):
+    response = TestClient(uploads_app).post(
+        "/uploads/image", files={"file": ("notes.txt", b"hello", "text/plain")}
+    )
+
+    assert response.status_code == 400
+
+
+def test_oversized_file_is_rejected_and_removed(uploads_app, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_UPLOAD_SIZE", 256 * 1024)
+
+    response = upload_image(TestClient(uploads_app), b"x" * (256 * 1024 + 1))
+
+    assert response.status_code == 413
+    assert stored_blobs(tmp_path) == []
+
+
+def test_oversized_request_is_rejected_before_reading(uploads_app, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_UPLOAD_SIZE", 256 * 1024)
+
+    response = upload_image(TestClient(uploads_app), b"x" * (1024 * 1024))
+
+    assert response.status_code == 413
+    assert stored_blobs(tmp_path) == []
+
+
+def test_concurrent_saves_memory_and_loop_stalls(tmp_path, monkeypatch):
+    """Benchmark: 16 concurrent 4MB receipt images saved from spooled uploads"""
+    monkeypatch.setattr(uploads, "blob_store", BlobStore(str(tmp_path / "blobs"), str(tmp_path / "index.db")))
+    count, size = 16, 4 * 1024 * 1024
+    files = []
+    for i in range(count):
+        spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        spooled.write(os.urandom(size))
+        spooled.seek(0)
+        files.append(UploadFile(spooled, filename=f"receipt-{i}.jpg"))
+
+    async def run():
+        stalls = []
+
+        async def tick():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0)
+                stalls.append(time.perf_counter() - started)
+
+        async def timed_save(upload):
+            started = time.perf_counter()
+            await uploads.save_upload_file(upload, "image", "user")
+            return time.perf_counter() - started
+
+        ticker = asyncio.ensure_future(tick())
+        await asyncio.sleep(0)
+        tracemalloc.start()
+        latencies = await asyncio.gather(*(timed_save(upload) for upload in files))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        ticker.cancel()
+        return sorted(latencies), peak, max(stalls)
+
+    latencies, peak, stall = asyncio.run(run())
+
+    assert len(stored_blobs(tmp_path)) == count
+    # Buffering even one whole file would exceed this
+    assert peak < size
+    assert stall < 0.25
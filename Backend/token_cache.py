@@ -0,0 +1,66 @@
+"""Cache of already verified bearer tokens."""
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+
+class VerifiedTokenCache:
+    """Size-bounded LRU of decoded token claims, kept until the token expires.
+
+    Entries are keyed by the SHA-256 of the token, so raw credentials are
+    not held in memory. Only tokens that passed verification are stored;
+    invalid ones are checked again every time.
+    """
+
+    def __init__(self, max_entries: int = 10000, clock: Callable[[], float] = time.time):
+        self.max_entries = max_entries
+        self._clock = clock
+        # token hash -> (claims, expiry as a Unix timestamp)
+        self._entries: "OrderedDict[bytes, Tuple[Any, float]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Any]:
+        """The cached claims for ``token``, or None if unknown or expired"""
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self._clock() < entry[1]:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[0]
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, token: str, claims: Any, expires_at: float) -> None:
+        """Remember verified ``claims`` until ``expires_at``"""
+        if self.max_entries <= 0 or expires_at <= self._clock():
+            return
+        key = self._key(token)
+        self._entries[key] = (claims, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0
+        }
@@ -0,0 +1,279 @@
+"""Resumable upload sessions, kept on disk until they are completed."""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Callable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Received bytes are written out once this much is buffered
+FLUSH_SIZE = 256 * 1024
+
+
+class SessionNotFound(Exception):
+    """No live session with this id belongs to the user"""
+
+
+class SessionBusy(Exception):
+    """Another request is already appending to the session"""
+
+
+class OffsetMismatch(Exception):
+    """The client's offset differs from what the server has stored"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class SessionOverflow(Exception):
+    """More bytes were sent than the session declared"""
+
+
+class UploadSessions:
+    """Upload sessions whose partial data survives dropped connections.
+
+    Each session is a ``<id>.json`` description and a ``<id>.part`` file
+    under ``root``. The part file's length is the session's offset, so
+    whatever reached the disk before a connection dropped counts and the
+    client resumes from there. Sessions untouched for ``ttl`` seconds are
+    removed by ``collect_expired``.
+    """
+
+    def __init__(self, root: str, ttl: float = 24 * 3600, clock: Callable[[], float] = time.time):
+        self.root = root
+        self.ttl = ttl
+        self._clock = clock
+        self._busy: Set[str] = set()
+        self._busy_guard = threading.Lock()
+        self._collector: Optional[asyncio.Task] = None
+
+        self.created = 0
+        self.completed = 0
+        self.expired = 0
+        self.interrupted = 0
+
+    def _meta_path(self, session_id: str) -> str:
+        return os.path.join(self.root, f"{session_id}.json")
+
+    def data_path(self, session_id: str) -> str:
+        return os.path.join(self.root, f"{session_id}.part")
+
+    def _save(self, session: dict) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(session, f)
+        os.replace(tmp, self._meta_path(session["id"]))
+
+    def _describe(self, session: dict) -> dict:
+        return {
+            **session,
+            "offset": os.path.getsize(self.data_path(session["id"])),
+            "expires_at": session["updated_at"] + self.ttl
+        }
+
+    def create(self, user_id: str, filename: str, content_type: str, size: int) -> dict:
+        """Start an empty session for a file of ``size`` bytes"""
+        os.makedirs(self.root, exist_ok=True)
+        now = self._clock()
+        session = {
+            "id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "filename": filename,
+            "content_type": content_type,
+            "size": size,
+            "created_at": now,
+            "updated_at": now
+        }
+        open(self.data_path(session["id"]), "wb").close()
+        self._save(session)
+        self.created += 1
+        return self._describe(session)
+
+    def get(self, user_id: str, session_id: str) -> dict:
+        """The session with its current offset
+
+        Raises:
+            SessionNotFound: Unknown, expired, or owned by another user
+        """
+        try:
+            with open(self._meta_path(os.path.basename(session_id))) as f:
+                session = json.load(f)
+            described = self._describe(session)
+        except (FileNotFoundError, ValueError):
+            raise SessionNotFound(session_id)
+        if session["user_id"] != user_id or described["expires_at"] <= self._clock():
+            raise SessionNotFound(session_id)
+        return described
+
+    def _claim(self, session_id: str) -> None:
+        with self._busy_guard:
+            if session_id in self._busy:
+                raise SessionBusy(session_id)
+            self._busy.add(session_id)
+
+    def _release(self, session_id: str) -> None:
+        with self._busy_guard:
+            self._busy.discard(session_id)
+
+    async def append(self, user_id: str, session_id: str, offset: int, chunks: AsyncIterator[bytes]) -> dict:
+        """Write ``chunks`` at ``offset``, which must be the stored offset.
+
+        Data is flushed as it arrives; if ``chunks`` fails part way, for
+        instance because the client went away, everything received so far
+        is kept and the error is re-raised.
+
+        Raises:
+            SessionNotFound, SessionBusy, OffsetMismatch
+            SessionOverflow: The chunk runs past the declared size; the
+                excess is discarded
+        """
+        session = await asyncio.to_thread(self.get, user_id, session_id)
+        self._claim(session["id"])
+        try:
+            # Re-read under the claim: a previous append may just have finished
+            session = await asyncio.to_thread(self.get, user_id, session_id)
+            if offset != session["offset"]:
+                raise OffsetMismatch(session["offset"])
+
+            remaining = session["size"] - offset
+            out = await asyncio.to_thread(open, self.data_path(session["id"]), "ab")
+            buffer = bytearray()
+            try:
+                async for chunk in chunks:
+                    if len(chunk) > remaining:
+                        buffer += chunk[:remaining]
+                        raise SessionOverflow(f"Upload is limited to {session['size']} bytes")
+                    buffer += chunk
+                    remaining -= len(chunk)
+                    if len(buffer) >= FLUSH_SIZE:
+                        await asyncio.to_thread(out.write, bytes(buffer))
+                        buffer.clear()
+            except (SessionOverflow, asyncio.CancelledError):
+                raise
+            except Exception:
+                self.interrupted += 1
+                raise
+            finally:
+                await asyncio.to_thread(self._close, out, bytes(buffer))
+                session["updated_at"] = self._clock()
+                await asyncio.to_thread(self._save, self._stored(session))
+        finally:
+            self._release(session["id"])
+        return await asyncio.to_thread(self.get, user_id, session_id)
+
+    @staticmethod
+    def _close(out, tail: bytes) -> None:
+        with out:
+            out.write(tail)
+            out.flush()
+            os.fsync(out.fileno())
+
+    @staticmethod
+    def _stored(session: dict) -> dict:
+        return {key: value for key, value in session.items() if key not in ("offset", "expires_at")}
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def discard(self, session_id: str) -> None:
+        """Delete a session and its partial data"""
+        for path in (self._meta_path(session_id), self.data_path(session_id)):
+            self._remove(path)
+
+    def complete(self, user_id: str, session_id: str, store: Callable[[str, dict], dict]) -> dict:
+        """Hand a fully received session to ``store`` and remove it.
+
+        ``store`` gets the part file's path and the session; blocking, so
+        call from a worker thread.
+
+        Raises:
+            SessionNotFound, SessionBusy
+            OffsetMismatch: Not all bytes have arrived yet
+        """
+        session = self.get(user_id, session_id)
+        self._claim(session["id"])
+        try:
+            session = self.get(user_id, session_id)
+            if session["offset"] != session["size"]:
+                raise OffsetMismatch(session["offset"])
+            result = store(self.data_path(session["id"]), session)
+            self.discard(session["id"])
+        finally:
+            self._release(session["id"])
+        self.completed += 1
+        return result
+
+    def collect_expired(self) -> int:
+        """Remove sessions idle for longer than ``ttl``; returns how many"""
+        if not os.path.isdir(self.root):
+            return 0
+        cutoff = self._clock() - self.ttl
+        removed = 0
+        for name in os.listdir(self.root):
+            session_id, ext = os.path.splitext(name)
+            path = os.path.join(self.root, name)
+            if ext == ".json":
+                try:
+                    with open(path) as f:
+                        updated_at = json.load(f)["updated_at"]
+                except (FileNotFoundError, ValueError, KeyError):
+                    updated_at = os.path.getmtime(path) if os.path.exists(path) else 0
+            elif ext in (".part", ".tmp") and not os.path.exists(self._meta_path(session_id)):
+                # Orphans left by a crash between writes, or already discarded above
+                try:
+                    updated_at = os.path.getmtime(path)
+                except FileNotFoundError:
+                    continue
+            else:
+                continue
+            if updated_at < cutoff and session_id not in self._busy:
+                if ext == ".json":
+                    self.discard(session_id)
+                    removed += 1
+                else:
+                    self._remove(path)
+        self.expired += removed
+        return removed
+
+    def start(self, interval: float = 3600.0) -> None:
+        """Collect expired sessions periodically in the background"""
+        if self._collector and not self._collector.done():
+            return
+
+        async def run():
+            while True:
+                try:
+                    removed = await asyncio.to_thread(self.collect_expired)
+                    if removed:
+                        logger.info("Removed %d expired upload sessions", removed)
+                except Exception as e:
+                    logger.error(f"Upload session cleanup failed: {str(e)}")
+                await asyncio.sleep(interval)
+
+        self._collector = asyncio.ensure_future(run())
+
+    def stop(self) -> None:
+        """Cancel the background cleanup task"""
+        if self._collector:
+            self._collector.cancel()
+            self._collector = None
+
+    def stats(self) -> dict:
+        return {
+            "appending": len(self._busy),
+            "created": self.created,
+            "completed": self.completed,
+            "expired": self.expired,
+            "interrupted": self.interrupted
+        }
@@ -0,0 +1,227 @@
+"""Writes held on local disk while the database is unreachable."""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds a replaying process may hold the head of the queue before another
+# process assumes it died and takes over
+CLAIM_TIMEOUT = 60.0
+
+# Seconds after which a process that saw the queue empty looks again, to
+# pick up writes queued by a process that has since exited
+RECHECK_INTERVAL = 30.0
+
+# Failed replays, not counting outages, after which a write is set aside
+MAX_ATTEMPTS = 5
+
+PENDING = 0
+DEAD = 2
+
+
+class WriteQueue:
+    """Durable queue of writes to replay once the database is back.
+
+    Entries are rows in a SQLite database in WAL mode at ``path``, so
+    queued writes survive a restart and every worker process on the host
+    shares one queue. ``replay`` applies them in order and deletes each
+    one only after it was applied. The entry being applied is claimed,
+    so two processes never replay the same write at once; a crash
+    mid-replay repeats the entry in flight, so replayed writes must be
+    idempotent. A write that keeps failing for a reason other than an
+    outage is moved to a dead-letter state after ``MAX_ATTEMPTS`` replays,
+    so it stops holding back the writes behind it.
+
+    Disk work runs in worker threads so it never blocks the event loop.
+    ``maybe_pending`` lets callers skip the queue without touching disk once
+    this process has seen it empty; writes queued by other processes are
+    replayed by them, or by this process after a restart.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._lock: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Lock]] = None
+        self._owner = uuid.uuid4().hex
+        # Unknown until the first replay: a previous run may have left writes
+        self._pending = True
+        self._checked_at = 0.0
+
+        self.queued = 0
+        self.replayed = 0
+        self.replay_failures = 0
+        self.dead = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Queued writes must outlive power loss, not just a crashed process
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS writes ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " entry TEXT NOT NULL,"
+                " queued_at REAL NOT NULL,"
+                " claimed_by TEXT,"
+                " claimed_at REAL,"
+                " state INTEGER NOT NULL DEFAULT 0,"
+                " attempts INTEGER NOT NULL DEFAULT 0)"
+            )
+            # Queues created before dead-lettering lack the newer columns
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(writes)")}
+            for column in ("state", "attempts"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE writes ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+            self._conn = conn
+        return self._conn
+
+    def __len__(self) -> int:
+        with self._db_lock:
+            return self._connect().execute("SELECT COUNT(*) FROM writes WHERE state = ?", (PENDING,)).fetchone()[0]
+
+    @property
+    def maybe_pending(self) -> bool:
+        """False only if the queue was seen empty recently; never touches disk"""
+        return self._pending or time.monotonic() - self._checked_at > RECHECK_INTERVAL
+
+    def entries(self, dead: bool = False) -> List[dict]:
+        """Queued writes, oldest first; ``dead`` lists those set aside instead"""
+        with self._db_lock:
+            rows = self._connect().execute(
+                "SELECT entry FROM writes WHERE state = ? ORDER BY seq", (DEAD if dead else PENDING,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _insert(self, entry: dict) -> None:
+        with self._db_lock:
+            self._connect().execute(
+                "INSERT INTO writes (entry, queued_at) VALUES (?, ?)", (json.dumps(entry), entry["queued_at"])
+            )
+
+    async def append(self, entry: Dict) -> dict:
+        """Queue a write; returns the entry with its ID and queue time"""
+        entry = {"id": uuid.uuid4().hex, "queued_at": time.time(), **entry}
+        await asyncio.to_thread(self._insert, entry)
+        self._pending = True
+        self.queued += 1
+        return entry
+
+    def _claim(self) -> Optional[Tuple[int, dict]]:
+        """Claim the oldest write, or None if another process holds it
+
+        Clears ``maybe_pending`` when the queue is empty.
+        """
+        with self._db_lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT seq, entry, claimed_by, claimed_at FROM writes WHERE state = ? ORDER BY seq LIMIT 1",
+                    (PENDING,)
+                ).fetchone()
+                if row is None:
+                    self._pending = False
+                    self._checked_at = time.monotonic()
+                    claimed = None
+                elif row[2] not in (None, self._owner) and time.time() - row[3] < CLAIM_TIMEOUT:
+                    # Replayed elsewhere; applying later writes first would reorder them
+                    claimed = None
+                else:
+                    conn.execute(
+                        "UPDATE writes SET claimed_by = ?, claimed_at = ? WHERE seq = ?",
+                        (self._owner, time.time(), row[0])
+                    )
+                    claimed = row[0], json.loads(row[1])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def _finish(self, seq: int) -> None:
+        with self._db_lock:
+            self._connect().execute("DELETE FROM writes WHERE seq = ?", (seq,))
+
+    def _release(self, seq: int, failed: bool) -> bool:
+        """Put a claimed write back; returns True if it was dead-lettered"""
+        with self._db_lock:
+            conn = self._connect()
+            conn.execute(
+                "UPDATE writes SET claimed_by = NULL, claimed_at = NULL, attempts = attempts + ? WHERE seq = ?",
+                (int(failed), seq)
+            )
+            cursor = conn.execute(
+                "UPDATE writes SET state = ? WHERE seq = ? AND attempts >= ?", (DEAD, seq, MAX_ATTEMPTS)
+            )
+        return cursor.rowcount > 0
+
+    def _replay_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock[0] is not loop:
+            self._lock = (loop, asyncio.Lock())
+        return self._lock[1]
+
+    async def replay(
+        self,
+        apply: Callable[[dict], Awaitable[None]],
+        transient: Callable[[Exception], bool] = lambda e: False
+    ) -> int:
+        """Apply queued writes in order, stopping at the first that fails
+
+        Returns the number applied; the failed write and those after it
+        stay queued and the error is raised. Failures ``transient`` accepts
+        (outages) don't count towards ``MAX_ATTEMPTS``; a write that runs
+        out of attempts is dead-lettered and replay moves on.
+        """
+        applied = 0
+        async with self._replay_lock():
+            while True:
+                claimed = await asyncio.to_thread(self._claim)
+                if claimed is None:
+                    break
+                seq, entry = claimed
+                try:
+                    await apply(entry)
+                except Exception as e:
+                    self.replay_failures += 1
+                    if not await asyncio.to_thread(self._release, seq, not transient(e)):
+                        raise
+                    self.dead += 1
+                    logger.error(f"Giving up on queued write {entry['id']} after {MAX_ATTEMPTS} attempts: {str(e)}")
+                    continue
+                await asyncio.to_thread(self._finish, seq)
+                self.replayed += 1
+                applied += 1
+        if applied:
+            logger.info(f"Replayed {applied} queued writes")
+        return applied
+
+    def stats(self) -> dict:
+        with self._db_lock:
+            conn = self._connect()
+            pending, oldest = conn.execute(
+                "SELECT COUNT(*), MIN(queued_at) FROM writes WHERE state = ?", (PENDING,)
+            ).fetchone()
+            dead = conn.execute("SELECT COUNT(*) FROM writes WHERE state = ?", (DEAD,)).fetchone()[0]
+        return {
+            "pending": pending,
+            "dead": dead,
+            "oldest_age_s": round(time.time() - oldest, 1) if oldest is not None else 0.0,
+            "queued": self.queued,
+            "replayed": self.replayed,
+            "replay_failures": self.replay_failures,
+            "dead_lettered": self.dead
+        }